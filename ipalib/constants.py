@@ -123,6 +123,32 @@ DEFAULT_CONFIG = (
     # WebUI stuff:
     ('webui_prod', True),
 
+    # LDAP backend:
+
+    # Seconds the IPA configuration entry is cached between requests.
+    ('ipa_config_cache_ttl', 60),
+
+    # Maximum number of threads executing a parallel batch request.
+    ('batch_workers', 4),
+
+    # Maximum number of idle LDAP connections kept by a server process,
+    # 0 disables the connection pool.
+    ('ldap_pool_size', 10),
+    # Seconds after which an idle pooled LDAP connection is closed.
+    ('ldap_pool_idle_timeout', 60),
+    # Number of entries requested per page by paged LDAP searches,
+    # 0 disables paging.
+    ('ldap_page_size', 1000),
+
+    # Validate the output of 1 in this many calls of each command, 1
+    # validates every call and 0 disables output validation. Unless every
+    # call is validated, violations are logged and counted instead of raised.
+    ('output_validation_sample', 1),
+
+    # Log 1 in this many successful calls of each command for auditing, 0
+    # disables it. Can be set per command as audit_log_sample_<command name>.
+    ('audit_log_sample', 1),
+
     # Session stuff:
 
     # Maximum time before a session expires forcing credentials to be reacquired.
@@ -153,6 +179,12 @@ DEFAULT_CONFIG = (
     ('interactive', True),
     ('fallback', True),
     ('delegate', False),
+    # Cache the servers found in DNS and the last one which answered in
+    # ~/.ipa/servers.cache for as long as the SRV records may be cached.
+    ('discovery_cache', True),
+    # Seconds to wait for one of several servers to accept a connection when
+    # choosing the server to use, 0 tries them one after another instead.
+    ('server_probe_timeout', 5),
 
     # Enable certain optional plugins:
     ('enable_ra', False),
@@ -23,6 +23,9 @@ Base classes for all front-end plugins.
 
 import re
 import inspect
+import logging
+import threading
+import itertools
 from base import lock, check_name, NameSpace
 from plugable import Plugin, is_production_mode
 from parameters import create_param, parse_param_spec, Param, Str, Flag, Password
@@ -365,6 +368,23 @@ class HasParam(Plugin):
         setattr(self, name, namespace)
 
 
+class _CallRepr(object):
+    """
+    Format the params of a command call when converted to a string.
+
+    This defers the work to when a log record is actually emitted.
+    """
+
+    __slots__ = ('command', 'params')
+
+    def __init__(self, command, params):
+        self.command = command
+        self.params = params
+
+    def __str__(self):
+        return ', '.join(self.command._repr_iter(**self.params))
+
+
 class Command(HasParam):
     """
     A public IPA atomic operation.
@@ -397,10 +417,12 @@ class Command(HasParam):
     options = Plugin.finalize_attr('options')
     params = Plugin.finalize_attr('params')
     params_by_default = Plugin.finalize_attr('params_by_default')
+    _process_params = Plugin.finalize_attr('_process_params')
     obj = None
 
     use_output_validation = True
     output = Plugin.finalize_attr('output')
+    output_validation_stats = Plugin.finalize_attr('output_validation_stats')
     has_output = ('result',)
     output_params = Plugin.finalize_attr('output_params')
     has_output_params = tuple()
@@ -419,18 +441,22 @@ class Command(HasParam):
         """
         self.ensure_finalized()
         params = self.args_options_2_params(*args, **options)
-        self.debug(
-            'raw: %s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
-        params.update(self.get_default(**params))
-        params = self.normalize(**params)
-        params = self.convert(**params)
-        self.debug(
-            '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
-        if not self.api.env.in_server and 'version' not in params:
-            params['version'] = API_VERSION
-        self.validate(**params)
+        return self.__call_params(params)
+
+    def call_with_params(self, params):
+        """
+        Perform validation and then execute the command with ``params``.
+
+        ``params`` are the merged args and options as returned by
+        `Command.args_options_2_params`, so that a caller which needs them
+        (for example for `Command.log_call`) does not have to merge them
+        twice. ``params`` is not modified.
+        """
+        self.ensure_finalized()
+        return self.__call_params(dict(params))
+
+    def __call_params(self, params):
+        params = self._process_params(params)
         (args, options) = self.params_2_args_options(**params)
         ret = self.run(*args, **options)
         if (
@@ -443,9 +469,128 @@ class Command(HasParam):
             else:
                 ret['summary'] = None
         if self.use_output_validation and (self.output or ret is not None):
-            self.validate_output(ret)
+            self.__validate_output_sampled(ret)
         return ret
 
+    def __validate_output_sampled(self, output):
+        """
+        Validate ``output`` for 1 in ``env.output_validation_sample`` calls.
+
+        When every call is validated, a violation raises an exception like
+        `Command.validate_output` does. Otherwise it is logged and counted in
+        ``output_validation_stats``, as the output has already been produced.
+        """
+        sample = self.api.env.output_validation_sample
+        if sample == 1:
+            self.validate_output(output)
+            return
+        if sample < 1:
+            return
+        stats = self.output_validation_stats
+        with self.__output_validation_lock:
+            stats['calls'] += 1
+            if stats['calls'] % sample:
+                return
+            stats['validated'] += 1
+        try:
+            self.validate_output(output)
+        except (TypeError, ValueError), e:
+            with self.__output_validation_lock:
+                stats['violations'] += 1
+            self.error('output validation failed: %s', e)
+
+    def __process_params_generic(self, params):
+        """
+        Fill in defaults, normalize, convert and validate ``params``.
+        """
+        self.debug(
+            'raw: %s(%s)', self.name, ', '.join(self._repr_iter(**params))
+        )
+        params.update(self.get_default(**params))
+        params = self.normalize(**params)
+        params = self.convert(**params)
+        self.debug(
+            '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
+        )
+        if not self.api.env.in_server and 'version' not in params:
+            params['version'] = API_VERSION
+        self.validate(**params)
+        return params
+
+    def __compile_process_params(self):
+        """
+        Return a function doing what `Command.__process_params_generic` does,
+        specialised for the params of this command.
+
+        Which params may get a default, need normalizing or must be validated
+        when missing is worked out once here rather than on every call, and
+        the other params are skipped by these steps. If a subclass overrides
+        any of the steps, the generic version is used.
+        """
+        for name in ('get_default', 'normalize', 'convert', 'validate'):
+            method = getattr(type(self), name)
+            if method.im_func is not getattr(Command, name).im_func:
+                return self.__process_params_generic
+
+        params_map = self.params.__todict__()
+        # get_default() only returns something for these:
+        defaults = tuple(
+            p.name for p in self.params()   #pylint: disable=E1102
+            if (p.required or p.autofill)
+            and (p.default is not None or p.default_from is not None)
+        )
+        # normalize() returns the value unchanged for the others:
+        normalized = frozenset(
+            p.name for p in self.params()   #pylint: disable=E1102
+            if p.multivalue or p.normalizer is not None
+            or type(p)._normalize_scalar.im_func is not
+                Param._normalize_scalar.im_func
+        )
+        # validate() only raises for a missing value if it is required:
+        validated = tuple(
+            (p, p.required) for p in self.params()  #pylint: disable=E1102
+        )
+        log = self.log
+
+        def get_kw(**kw):
+            return kw
+
+        def process_params(params):
+            if log.isEnabledFor(logging.DEBUG):
+                self.debug('raw: %s(%s)',
+                    self.name, ', '.join(self._repr_iter(**params))
+                )
+            missing = [name for name in defaults if name not in params]
+            if missing:
+                params.update(self.__get_default_iter(missing, dict(params)))
+            # Pass the values through a keyword argument dict the way
+            # normalize() and convert() get them, so that if more than one
+            # value is invalid, the error is raised for the same one.
+            kw = get_kw(**params)
+            params = dict(
+                (k, params_map[k].normalize(v) if k in normalized else v)
+                for (k, v) in kw.iteritems()
+            )
+            kw = get_kw(**params)
+            params = dict(
+                (k, params_map[k].convert(v)) for (k, v) in kw.iteritems()
+            )
+            if log.isEnabledFor(logging.DEBUG):
+                self.debug('%s(%s)',
+                    self.name, ', '.join(self._repr_iter(**params))
+                )
+            if not self.api.env.in_server and 'version' not in params:
+                params['version'] = API_VERSION
+            context = self.env.context
+            for (param, required) in validated:
+                if param.name in params:
+                    param.validate(params[param.name], context, supplied=True)
+                elif required:
+                    param.validate(None, context, supplied=False)
+            return params
+
+        return process_params
+
     def soft_validate(self, values):
         errors = dict()
         for p in self.params():
@@ -459,6 +604,41 @@ class Command(HasParam):
             errors=errors,
         )
 
+    def log_call(self, log, principal, params, error=None, prefix=''):
+        """
+        Log a call of this command with ``params`` to ``log`` for auditing.
+
+        A failed call is always logged. A successful call is logged for 1 in
+        ``env.audit_log_sample_<command name>`` calls, or if that is not set,
+        for 1 in ``env.audit_log_sample`` calls; 0 disables logging successful
+        calls.
+
+        The params are only formatted if a handler emits the record.
+
+        :param log: The logger to log to at info level.
+        :param principal: The principal who called the command.
+        :param params: The params as returned by
+            `Command.args_options_2_params`.
+        :param error: The exception raised by the call, if any.
+        :param prefix: A string to log in front of the command name.
+        """
+        if not log.isEnabledFor(logging.INFO):
+            return
+        if error is None:
+            env = self.api.env
+            sample = getattr(
+                env, 'audit_log_sample_%s' % self.name, env.audit_log_sample
+            )
+            if sample != 1:
+                if sample < 1 or self.__audit_calls.next() % sample:
+                    return
+            status = 'SUCCESS'
+        else:
+            status = error.__class__.__name__
+        log.info('%s: %s%s(%s): %s',
+            principal, prefix, self.name, _CallRepr(self, params), status
+        )
+
     def _repr_iter(self, **params):
         """
         Iterate through ``repr()`` of *safe* values of args and options.
@@ -816,6 +996,10 @@ class Command(HasParam):
         self.params_by_default = NameSpace(params, sort=False)
         self.output = NameSpace(self._iter_output(), sort=False)
         self._create_param_namespace('output_params')
+        self._process_params = self.__compile_process_params()
+        self.output_validation_stats = dict(calls=0, validated=0, violations=0)
+        self.__audit_calls = itertools.count(1)
+        self.__output_validation_lock = threading.Lock()
         super(Command, self)._on_finalize()
 
     def _iter_output(self):
@@ -1156,8 +1340,18 @@ class Object(HasParam):
         if name not in self.api:
             return
         namespace = self.api[name]
-        assert type(namespace) is NameSpace
-        for plugin in namespace(): # Equivalent to dict.itervalues()
+        assert isinstance(namespace, NameSpace)
+        # Match the names first so that lazily loaded plugins of other
+        # objects are not loaded:
+        prefix = self.name + '_'
+        for plugin_name in namespace:
+            if not plugin_name.startswith(prefix):
+                continue
+            try:
+                plugin = namespace[plugin_name]
+            except KeyError:
+                # A lazily loaded plugin which is no longer registered
+                continue
             if plugin.obj_name == self.name:
                 yield plugin
 
@@ -33,6 +33,8 @@ import os
 from os import path
 import subprocess
 import optparse
+import hashlib
+import json
 import errors
 from config import Env
 import util
@@ -167,6 +169,114 @@ class MagicDict(DictProxy):
             raise AttributeError('no magic attribute %r' % name)
 
 
+class LazyNameSpace(NameSpace):
+    """
+    A `NameSpace` whose members are created when they are first accessed.
+
+    For example:
+
+    >>> class my_member(object):
+    ...     def __init__(self, name):
+    ...         self.name = name
+    ...
+    >>> namespace = LazyNameSpace(['two', 'one'], my_member)
+    >>> list(namespace)
+    ['one', 'two']
+    >>> namespace.two.name
+    'two'
+
+    ``loader`` is called with a member name and must return the member.
+    If it raises KeyError, the member no longer exists and is dropped from
+    the namespace. Testing whether a member exists loads it. Iterating
+    through the members (by calling the instance) loads all of them.
+    """
+
+    def __init__(self, names, loader):
+        """
+        :param names: An iterable providing the member names.
+        :param loader: A callable returning the member for a name.
+        """
+        self.__names = sorted(names)
+        self.__set = set(self.__names)
+        self.__loader = loader
+        lock(self)
+
+    def __load(self, name):
+        try:
+            return self.__loader(name)
+        except KeyError:
+            self.__set.discard(name)
+            try:
+                self.__names.remove(name)
+            except ValueError:
+                pass
+            raise KeyError(name)
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __iter__(self):
+        for name in tuple(self.__names):
+            yield name
+
+    def __call__(self):
+        for name in tuple(self.__names):
+            try:
+                member = self.__load(name)
+            except KeyError:
+                continue
+            yield member
+
+    def __contains__(self, name):
+        # Load the member, so that a member which no longer exists is not
+        # reported:
+        if name not in self.__set:
+            return False
+        try:
+            self.__load(name)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            if key not in self.__set:
+                raise KeyError(key)
+            return self.__load(key)
+        if type(key) is int:
+            return self.__load(self.__names[key])
+        if type(key) is slice:
+            return tuple(self.__load(name) for name in self.__names[key])
+        raise TypeError(
+            TYPE_ERROR % ('key', (str, int, slice), key, type(key))
+        )
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.__set:
+            raise AttributeError(name)
+        try:
+            return self.__load(name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        cnt = len(self)
+        if cnt == 1:
+            m = 'member'
+        else:
+            m = 'members'
+        return '%s(<%d %s>, sort=True)' % (self.__class__.__name__, cnt, m)
+
+    def __todict__(self):
+        members = {}
+        for name in tuple(self.__names):
+            try:
+                members[name] = self.__load(name)
+            except KeyError:
+                pass
+        return members
+
+
 class Plugin(ReadOnly):
     """
     Base class for all plugins.
@@ -433,6 +543,8 @@ class API(DictProxy):
     Dynamic API object through which `Plugin` instances are accessed.
     """
 
+    __manifest = None
+
     def __init__(self, *allowed):
         self.__d = dict()
         self.__done = set()
@@ -584,27 +696,54 @@ class API(DictProxy):
         self.bootstrap(**overrides)
         return (options, args)
 
-    def load_plugins(self):
+    def load_plugins(self, packages=None):
         """
-        Load plugins from all standard locations.
+        Load plugins from all standard locations, or from the ``plugins``
+        sub-package of each of ``packages``.
 
         `API.bootstrap` will automatically be called if it hasn't been
         already.
+
+        When plugins are finalized on demand and a valid plugin manifest
+        exists, no plugin module is imported here; each module is imported
+        when one of its plugins is first accessed. Only the modules which
+        were skipped when the manifest was generated are imported, as they
+        may register plugins now.
         """
         self.__doing('load_plugins')
         self.__do_if_not_done('bootstrap')
         if self.env.mode in ('dummy', 'unit_test'):
             return
-        self.import_plugins('ipalib')
-        if self.env.context in ('server', 'lite'):
-            self.import_plugins('ipaserver')
-        if self.env.context in ('installer', 'updates'):
-            self.import_plugins('ipaserver/install/plugins')
+        if packages is None:
+            packages = ['ipalib']
+            if self.env.context in ('server', 'lite'):
+                packages.append('ipaserver')
+            if self.env.context in ('installer', 'updates'):
+                packages.append('ipaserver/install/plugins')
+        if self.env.plugins_on_demand:
+            data = self.__read_manifest(packages)
+            if data is not None:
+                (manifest, skipped) = data
+                for module in skipped:
+                    if self.__import_plugin_module(module, module):
+                        self.log.debug(
+                            'plugin module %s is no longer skipped', module
+                        )
+                        self.__discard_manifest()
+                object.__setattr__(self, '_API__manifest', manifest)
+                return
+            (manifest, skipped) = ({}, [])
+        else:
+            (manifest, skipped) = (None, None)
+        for package in packages:
+            self.import_plugins(package, manifest, skipped)
+        if manifest is not None:
+            self.__write_manifest(packages, manifest, skipped)
 
-    # FIXME: This method has no unit test
-    def import_plugins(self, package):
+    def __find_plugins(self, package):
         """
-        Import modules in ``plugins`` sub-package of ``package``.
+        Return ``(subpackage, plugins_dir)`` for the ``plugins`` sub-package
+        of ``package``.
         """
         package = package.replace(os.path.sep, '.')
         subpackage = '%s.plugins' % package
@@ -632,21 +771,161 @@ class API(DictProxy):
             raise errors.PluginsPackageError(
                 name=subpackage, file=plugins.__file__
             )
+        return (subpackage, plugins_dir)
+
+    def __import_plugin_module(self, fullname, pyfile):
+        """
+        Import a plugin module, return False if the module was skipped.
+        """
+        self.log.debug('importing plugin module %r', pyfile)
+        try:
+            __import__(fullname)
+        except errors.SkipPluginModule, e:
+            self.log.debug(
+                'skipping plugin module %s: %s', fullname, e.reason
+            )
+            return False
+        except StandardError, e:
+            if self.env.startup_traceback:
+                import traceback
+                self.log.error('could not load plugin module %r\n%s', pyfile, traceback.format_exc())
+            raise
+        return True
+
+    def __registered(self):
+        """
+        Return a dict mapping ``(base name, plugin name)`` to plugin class.
+        """
+        registered = {}
+        for name in self.register:
+            magic = getattr(self.register, name)
+            for key in magic:
+                registered[(name, key)] = magic[key]
+        return registered
+
+    def import_plugins(self, package, manifest=None, skipped=None):
+        """
+        Import modules in ``plugins`` sub-package of ``package``.
+
+        If ``manifest`` is a dict, the modules which register each plugin
+        are recorded in it as ``manifest[base][name] = [module, ...]``.
+        If ``skipped`` is a list, the modules raising `SkipPluginModule` are
+        appended to it.
+        """
+        (subpackage, plugins_dir) = self.__find_plugins(package)
         self.log.debug('importing all plugin modules in %r...', plugins_dir)
         for (name, pyfile) in util.find_modules_in_dir(plugins_dir):
             fullname = '%s.%s' % (subpackage, name)
-            self.log.debug('importing plugin module %r', pyfile)
+            if manifest is None:
+                self.__import_plugin_module(fullname, pyfile)
+                continue
+            before = self.__registered()
+            if not self.__import_plugin_module(fullname, pyfile):
+                if skipped is not None:
+                    skipped.append(fullname)
+            for ((base, key), klass) in self.__registered().iteritems():
+                if before.get((base, key)) is klass:
+                    continue
+                # A plugin module can import another plugin module, so
+                # prefer the module defining the class when it is a plugin
+                # module itself:
+                module = klass.__module__
+                if not module.startswith(subpackage + '.'):
+                    module = fullname
+                modules = manifest.setdefault(base, {}).setdefault(key, [])
+                if module not in modules:
+                    modules.append(module)
+
+    def __manifest_file(self):
+        if self.env.dot_ipa is None:
+            return None
+        return path.join(self.env.dot_ipa, 'plugins.manifest')
+
+    def __manifest_key(self, packages):
+        """
+        Return a key identifying the plugin modules and the configuration
+        the manifest was generated with.
+
+        Plugin modules register plugins conditionally on the environment, so
+        the relevant variables are part of the key along with the stat of
+        every plugin module.
+        """
+        h = hashlib.sha1()
+        for key in ('version', 'context', 'in_server', 'in_tree', 'mode',
+            'enable_ra', 'ra_plugin'):
+            h.update('%s=%r\n' % (key, getattr(self.env, key, None)))
+        for filename in (self.env.conf, self.env.conf_default):
             try:
-                __import__(fullname)
-            except errors.SkipPluginModule, e:
-                self.log.debug(
-                    'skipping plugin module %s: %s', fullname, e.reason
-                )
-            except StandardError, e:
-                if self.env.startup_traceback:
-                    import traceback
-                    self.log.error('could not load plugin module %r\n%s', pyfile, traceback.format_exc())
-                raise
+                st = os.stat(filename)
+            except (OSError, TypeError):
+                continue
+            h.update('%s:%d\n' % (filename, st.st_mtime))
+        for package in packages:
+            (subpackage, plugins_dir) = self.__find_plugins(package)
+            for (name, pyfile) in util.find_modules_in_dir(plugins_dir):
+                st = os.stat(pyfile)
+                h.update('%s:%d:%d\n' % (pyfile, st.st_mtime, st.st_size))
+        return h.hexdigest()
+
+    def __read_manifest(self, packages):
+        """
+        Return the plugin manifest and the skipped plugin modules, or None if
+        the manifest is missing or stale.
+        """
+        filename = self.__manifest_file()
+        if filename is None or not path.isfile(filename):
+            return None
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if data['key'] != self.__manifest_key(packages):
+                self.log.debug('plugin manifest %r is stale', filename)
+                return None
+            # Plugin names are str, not the unicode the JSON decoder returns:
+            manifest = dict(
+                (str(base), dict(
+                    (str(name), [str(m) for m in modules])
+                    for (name, modules) in plugins.iteritems()
+                ))
+                for (base, plugins) in data['plugins'].iteritems()
+            )
+            return (manifest, [str(m) for m in data['skipped']])
+        except (IOError, ValueError, KeyError, TypeError), e:
+            self.log.debug('cannot read plugin manifest %r: %s', filename, e)
+            return None
+
+    def __write_manifest(self, packages, manifest, skipped):
+        filename = self.__manifest_file()
+        if filename is None:
+            return
+        data = dict(key=self.__manifest_key(packages), plugins=manifest,
+                    skipped=skipped)
+        tmpname = '%s.%d' % (filename, os.getpid())
+        try:
+            if not path.isdir(self.env.dot_ipa):
+                os.makedirs(self.env.dot_ipa, 0700)
+            with open(tmpname, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmpname, filename)
+        except (IOError, OSError), e:
+            self.log.debug('cannot write plugin manifest %r: %s', filename, e)
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def __discard_manifest(self):
+        """
+        Remove a stale plugin manifest, so that it is regenerated by the
+        next `API.load_plugins`.
+        """
+        filename = self.__manifest_file()
+        if filename is None:
+            return
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
 
     def finalize(self):
         """
@@ -689,26 +968,64 @@ class API(DictProxy):
 
         plugins = {}
         tofinalize = set()
+        def get_plugin(base, klass):
+            assert issubclass(klass, base)
+            if klass not in plugins:
+                plugins[klass] = PluginInstance(klass)
+            p = plugins[klass]
+            if not is_production_mode(self):
+                assert base not in p.bases
+            p.bases.append(base)
+            return p
+
         def plugin_iter(base, subclasses):
             for klass in subclasses:
-                assert issubclass(klass, base)
-                if klass not in plugins:
-                    plugins[klass] = PluginInstance(klass)
-                p = plugins[klass]
-                if not is_production_mode(self):
-                    assert base not in p.bases
-                p.bases.append(base)
+                p = get_plugin(base, klass)
                 if klass.finalize_early or not self.env.plugins_on_demand:
                     tofinalize.add(p)
                 yield p.instance
 
+        manifest = self.__manifest
+        lazy_lock = threading.RLock()
+        def lazy_loader(name, base, magic):
+            loaded = {}
+            def load(key):
+                with lazy_lock:
+                    if key in loaded:
+                        return loaded[key]
+                    for module in manifest.get(name, {}).get(key, ()):
+                        self.__import_plugin_module(module, module)
+                    if key not in magic:
+                        # The module does not register the plugin anymore,
+                        # e.g. because an import it depends on now fails:
+                        self.log.debug(
+                            'plugin %s.%s is not registered, plugin '
+                            'manifest is stale', name, key
+                        )
+                        self.__discard_manifest()
+                        raise KeyError(key)
+                    p = get_plugin(base, magic[key])
+                    if p.instance.api is None:
+                        p.instance.set_api(self)
+                    if p.klass.finalize_early:
+                        p.instance.ensure_finalized()
+                    loaded[key] = p.instance
+                    return p.instance
+            return load
+
         production_mode = is_production_mode(self)
         for name in self.register:
             base = self.register[name]
             magic = getattr(self.register, name)
-            namespace = NameSpace(
-                plugin_iter(base, (magic[k] for k in magic))
-            )
+            if manifest is not None:
+                namespace = LazyNameSpace(
+                    set(manifest.get(name, ())) | set(magic),
+                    lazy_loader(name, base, magic)
+                )
+            else:
+                namespace = NameSpace(
+                    plugin_iter(base, (magic[k] for k in magic))
+                )
             if not production_mode:
                 assert not (
                     name in self.__d or hasattr(self, name)
@@ -726,7 +1043,19 @@ class API(DictProxy):
             if not production_mode:
                 assert islocked(p.instance) is True
         object.__setattr__(self, '_API__finalized', True)
-        tuple(PluginInfo(p) for p in plugins.itervalues())
-        object.__setattr__(self, 'plugins',
-            tuple(PluginInfo(p) for p in plugins.itervalues())
-        )
+
+        def plugin_info():
+            if manifest is not None:
+                for name in self.register:
+                    tuple(self.__d[name]())
+            return tuple(PluginInfo(p) for p in plugins.itervalues())
+        object.__setattr__(self, '_API__plugin_info', plugin_info)
+
+    def __get_plugins(self):
+        """
+        Return a `PluginInfo` for each plugin instance.
+
+        With lazily loaded plugins, this loads all of them.
+        """
+        return self.__plugin_info()
+    plugins = property(__get_plugins)
@@ -459,6 +459,33 @@ class LDAPObject(Object):
     object_not_found_msg = _('%(pkey)s: %(oname)s not found')
     already_exists_msg = _('%(oname)s with name "%(pkey)s" already exists')
 
+    # Create stubs for attributes that are set in _on_finalize()
+    _member_containers = Object.finalize_attr('_member_containers')
+
+    def _on_finalize(self):
+        # Filled in by _get_member_containers() on first use, so that the
+        # objects referenced by attribute_members are only loaded when needed.
+        self._member_containers = {}
+
+        super(LDAPObject, self)._on_finalize()
+
+    def _get_member_containers(self, attr):
+        """
+        Map the RDNs of the container of every object attribute_members[attr]
+        may reference to these objects (and their position in
+        attribute_members), so that convert_attribute_members can sort out a
+        member by its parents.
+        """
+        if attr not in self._member_containers:
+            containers = {}
+            for (i, ldap_obj_name) in enumerate(self.attribute_members[attr]):
+                ldap_obj = self.api.Object[ldap_obj_name]
+                container_dn = DN(ldap_obj.container_dn, self.api.env.basedn)
+                containers.setdefault(tuple(container_dn), []).append(
+                    (i, ldap_obj))
+            self._member_containers[attr] = containers
+        return self._member_containers[attr]
+
     def get_dn(self, *keys, **kwargs):
         if self.parent_object:
             parent_dn = self.api.Object[self.parent_object].get_dn(*keys[:-1])
@@ -520,18 +547,35 @@ class LDAPObject(Object):
         oc = map(lambda x:x.lower(),classes)
         return objectclass.lower() in oc
 
+    def _get_member_objects(self, attr, member):
+        """
+        Return the objects of attribute_members[attr] whose container
+        holds member.
+        """
+        basedn = self.api.env.basedn
+        if not member.endswith(basedn):
+            return [self.api.Object[ldap_obj_name]
+                    for ldap_obj_name in self.attribute_members[attr]
+                    if self.api.Object[ldap_obj_name].container_dn in member]
+
+        containers = self._get_member_containers(attr)
+        found = []
+        for i in xrange(len(member) - len(basedn) + 1):
+            found.extend(containers.get(tuple(member[i:]), []))
+        if len(found) > 1:
+            found.sort()
+        return [ldap_obj for (pos, ldap_obj) in found]
+
     def convert_attribute_members(self, entry_attrs, *keys, **options):
         if options.get('raw', False):
             return
         for attr in self.attribute_members:
             for member in entry_attrs.setdefault(attr, []):
-                for ldap_obj_name in self.attribute_members[attr]:
-                    ldap_obj = self.api.Object[ldap_obj_name]
-                    if ldap_obj.container_dn in member:
-                        new_attr = '%s_%s' % (attr, ldap_obj.name)
-                        entry_attrs.setdefault(new_attr, []).append(
-                            ldap_obj.get_primary_key_from_dn(member)
-                        )
+                for ldap_obj in self._get_member_objects(attr, member):
+                    new_attr = '%s_%s' % (attr, ldap_obj.name)
+                    entry_attrs.setdefault(new_attr, []).append(
+                        ldap_obj.get_primary_key_from_dn(member)
+                    )
             del entry_attrs[attr]
 
     def get_password_attributes(self, ldap, dn, entry_attrs):
@@ -553,6 +597,50 @@ class LDAPObject(Object):
             except errors.NotFound:
                 entry_attrs[attr] = False
 
+    def get_password_attributes_for_entries(self, ldap, entries):
+        """
+        Same as get_password_attributes but for a list of (dn, entry_attrs)
+        tuples, e.g. a search result.
+
+        Instead of searching on every entry, the entries are grouped by
+        their parent and one search per password type and parent is made
+        for all of their RDNs.
+        """
+        children = {}
+        for (dn, entry_attrs) in entries:
+            assert isinstance(dn, DN)
+            if len(dn) < 2:
+                self.get_password_attributes(ldap, dn, entry_attrs)
+                continue
+            children.setdefault(DN(*dn[1:]), []).append((dn, entry_attrs))
+
+        for (parent_dn, parent_entries) in children.iteritems():
+            rdn_filter = ldap.combine_filters(
+                [ldap.make_filter(dict((ava.attr, ava.value) for ava in dn[0]),
+                                  rules=ldap.MATCH_ALL)
+                 for (dn, entry_attrs) in parent_entries],
+                ldap.MATCH_ANY
+            )
+            for (pwattr, attr) in self.password_attributes:
+                search_filter = ldap.combine_filters(
+                    ['(%s=*)' % pwattr, rdn_filter], ldap.MATCH_ALL
+                )
+                try:
+                    (result, truncated) = ldap.find_entries(
+                        search_filter, ['dn'], parent_dn, ldap.SCOPE_ONELEVEL,
+                        size_limit=0
+                    )
+                except errors.NotFound:
+                    (result, truncated) = ([], False)
+                if truncated:
+                    # Incomplete answer, fall back to searching every entry
+                    for (dn, entry_attrs) in parent_entries:
+                        self.get_password_attributes(ldap, dn, entry_attrs)
+                    break
+                found = set(dn for (dn, entry_attrs) in result)
+                for (dn, entry_attrs) in parent_entries:
+                    entry_attrs[attr] = dn in found
+
     def handle_not_found(self, *keys):
         pkey = ''
         if self.primary_key:
@@ -591,9 +679,9 @@ class LDAPObject(Object):
         objectclasses = self.object_class
         if self.object_class_config:
             config = ldap.get_ipa_config()[1]
-            objectclasses = config.get(
+            objectclasses = list(config.get(
                 self.object_class_config, objectclasses
-            )
+            ))
         objectclasses = objectclasses + self.possible_objectclasses
         # Get list of available attributes for this object for use
         # in the ACI UI.
@@ -627,6 +715,23 @@ def _check_empty_attrs(params, entry_attrs):
             if a in params and params[a].required:
                 raise errors.RequirementError(name=a)
 
+# ldap2.add_entry and update_entry return the written entry when asked
+# to, but an exc_callback handling their error may return anything
+def _is_returned_entry(result):
+    return (isinstance(result, tuple) and len(result) == 2 and
+            isinstance(result[0], DN))
+
+# The entry returned with a write operation is read before the 389-ds
+# post-operation plugins (memberOf, Managed Entries) update it, it has to
+# be read again when any of the attributes they maintain is requested.
+def _get_return_attrs(attrs_list):
+    for attr in attrs_list:
+        attr = attr.lower()
+        if (attr == '*' or attr.startswith('memberof') or
+            attr == 'mepmanagedentry'):
+            return None
+    return attrs_list
+
 
 def _check_limit_object_class(attributes, attrs, allow_only):
     """
@@ -987,9 +1092,9 @@ class LDAPCreate(BaseLDAPCommand, crud.Create):
 
         if self.obj.object_class_config:
             config = ldap.get_ipa_config()[1]
-            entry_attrs['objectclass'] = config.get(
+            entry_attrs['objectclass'] = list(config.get(
                 self.obj.object_class_config, entry_attrs['objectclass']
-            )
+            ))
 
         if self.obj.uuid_attribute:
             entry_attrs[self.obj.uuid_attribute] = 'autogenerate'
@@ -1023,8 +1128,17 @@ class LDAPCreate(BaseLDAPCommand, crud.Create):
         _check_limit_object_class(self.api.Backend.ldap2.schema.attribute_types(self.obj.limit_object_classes), entry_attrs.keys(), allow_only=True)
         _check_limit_object_class(self.api.Backend.ldap2.schema.attribute_types(self.obj.disallow_object_classes), entry_attrs.keys(), allow_only=False)
 
+        if self.obj.rdn_attribute:
+            # the server may change the DN, the entry is looked up below
+            return_attrs = None
+        else:
+            return_attrs = _get_return_attrs(attrs_list)
+
+        entry = None
         try:
-            self._exc_wrapper(keys, options, ldap.add_entry)(dn, entry_attrs, normalize=self.obj.normalize_dn)
+            entry = self._exc_wrapper(keys, options, ldap.add_entry)(
+                dn, entry_attrs, normalize=self.obj.normalize_dn,
+                return_attrs=return_attrs)
         except errors.NotFound:
             parent = self.obj.parent_object
             if parent:
@@ -1054,6 +1168,8 @@ class LDAPCreate(BaseLDAPCommand, crud.Create):
                     self.obj.container_dn
                 )
                 assert isinstance(dn, DN)
+            elif _is_returned_entry(entry):
+                (dn, entry_attrs) = entry
             else:
                 (dn, entry_attrs) = self._exc_wrapper(keys, options, ldap.get_entry)(
                     dn, attrs_list, normalize=self.obj.normalize_dn
@@ -1277,6 +1393,7 @@ class LDAPUpdate(LDAPQuery, crud.Update):
         _check_limit_object_class(self.api.Backend.ldap2.schema.attribute_types(self.obj.disallow_object_classes), entry_attrs.keys(), allow_only=False)
 
         rdnupdate = False
+        entry = None
         try:
             if self.obj.rdn_is_primary_key and 'rename' in options:
                 if not options['rename']:
@@ -1299,21 +1416,26 @@ class LDAPUpdate(LDAPQuery, crud.Update):
             # mean an error occurred, just that there were no other updates to
             # perform.
             assert isinstance(dn, DN)
-            self._exc_wrapper(keys, options, ldap.update_entry)(dn, entry_attrs, normalize=self.obj.normalize_dn)
+            entry = self._exc_wrapper(keys, options, ldap.update_entry)(
+                dn, entry_attrs, normalize=self.obj.normalize_dn,
+                return_attrs=_get_return_attrs(attrs_list))
         except errors.EmptyModlist, e:
             if not rdnupdate:
                 raise e
         except errors.NotFound:
             self.obj.handle_not_found(*keys)
 
-        try:
-            (dn, entry_attrs) = self._exc_wrapper(keys, options, ldap.get_entry)(
-                dn, attrs_list, normalize=self.obj.normalize_dn
-            )
-        except errors.NotFound:
-            raise errors.MidairCollision(
-                format=_('the entry was deleted while being modified')
-            )
+        if _is_returned_entry(entry):
+            (dn, entry_attrs) = entry
+        else:
+            try:
+                (dn, entry_attrs) = self._exc_wrapper(keys, options, ldap.get_entry)(
+                    dn, attrs_list, normalize=self.obj.normalize_dn
+                )
+            except errors.NotFound:
+                raise errors.MidairCollision(
+                    format=_('the entry was deleted while being modified')
+                )
 
         if options.get('rights', False) and options.get('all', False):
             entry_attrs['attributelevelrights'] = get_effective_rights(ldap, dn)
@@ -1473,6 +1595,48 @@ class LDAPModMember(LDAPQuery):
                         failed[attr][ldap_obj_name].append((name, unicode(e)))
         return (dns, failed)
 
+    def modify_members(self, modify, dn, member_dns, failed, **kw):
+        """
+        Add or remove the members in member_dns to/from the entry dn.
+
+        modify is the ldap2 bulk method to use (add_entries_to_group or
+        remove_entries_from_group), it is called once for each member
+        attribute with every member DN of that attribute and the extra
+        keyword arguments kw.
+
+        Members which could not be processed are recorded in failed in
+        the order they were requested. Returns the number of members
+        processed successfully.
+        """
+        completed = 0
+        for (attr, objs) in member_dns.iteritems():
+            m_dns = []
+            for m_dns_obj in objs.itervalues():
+                for m_dn in m_dns_obj:
+                    assert isinstance(m_dn, DN)
+                    if m_dn:
+                        m_dns.append(m_dn)
+            if not m_dns:
+                continue
+
+            errs = {}
+            for (m_dn, e) in modify(m_dns, dn, attr, **kw):
+                errs.setdefault(m_dn, []).append(e)
+
+            for ldap_obj_name, m_dns_obj in objs.iteritems():
+                for m_dn in m_dns_obj:
+                    if not m_dn:
+                        continue
+                    if errs.get(m_dn):
+                        ldap_obj = self.api.Object[ldap_obj_name]
+                        failed[attr][ldap_obj_name].append((
+                            ldap_obj.get_primary_key_from_dn(m_dn),
+                            unicode(errs[m_dn].pop(0)),)
+                        )
+                    else:
+                        completed += 1
+        return completed
+
 
 class LDAPAddMember(LDAPModMember):
     """
@@ -1508,23 +1672,9 @@ class LDAPAddMember(LDAPModMember):
             dn = callback(self, ldap, dn, member_dns, failed, *keys, **options)
             assert isinstance(dn, DN)
 
-        completed = 0
-        for (attr, objs) in member_dns.iteritems():
-            for ldap_obj_name in objs:
-                for m_dn in member_dns[attr][ldap_obj_name]:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.add_entry_to_group(m_dn, dn, attr, allow_same=self.allow_same)
-                    except errors.PublicError, e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+        completed = self.modify_members(
+            ldap.add_entries_to_group, dn, member_dns, failed,
+            allow_same=self.allow_same)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1603,23 +1753,8 @@ class LDAPRemoveMember(LDAPModMember):
             dn = callback(self, ldap, dn, member_dns, failed, *keys, **options)
             assert isinstance(dn, DN)
 
-        completed = 0
-        for (attr, objs) in member_dns.iteritems():
-            for ldap_obj_name, m_dns in objs.iteritems():
-                for m_dn in m_dns:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.remove_entry_from_group(m_dn, dn, attr)
-                    except errors.PublicError, e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+        completed = self.modify_members(
+            ldap.remove_entries_from_group, dn, member_dns, failed)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1683,8 +1818,8 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
     member_param_incl_doc = _('Search for %(searched_object)s with these %(relationship)s %(ldap_object)s.')
     member_param_excl_doc = _('Search for %(searched_object)s without these %(relationship)s %(ldap_object)s.')
 
-    # LDAPSearch sorts all matched records in the end using their primary key
-    # as a key attribute
+    # LDAPSearch sorts all matched records using their primary key as a key
+    # attribute, on the server side when possible
     # Set the following attribute to False to turn sorting off
     sort_result_entries = True
 
@@ -1703,6 +1838,13 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
             minvalue=0,
             autofill=False,
         ),
+        Int('offset?',
+            label=_('Offset'),
+            doc=_('Number of leading entries to skip in the sorted result'),
+            flags=['no_display'],
+            minvalue=0,
+            autofill=False,
+        ),
     )
 
     def get_args(self):
@@ -1836,19 +1978,28 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                 self, ldap, filter, attrs_list, base_dn, scope, *args, **options)
             assert isinstance(base_dn, DN)
 
+        sort_keys = None
+        if self.sort_result_entries and self.obj.primary_key:
+            sort_keys = [self.obj.primary_key.name]
+
         try:
             (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
                 filter, attrs_list, base_dn, scope,
                 time_limit=options.get('timelimit', None),
-                size_limit=options.get('sizelimit', None)
+                size_limit=options.get('sizelimit', None),
+                paged_search=True, sort_keys=sort_keys,
+                offset=options.get('offset', None)
             )
         except errors.NotFound:
             (entries, truncated) = ([], False)
+        count = len(entries)
 
         for callback in self.get_callbacks('post'):
             truncated = callback(self, ldap, entries, truncated, *args, **options)
 
-        if self.sort_result_entries:
+        # find_entries() returns the entries sorted, only entries added by
+        # post callbacks have to be put in place
+        if self.sort_result_entries and len(entries) != count:
             if self.obj.primary_key:
                 def sort_key(x):
                     return x[1][self.obj.primary_key.name][0].lower()
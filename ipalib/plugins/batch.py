@@ -43,15 +43,31 @@ The format of the response is nested the same way.  At the top you will see
 
 And then a nested response for each IPA command method sent in the request
 
+Independent methods can be executed concurrently by passing the "parallel"
+option:
+
+{"method":"batch","params":[[
+        {"method":"user_show","params":[["admin"],{}]},
+        {"method":"group_show","params":[["admins"],{}]}
+        ],{"parallel":true}],"id":1}
+
+The methods are then distributed among at most batch_workers threads (see
+default.conf), each with its own LDAP connection. The results are returned
+in the order of the request regardless of the order of execution.
+
 """
 
+import os
+import threading
+import Queue
+
 from ipalib import api, errors
 from ipalib import Command
-from ipalib.parameters import Str, Any
+from ipalib.parameters import Str, Any, Flag
 from ipalib.output import Output
 from ipalib import output
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, destroy_context
 from ipapython.version import API_VERSION
 
 class batch(Command):
@@ -74,53 +90,133 @@ class batch(Command):
         ),
     )
 
+    takes_options = (
+        Flag('parallel?',
+            doc=_('Execute the nested methods concurrently'),
+        ),
+    )
+
     has_output = (
         Output('count', int, doc=''),
         Output('results', (list, tuple), doc='')
     )
 
+    # Attributes of the request context the nested commands may read, they
+    # are copied to the context of the parallel workers. The other context
+    # attributes are the LDAP connection, which every worker binds itself,
+    # and state kept by a command for the duration of its own execution.
+    worker_context = ('principal', 'session_data', 'languages')
+
     def execute(self, *args, **options):
-        results = []
-        for arg in args[0]:
-            params = dict()
-            name = None
-            try:
-                if 'method' not in arg:
-                    raise errors.RequirementError(name='method')
-                if 'params' not in arg:
-                    raise errors.RequirementError(name='params')
-                name = arg['method']
-                if name not in self.Command:
-                    raise errors.CommandError(name=name)
-                a, kw = arg['params']
-                newkw = dict((str(k), v) for k, v in kw.iteritems())
-                params = api.Command[name].args_options_2_params(*a, **newkw)
-
-                result = api.Command[name](*a, **newkw)
+        methods = args[0] or ()
+        if options.get('parallel') and len(methods) > 1:
+            results = self._execute_parallel(methods)
+        else:
+            results = [self._execute_method(arg) for arg in methods]
+        return dict(count=len(results) , results=results)
+
+    def _execute_method(self, arg):
+        params = dict()
+        name = None
+        try:
+            if 'method' not in arg:
+                raise errors.RequirementError(name='method')
+            if 'params' not in arg:
+                raise errors.RequirementError(name='params')
+            name = arg['method']
+            if name not in self.Command:
+                raise errors.CommandError(name=name)
+            a, kw = arg['params']
+            newkw = dict((str(k), v) for k, v in kw.iteritems())
+            params = api.Command[name].args_options_2_params(*a, **newkw)
+
+            result = api.Command[name].call_with_params(params)
+            api.Command[name].log_call(
+                self.log, context.principal, params, prefix='batch: '
+            )
+            result['error']=None
+        except Exception, e:
+            if isinstance(e, errors.RequirementError) or \
+                isinstance(e, errors.CommandError):
                 self.info(
-                    '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+                    '%s: batch: %s', context.principal, e.__class__.__name__
                 )
-                result['error']=None
-            except Exception, e:
-                if isinstance(e, errors.RequirementError) or \
-                    isinstance(e, errors.CommandError):
-                    self.info(
-                        '%s: batch: %s', context.principal, e.__class__.__name__
-                    )
-                else:
-                    self.info(
-                        '%s: batch: %s(%s): %s', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params)),  e.__class__.__name__
-                    )
-                if isinstance(e, errors.PublicError):
-                    reported_error = e
-                else:
-                    reported_error = errors.InternalError()
-                result = dict(
-                    error=reported_error.strerror,
-                    error_code=reported_error.errno,
-                    error_name=unicode(type(reported_error).__name__),
+            else:
+                api.Command[name].log_call(
+                    self.log, context.principal, params, error=e,
+                    prefix='batch: '
                 )
-            results.append(result)
-        return dict(count=len(results) , results=results)
+            result = self._error_result(e)
+        return result
+
+    def _error_result(self, e):
+        if isinstance(e, errors.PublicError):
+            reported_error = e
+        else:
+            reported_error = errors.InternalError()
+        return dict(
+            error=reported_error.strerror,
+            error_code=reported_error.errno,
+            error_name=unicode(type(reported_error).__name__),
+        )
+
+    def _execute_parallel(self, methods):
+        """
+        Execute methods on a pool of worker threads.
+
+        Every worker has its own thread-local context and binds its own
+        LDAP connection with the credentials of the request.
+        """
+        ccache = os.environ.get('KRB5CCNAME')
+        request_context = dict(
+            (name, getattr(context, name)) for name in self.worker_context
+            if hasattr(context, name)
+        )
+        queue = Queue.Queue()
+        for (i, arg) in enumerate(methods):
+            queue.put((i, arg))
+        results = [None] * len(methods)
+
+        workers = []
+        for i in xrange(min(self.api.env.batch_workers, len(methods))):
+            worker = threading.Thread(
+                target=self._worker,
+                args=(queue, results, ccache, request_context),
+                name='%s-worker-%d' % (self.name, i)
+            )
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        return results
+
+    def _worker(self, queue, results, ccache, request_context):
+        connect_error = None
+        try:
+            for (name, value) in request_context.iteritems():
+                setattr(context, name, value)
+            try:
+                self.api.Backend.ldap2.connect(ccache=ccache)
+            except Exception, e:
+                self.error('batch: cannot connect worker %s: %s',
+                           threading.currentThread().getName(), e)
+                connect_error = e
+            while True:
+                try:
+                    (i, arg) = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if connect_error is not None:
+                    results[i] = self._error_result(connect_error)
+                    continue
+                try:
+                    results[i] = self._execute_method(arg)
+                except Exception, e:
+                    # Do not let the worker die and leave results[i] empty.
+                    self.exception('batch: method %d failed', i)
+                    results[i] = self._error_result(e)
+        finally:
+            destroy_context()
 
 api.register(batch)
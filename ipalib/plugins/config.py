@@ -308,6 +308,11 @@ class config_mod(LDAPUpdate):
 
         return dn
 
+    def post_callback(self, ldap, dn, entry_attrs, *keys, **options):
+        assert isinstance(dn, DN)
+        ldap.flush_ipa_config()
+        return dn
+
 api.register(config_mod)
 
 
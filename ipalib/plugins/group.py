@@ -498,7 +498,7 @@ class group_detach(LDAPQuery):
         def_objectclass = config.get(
             self.obj.object_class_config, objectclasses
         )
-        objectclasses = list(set(def_objectclass + objectclasses))
+        objectclasses = list(set(def_objectclass) | set(objectclasses))
 
         update_attrs = {'objectclass': objectclasses, 'mepManagedBy': None}
         ldap.update_entry(group_dn, update_attrs)
@@ -794,10 +794,10 @@ class host_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+        self.obj.get_password_attributes_for_entries(ldap, entries)
         for entry in entries:
             (dn, entry_attrs) = entry
             set_certificate_attrs(entry_attrs)
-            self.obj.get_password_attributes(ldap, dn, entry_attrs)
             self.obj.suppress_netgroup_memberof(entry_attrs)
             if entry_attrs['has_password']:
                 # If an OTP is set there is no keytab, at least not one
@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import itertools
 import ldap as _ldap
 
 from ipalib import api, errors, output
@@ -115,6 +116,19 @@ _supported_schemas = (u'RFC2307bis', u'RFC2307')
 
 _compat_dn = DN(('cn', 'Schema Compatibility'), ('cn', 'plugins'), ('cn', 'config'))
 
+def _merge_objectclasses(ldap_obj, config, objectclasses):
+    """
+    Return the default objectclasses of ldap_obj in the IPA config entry
+    (a read-only IPAConfigEntry) merged with the migrated objectclasses.
+    """
+    return list(
+        set(
+            list(config.get(
+                ldap_obj.object_class_config, ldap_obj.object_class
+            )) + [o.lower() for o in objectclasses]
+        )
+    )
+
 def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs):
     assert isinstance(dn, DN)
     attr_blacklist = ['krbprincipalkey','memberofindirect','memberindirect']
@@ -599,6 +613,21 @@ can use their Kerberos accounts.''')
             search_bases[ldap_obj_name] = search_base
         return search_bases
 
+    def _iter_until_limit(self, entries, ldap_obj):
+        """
+        Generate the entries of a ldap2.iter_entries() search, logging
+        an error rather than failing when the search is truncated.
+        """
+        try:
+            for entry in entries:
+                yield entry
+        except errors.LimitsExceeded:
+            self.log.error(
+                '%s: %s' % (
+                    ldap_obj.name, self.truncated_err_msg
+                )
+            )
+
     def migrate(self, ldap, config, ds_ldap, ds_base_dn, options):
         """
         Migrate objects from DS to LDAP.
@@ -620,15 +649,28 @@ can use their Kerberos accounts.''')
             migrated[ldap_obj_name] = []
             failed[ldap_obj_name] = {}
 
+            # the entries are retrieved page by page as they are migrated
+            entries = ds_ldap.iter_entries(
+                search_filter, ['*'], search_bases[ldap_obj_name],
+                _ldap.SCOPE_ONELEVEL,
+                time_limit=0, size_limit=-1,
+                search_refs=True    # migrated DS may contain search references
+            )
             try:
-                (entries, truncated) = ds_ldap.find_entries(
-                    search_filter, ['*'], search_bases[ldap_obj_name],
-                    _ldap.SCOPE_ONELEVEL,
-                    time_limit=0, size_limit=-1,
-                    search_refs=True    # migrated DS may contain search references
-                )
-            except errors.NotFound:
-                if not options.get('continue',False):
+                first_entry = entries.next()
+            except StopIteration:
+                first_entry = None
+                truncated = False
+            except errors.LimitsExceeded:
+                first_entry = None
+                truncated = True
+            else:
+                truncated = False
+                entries = itertools.chain(
+                    [first_entry], self._iter_until_limit(entries, ldap_obj))
+            if first_entry is None:
+                entries = []
+                if not truncated and not options.get('continue',False):
                     raise errors.NotFound(
                         reason=_('%(container)s LDAP search did not return any result '
                                  '(search base: %(search_base)s, '
@@ -637,9 +679,6 @@ can use their Kerberos accounts.''')
                                     'search_base': search_bases[ldap_obj_name],
                                     'objectclass': ', '.join(oc_list)}
                     )
-                else:
-                    truncated = False
-                    entries = []
             if truncated:
                 self.log.error(
                     '%s: %s' % (
@@ -695,12 +734,8 @@ can use their Kerberos accounts.''')
 
                 dn = ldap_obj.get_dn(pkey)
                 assert isinstance(dn, DN)
-                entry_attrs['objectclass'] = list(
-                    set(
-                        config.get(
-                            ldap_obj.object_class_config, ldap_obj.object_class
-                        ) + [o.lower() for o in entry_attrs['objectclass']]
-                    )
+                entry_attrs['objectclass'] = _merge_objectclasses(
+                    ldap_obj, config, entry_attrs['objectclass']
                 )
                 entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
 
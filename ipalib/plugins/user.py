@@ -681,10 +681,10 @@ class user_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+        self.obj.get_password_attributes_for_entries(ldap, entries)
         for entry in entries:
             (dn, attrs) = entry
             self.obj._convert_manager(attrs, **options)
-            self.obj.get_password_attributes(ldap, dn, attrs)
             convert_nsaccountlock(attrs)
             convert_sshpubkey_post(ldap, dn, attrs)
         return truncated
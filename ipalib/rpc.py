@@ -38,6 +38,9 @@ import os
 import errno
 import locale
 import datetime
+import time
+import json
+import Queue
 from xmlrpclib import (Binary, Fault, dumps, loads, ServerProxy, Transport,
         ProtocolError, MININT, MAXINT)
 import kerberos
@@ -59,6 +62,7 @@ import httplib
 import socket
 from ipapython.nsslib import NSSHTTPS, NSSConnection
 from nss.error import NSPRError
+import nss.error
 from urllib2 import urlparse
 from ipalib.krb_utils import KRB5KDC_ERR_S_PRINCIPAL_UNKNOWN, KRB5KRB_AP_ERR_TKT_EXPIRED, \
                              KRB5_FCC_PERM, KRB5_FCC_NOFILE, KRB5_CC_FORMAT, KRB5_REALM_CANT_RESOLVE
@@ -67,6 +71,13 @@ from ipapython.dn import DN
 COOKIE_NAME = 'ipa_session'
 KEYRING_COOKIE_NAME = '%s_cookie:%%s' % COOKIE_NAME
 
+# Seconds a failed lookup of the IPA server SRV records is cached for.
+DISCOVERY_NEGATIVE_TTL = 60
+
+# Seconds to wait for a server to accept a connection before also trying
+# the next one.
+SERVER_PROBE_DELAY = 0.25
+
 
 def client_session_keyring_keyname(principal):
     '''
@@ -481,21 +492,25 @@ class xmlclient(Connectible):
         """
         Create a list of urls consisting of the available IPA servers.
         """
+        return self.__get_url_list(xmlrpc_uri, self.__get_discovery_cache())
+
+    def __get_url_list(self, xmlrpc_uri, cache):
         # the configured URL defines what we use for the discovered servers
         (scheme, netloc, path, params, query, fragment) = urlparse.urlparse(xmlrpc_uri)
         servers = []
-        name = '_ldap._tcp.%s.' % self.env.domain
+        srv = cache.get('srv', {})
+        latencies = cache.get('latencies', {})
 
-        try:
-            answers = resolver.query(name, rdatatype.SRV)
-        except DNSException, e:
-            answers = []
+        # prefer the servers by SRV priority, then by how fast they were to
+        # connect to and finally by SRV weight
+        def key(server):
+            (priority, weight) = srv.get(server, (0, 0))
+            latency = latencies.get(ipautil.format_netloc(server))
+            return (priority, latency is None, latency, -weight)
 
-        for answer in answers:
-            server = str(answer.target).rstrip(".")
+        for server in sorted(set(cache['servers']), key=key):
             servers.append('https://%s%s' % (ipautil.format_netloc(server), path))
 
-        servers = list(set(servers))
         # the list/set conversion won't preserve order so stick in the
         # local config file version here.
         cfg_server = xmlrpc_uri
@@ -509,6 +524,165 @@ class xmlclient(Connectible):
 
         return servers
 
+    def __get_discovery_cache_file(self):
+        if not self.env.discovery_cache or self.env.dot_ipa is None:
+            return None
+        return os.path.join(self.env.dot_ipa, 'servers.cache')
+
+    def __get_discovery_cache(self):
+        """
+        Return the IPA servers of the domain, from the discovery cache if it
+        is fresh, otherwise from the SRV records in DNS.
+
+        The result is a dict with the host names of the servers in
+        ``servers``, their SRV priority and weight in ``srv``, the time it
+        expires at in ``expires`` and, once a server has answered a ping,
+        its name and how long the ping took in ``last_server`` and
+        ``latency``. How long the servers took to accept a connection is
+        kept in ``latencies``.
+        """
+        filename = self.__get_discovery_cache_file()
+        if filename is not None and os.path.isfile(filename):
+            try:
+                f = open(filename)
+                try:
+                    cache = json.load(f)
+                finally:
+                    f.close()
+                if (cache['domain'] == self.env.domain and
+                    cache['expires'] > time.time()):
+                    cache['servers'] = [str(s) for s in cache['servers']]
+                    cache['srv'] = dict(
+                        (str(s), tuple(v)) for (s, v) in cache['srv'].items())
+                    cache['latencies'] = dict(
+                        (str(s), v) for (s, v) in cache['latencies'].items())
+                    if cache.get('last_server') is not None:
+                        cache['last_server'] = str(cache['last_server'])
+                    return cache
+            except (IOError, ValueError, KeyError, TypeError,
+                    AttributeError), e:
+                self.debug('cannot read discovery cache %r: %s', filename, e)
+
+        name = '_ldap._tcp.%s.' % self.env.domain
+
+        try:
+            answers = resolver.query(name, rdatatype.SRV)
+            expires = time.time() + answers.rrset.ttl
+        except DNSException, e:
+            answers = []
+            expires = time.time() + DISCOVERY_NEGATIVE_TTL
+
+        servers = []
+        srv = {}
+        for answer in answers:
+            server = str(answer.target).rstrip(".")
+            servers.append(server)
+            srv[server] = (answer.priority, answer.weight)
+
+        cache = dict(domain=self.env.domain, servers=servers, srv=srv,
+            latencies={}, expires=expires)
+        self.__update_discovery_cache(cache)
+        return cache
+
+    def __update_discovery_cache(self, cache):
+        filename = self.__get_discovery_cache_file()
+        if filename is None:
+            return
+        tmpname = '%s.%d' % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.env.dot_ipa):
+                os.makedirs(self.env.dot_ipa, 0700)
+            f = open(tmpname, 'w')
+            try:
+                json.dump(cache, f)
+            finally:
+                f.close()
+            os.rename(tmpname, filename)
+        except (IOError, OSError), e:
+            self.debug('cannot write discovery cache %r: %s', filename, e)
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def __probe_servers(self, urls, cache):
+        """
+        Return ``urls`` with the first server to accept a connection in
+        front and the servers which refused one at the end.
+
+        The servers are connected to concurrently, in the order of ``urls``
+        and each one `SERVER_PROBE_DELAY` seconds after the previous one
+        unless that failed already, so a preferred server which is up is
+        still chosen and a dead one costs about a round trip rather than a
+        connection timeout. How long the connections took is recorded in
+        the ``latencies`` of the discovery cache.
+        """
+        timeout = self.env.server_probe_timeout
+        results = Queue.Queue()
+
+        def probe(url):
+            url = urlparse.urlparse(url)
+            if url.port is not None:
+                port = url.port
+            elif url.scheme == 'https':
+                port = 443
+            else:
+                port = 80
+            start = time.time()
+            try:
+                sock = socket.create_connection((url.hostname, port), timeout)
+            except socket.error, e:
+                results.put((url.netloc, None, e))
+            else:
+                sock.close()
+                results.put((url.netloc, time.time() - start, None))
+
+        pending = list(urls)
+        running = 0
+        first = None
+        refused = []
+        deadline = time.time() + timeout
+        while first is None and (pending or running):
+            wait = deadline - time.time()
+            if wait <= 0:
+                break
+            if pending:
+                thread = threading.Thread(target=probe,
+                    args=(pending.pop(0),))
+                thread.daemon = True
+                thread.start()
+                running += 1
+                wait = min(wait, SERVER_PROBE_DELAY)
+            try:
+                (netloc, latency, e) = results.get(timeout=wait)
+            except Queue.Empty:
+                continue
+            running -= 1
+            if e is None:
+                first = netloc
+                cache['latencies'][netloc] = latency
+            else:
+                self.log.info('Connection to %s failed with %s', netloc, e)
+                refused.append(netloc)
+                cache['latencies'].pop(netloc, None)
+
+        if first is None:
+            self.debug('no server accepted a connection in %s seconds',
+                timeout)
+            return urls
+        self.debug('%s accepted a connection first', first)
+        # sorted() is stable, so the order of the other servers is kept
+        def key(url):
+            netloc = urlparse.urlparse(url)[1]
+            return (netloc != first, netloc in refused)
+        return sorted(urls, key=key)
+
+    def __forget_last_server(self):
+        cache = self.__get_discovery_cache()
+        if cache.pop('last_server', None) is not None:
+            cache.pop('latency', None)
+            self.__update_discovery_cache(cache)
+
     def get_session_cookie_from_persistent_storage(self, principal):
         '''
         Retrieves the session cookie for the given principal from the
@@ -609,7 +783,22 @@ class xmlclient(Connectible):
         except ValueError:
             # No session key, do full Kerberos auth
             pass
-        urls = self.get_url_list(xmlrpc_uri)
+        cache = self.__get_discovery_cache()
+        urls = self.__get_url_list(xmlrpc_uri, cache)
+        # Try the server which last answered first and without a ping while
+        # the discovery cache is fresh.
+        cached_url = None
+        if len(urls) > 1 and cache.get('last_server') is not None:
+            for url in urls:
+                if urlparse.urlparse(url)[1] == cache['last_server']:
+                    cached_url = url
+                    urls.remove(url)
+                    urls.insert(0, url)
+                    break
+        # Otherwise start with the first server which accepts a connection.
+        if (len(urls) > 1 and cached_url is None and fallback and
+            self.env.server_probe_timeout > 0):
+            urls = self.__probe_servers(urls, cache)
         serverproxy = None
         for url in urls:
             kw = dict(allow_none=True, encoding='UTF-8')
@@ -623,8 +812,9 @@ class xmlclient(Connectible):
                 kw['transport'] = LanguageAwareTransport()
             self.log.info('trying %s' % url)
             setattr(context, 'request_url', url)
+            setattr(context, 'request_url_cached', url == cached_url)
             serverproxy = ServerProxy(url, **kw)
-            if len(urls) == 1:
+            if len(urls) == 1 or url == cached_url:
                 # if we have only 1 server and then let the
                 # main requester handle any errors. This also means it
                 # must handle a 401 but we save a ping.
@@ -632,7 +822,11 @@ class xmlclient(Connectible):
             try:
                 command = getattr(serverproxy, 'ping')
                 try:
+                    start = time.time()
                     response = command()
+                    cache['last_server'] = urlparse.urlparse(url)[1]
+                    cache['latency'] = time.time() - start
+                    self.__update_discovery_cache(cache)
                 except Fault, e:
                     e = decode_fault(e)
                     if e.faultCode in self.__errors:
@@ -681,6 +875,26 @@ class xmlclient(Connectible):
                 conn = conn.conn._ServerProxy__transport
                 conn.close()
 
+    def __reconnect(self):
+        """
+        Replace the connection of this thread with a new one.
+        """
+        # If there is an existing connection we need to save the NSS dbdir
+        # so we can skip an unnecessary NSS_Initialize() and avoid
+        # NSS_Shutdown issues.
+        serverproxy = self.create_connection(os.environ.get('KRB5CCNAME'), self.env.verbose, self.env.fallback, self.env.delegate)
+
+        dbdir = None
+        current_conn = getattr(context, self.id, None)
+        if current_conn is not None:
+            dbdir = getattr(current_conn.conn._ServerProxy__transport, 'dbdir', None)
+            if dbdir is not None:
+                self.debug('Using dbdir %s' % dbdir)
+        setattr(context, self.id, Connection(serverproxy, self.disconnect))
+        if dbdir is not None:
+            current_conn = getattr(context, self.id, None)
+            current_conn.conn._ServerProxy__transport.dbdir = dbdir
+
     def forward(self, name, *args, **kw):
         """
         Forward call to command named ``name`` over XML-RPC.
@@ -716,6 +930,15 @@ class xmlclient(Connectible):
                 server=server,
             )
         except NSPRError, e:
+            if (getattr(context, 'request_url_cached', False) and
+                e.errno == nss.error.PR_ADDRESS_NOT_SUPPORTED_ERROR):
+                # The server from the discovery cache could not be
+                # connected to, so nothing was sent. Forget it and look
+                # for another server.
+                self.debug('Cannot connect to cached server %r', server)
+                self.__forget_last_server()
+                self.__reconnect()
+                return self.forward(name, *args, **kw)
             raise NetworkError(uri=server, error=str(e))
         except ProtocolError, e:
             # By catching a 401 here we can detect the case where we have
@@ -732,22 +955,8 @@ class xmlclient(Connectible):
                     # This shouldn't happen if we have a session but it isn't fatal.
                     pass
 
-                # Create a new serverproxy with the non-session URI. If there
-                # is an existing connection we need to save the NSS dbdir so
-                # we can skip an unnecessary NSS_Initialize() and avoid
-                # NSS_Shutdown issues.
-                serverproxy = self.create_connection(os.environ.get('KRB5CCNAME'), self.env.verbose, self.env.fallback, self.env.delegate)
-
-                dbdir = None
-                current_conn = getattr(context, self.id, None)
-                if current_conn is not None:
-                    dbdir = getattr(current_conn.conn._ServerProxy__transport, 'dbdir', None)
-                    if dbdir is not None:
-                        self.debug('Using dbdir %s' % dbdir)
-                setattr(context, self.id, Connection(serverproxy, self.disconnect))
-                if dbdir is not None:
-                    current_conn = getattr(context, self.id, None)
-                    current_conn.conn._ServerProxy__transport.dbdir = dbdir
+                # Create a new serverproxy with the non-session URI.
+                self.__reconnect()
                 return self.forward(name, *args, **kw)
             raise NetworkError(uri=server, error=e.errmsg)
         except socket.error, e:
@@ -497,6 +497,19 @@ def _adjust_indices(start, end, length):
 
     return start, end
 
+# Parsing a DN string with str2dn and building the AVA's and RDN's is
+# comparatively expensive and the same handful of container and base
+# DN's are parsed over and over. Immutable RDN's can be safely shared
+# between DN's so the RDN's parsed from a string are interned here,
+# keyed by the UTF-8 encoded string. The cache is bounded, when it
+# fills up it is simply emptied.
+_DN_CACHE_SIZE = 4096
+_dn_cache = {}
+
+def _clear_dn_cache():
+    'discard every interned DN string'
+    _dn_cache.clear()
+
 class AVA(object):
     '''
     AVA(arg0, ...)
@@ -551,6 +564,8 @@ class AVA(object):
     The str method of an AVA returns the string representation in RFC 4514 DN
     syntax with proper escaping.
     '''
+    __slots__ = ('_attr_unicode', '_value_unicode', '_str', '_hash')
+
     is_mutable = False
     flags = 0
 
@@ -586,6 +601,8 @@ class AVA(object):
         else:
             raise TypeError("takes 1 or 2 arguments (%d given)" % (len(args)))
 
+        self._str = None
+        self._hash = None
         self._set_attr(attr)
         self._set_value(value)
 
@@ -606,6 +623,7 @@ class AVA(object):
                 self._attr_unicode = unicode(new_attr)
         except Exception, e:
             raise ValueError('unable to convert attr "%s" to unicode: %s' % (new_attr, e))
+        self._str = None
 
     attr  = property(_get_attr)
 
@@ -626,6 +644,7 @@ class AVA(object):
                 self._value_unicode  = unicode(new_value)
         except Exception, e:
             raise ValueError('unable to convert value "%s" to unicode: %s' % (new_value, e))
+        self._str = None
 
     value = property(_get_value)
 
@@ -633,11 +652,18 @@ class AVA(object):
         return [[(self._attr_unicode.encode('utf-8'), self._value_unicode.encode('utf-8'), self.flags)]]
 
     def __str__(self):
-        return dn2str(self._to_openldap())
+        # The string representation is memoized, the setters reset it
+        if self._str is None:
+            self._str = dn2str(self._to_openldap())
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
 
+    def __reduce__(self):
+        # Instances have no __dict__, pickle and copy via the constructor
+        return (self.__class__, (self._attr_unicode, self._value_unicode))
+
     def __getitem__(self, key):
         if isinstance(key, basestring):
             if key == self._attr_unicode:
@@ -653,8 +679,12 @@ class AVA(object):
         # Because attrs & values are comparison case-insensitive the
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
+        #
+        # Being immutable the hash is computed only once.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         '''
@@ -681,6 +711,9 @@ class AVA(object):
         if not isinstance(other, AVA):
             return False
 
+        if other is self:
+            return True
+
         # Perform comparison between objects of same type
         return self._attr_unicode.lower() == other.attr.lower() and \
             self._value_unicode.lower() == other.value.lower()
@@ -711,6 +744,8 @@ class EditableAVA(AVA):
     * The attr and value properties may be modified after object creation.
 
     '''
+    __slots__ = ()
+
     is_mutable = True
     __hash__ = None
 
@@ -824,22 +859,31 @@ class RDN(object):
     The str method of an RDN returns the string representation in RFC 4514 DN
     syntax with proper escaping.
     '''
+    __slots__ = ('avas', '_str', '_hash')
 
     is_mutable = False
     flags = 0
     AVA_type = AVA
 
     def __init__(self, *args, **kwds):
+        self._str = None
+        self._hash = None
         self.avas = self._avas_from_sequence(args)
         self.avas.sort()
 
+    def _copy_ava(self, ava):
+        # Immutable AVA's are shared rather than copied
+        if type(ava) is self.AVA_type and not ava.is_mutable:
+            return ava
+        return self.AVA_type(ava.attr, ava.value)
+
     def _ava_from_value(self, value):
         if isinstance(value, AVA):
-            return self.AVA_type(value.attr, value.value)
+            return self._copy_ava(value)
         elif isinstance(value, RDN):
             avas = []
             for ava in value.avas:
-                avas.append(self.AVA_type(ava.attr, ava.value))
+                avas.append(self._copy_ava(ava))
             if len(avas) == 1:
                 return avas[0]
             else:
@@ -883,11 +927,20 @@ class RDN(object):
         return [[(ava.attr.encode('utf-8'), ava.value.encode('utf-8'), self.flags) for ava in self.avas]]
 
     def __str__(self):
-        return dn2str(self._to_openldap())
+        # Only immutable RDN's memoize their string representation
+        if self.is_mutable:
+            return dn2str(self._to_openldap())
+        if self._str is None:
+            self._str = dn2str(self._to_openldap())
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
 
+    def __reduce__(self):
+        # Instances have no __dict__, pickle and copy via the constructor
+        return (self.__class__, tuple([(ava.attr, ava.value) for ava in self.avas]))
+
     def _next(self):
         for ava in self.avas:
             yield ava
@@ -942,8 +995,12 @@ class RDN(object):
         # Because attrs & values are comparison case-insensitive the
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
+        #
+        # Being immutable the hash is computed only once.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         # Try coercing string to RDN, if successful compare to coerced object
@@ -958,6 +1015,9 @@ class RDN(object):
         if not isinstance(other, RDN):
             return False
 
+        if other is self:
+            return True
+
         # Perform comparison between objects of same type
         return self.avas == other.avas
 
@@ -1010,6 +1070,7 @@ class EditableRDN(RDN):
 
     * The attr and value properties may be modified after object creation.
     '''
+    __slots__ = ()
 
     is_mutable = True
     __hash__ = None
@@ -1211,6 +1272,7 @@ class DN(object):
     The str method of an DN returns the string representation in RFC 4514 DN
     syntax with proper escaping.
     '''
+    __slots__ = ('rdns', '_str', '_hash')
 
     is_mutable = False
     flags = 0
@@ -1218,31 +1280,59 @@ class DN(object):
     RDN_type = RDN
 
     def __init__(self, *args, **kwds):
+        self._str = None
+        self._hash = None
         self.rdns = self._rdns_from_sequence(args)
 
+    def _copy_rdn(self, rdn):
+        # Immutable RDN's are shared rather than copied
+        if type(rdn) is self.RDN_type and not rdn.is_mutable:
+            return rdn
+        return self.RDN_type(rdn)
+
+    def _rdns_from_string(self, value):
+        dn_str = value.encode('utf-8')
+
+        # Only immutable RDN's are interned, mutable RDN's must be
+        # unique to the DN which owns them.
+        interned = not self.RDN_type.is_mutable
+        if interned:
+            key = (self.RDN_type, dn_str)
+            rdns = _dn_cache.get(key)
+            if rdns is not None:
+                return list(rdns)
+
+        rdns = []
+        try:
+            dn_list = str2dn(dn_str)
+            for rdn_list in dn_list:
+                avas = []
+                for ava_tuple in rdn_list:
+                    avas.append(self.AVA_type(ava_tuple[0], ava_tuple[1]))
+                rdn = self.RDN_type(*avas)
+                rdns.append(rdn)
+        except DECODING_ERROR:
+            raise ValueError("malformed RDN string = \"%s\"" % value)
+
+        if interned:
+            if len(_dn_cache) >= _DN_CACHE_SIZE:
+                _dn_cache.clear()
+            _dn_cache[key] = tuple(rdns)
+        return rdns
+
     def _rdn_from_value(self, value):
         if isinstance(value, RDN):
-            return self.RDN_type(value)
+            return self._copy_rdn(value)
         elif isinstance(value, DN):
             rdns = []
             for rdn in value.rdns:
-                rdns.append(self.RDN_type(rdn))
+                rdns.append(self._copy_rdn(rdn))
             if len(rdns) == 1:
                 return rdns[0]
             else:
                 return rdns
         elif isinstance(value, basestring):
-            rdns = []
-            try:
-                dn_list = str2dn(value.encode('utf-8'))
-                for rdn_list in dn_list:
-                    avas = []
-                    for ava_tuple in rdn_list:
-                        avas.append(self.AVA_type(ava_tuple[0], ava_tuple[1]))
-                    rdn = self.RDN_type(*avas)
-                    rdns.append(rdn)
-            except DECODING_ERROR:
-                raise ValueError("malformed RDN string = \"%s\"" % value)
+            rdns = self._rdns_from_string(value)
             if len(rdns) == 1:
                 return rdns[0]
             else:
@@ -1271,11 +1361,20 @@ class DN(object):
         return [[(ava.attr.encode('utf-8'), ava.value.encode('utf-8'), self.flags) for ava in rdn] for rdn in self.rdns]
 
     def __str__(self):
-        return dn2str(self._to_openldap())
+        # Only immutable DN's memoize their string representation
+        if self.is_mutable:
+            return dn2str(self._to_openldap())
+        if self._str is None:
+            self._str = dn2str(self._to_openldap())
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
 
+    def __reduce__(self):
+        # Instances have no __dict__, pickle and copy via the constructor
+        return (self.__class__, tuple(self.rdns))
+
     def _next(self):
         for rdn in self.rdns:
             yield rdn
@@ -1304,8 +1403,12 @@ class DN(object):
         # Because attrs & values are comparison case-insensitive the
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
+        #
+        # Being immutable the hash is computed only once.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         # Try coercing string to DN, if successful compare to coerced object
@@ -1320,6 +1423,9 @@ class DN(object):
         if not isinstance(other, DN):
             return False
 
+        if other is self:
+            return True
+
         # Perform comparison between objects of same type
         return self.rdns == other.rdns
 
@@ -1350,9 +1456,9 @@ class DN(object):
         result = self.__class__(self)
         if isinstance(other, DN):
             for rdn in other.rdns:
-                result.rdns.append(self.RDN_type(rdn))
+                result.rdns.append(self._copy_rdn(rdn))
         elif isinstance(other, RDN):
-            result.rdns.append(self.RDN_type(other))
+            result.rdns.append(self._copy_rdn(other))
         elif isinstance(other, basestring):
             dn = self.__class__(other)
             for rdn in dn.rdns:
@@ -1565,6 +1671,7 @@ class EditableDN(DN):
     * In-place addition modifes the lhs object.
 
     '''
+    __slots__ = ()
 
     is_mutable = True
     __hash__ = None
@@ -44,41 +44,41 @@ class update_service_principalalias(PostUpdate):
         while True:
             # run the search in loop to avoid issues when LDAP limits are hit
             # during update
+            count = 0
+            truncated = False
+            error = False
             try:
-                (entries, truncated) = ldap.find_entries(search_filter,
-                    ['objectclass', 'krbprincipalname'], base_dn,
-                    time_limit=0, size_limit=0)
-            except errors.NotFound:
-                root_logger.debug("update_service_principalalias: no service "
-                                  "to update found")
-                return (False, False, [])
+                # the services are retrieved page by page as they are updated
+                for dn, entry in ldap.iter_entries(search_filter,
+                        ['objectclass', 'krbprincipalname'], base_dn,
+                        time_limit=0, size_limit=0):
+                    count += 1
+                    update = {}
+                    update['objectclass'] = (entry['objectclass'] +
+                                             ['ipakrbprincipal'])
+                    update['ipakrbprincipalalias'] = entry['krbprincipalname']
+                    try:
+                        ldap.update_entry(dn, update)
+                    except (errors.EmptyModlist, errors.NotFound):
+                        pass
+                    except errors.ExecutionError, e:
+                        root_logger.debug("update_service_principalalias: cannot "
+                                          "update service: %s", e)
+                        error = True
+            except errors.LimitsExceeded:
+                truncated = True
             except errors.ExecutionError, e:
                 root_logger.error("update_service_principalalias: cannot "
                                   "retrieve list of affected services: %s", e)
                 return (False, False, [])
-            if not entries:
+            if not count:
                 # no entry was returned, rather break than continue cycling
                 root_logger.debug("update_service_principalalias: no service "
-                                  "was returned")
+                                  "to update found")
                 return (False, False, [])
             root_logger.debug("update_service_principalalias: found %d "
                               "services to update, truncated: %s",
-                              len(entries), truncated)
-
-            error = False
-            for dn, entry in entries:
-                update = {}
-                update['objectclass'] = (entry['objectclass'] +
-                                         ['ipakrbprincipal'])
-                update['ipakrbprincipalalias'] = entry['krbprincipalname']
-                try:
-                    ldap.update_entry(dn, update)
-                except (errors.EmptyModlist, errors.NotFound):
-                    pass
-                except errors.ExecutionError, e:
-                    root_logger.debug("update_service_principalalias: cannot "
-                                      "update service: %s", e)
-                    error = True
+                              count, truncated)
 
             if error:
                 # exit loop to avoid infinite cycles
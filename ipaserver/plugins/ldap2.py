@@ -27,7 +27,6 @@ Backend plugin for LDAP.
 # binding encodes them into the appropriate representation. This applies to
 # everything except the CrudBackend methods, where dn is part of the entry dict.
 
-import copy
 import os
 import socket
 import string
@@ -37,6 +36,9 @@ import time
 import re
 import pwd
 import sys
+import threading
+import hashlib
+import cPickle
 from decimal import Decimal
 
 import krbV
@@ -64,6 +66,24 @@ except ImportError:
     class GetEffectiveRightsControl(LDAPControl):
         def __init__(self, criticality, authzId=None):
             LDAPControl.__init__(self, '1.3.6.1.4.1.42.2.27.9.5.2', criticality, authzId)
+try:
+    from ldap.controls.libldap import SimplePagedResultsControl #pylint: disable=F0401,E0611
+except ImportError:
+    # The API of the paged results control changed in python-ldap 2.4,
+    # searches are not paged with older versions.
+    SimplePagedResultsControl = None
+try:
+    from ldap.controls.readentry import PostReadControl #pylint: disable=F0401,E0611
+except ImportError:
+    # The read entry controls need python-ldap 2.4 with pyasn1, entries
+    # are read back with a search without it.
+    PostReadControl = None
+try:
+    from ldap.controls.sss import SSSRequestControl, SSSResponseControl #pylint: disable=F0401,E0611
+    from ldap.controls.vlv import VLVRequestControl, VLVResponseControl #pylint: disable=F0401,E0611
+except ImportError:
+    # Without server side sorting and VLV entries are sorted and cut here
+    SSSRequestControl = None
 # for backward compatibility
 from ipalib import _
 
@@ -72,6 +92,7 @@ import krbV
 from ipalib import api, errors
 from ipalib.crud import CrudBackend
 from ipalib.request import context
+from ipalib.krb_utils import KRB5_CCache
 
 _debug_log_ldap = False
 
@@ -95,6 +116,14 @@ SASL_AUTH = _ldap_sasl.sasl({}, 'GSSAPI')
 
 DN_SYNTAX_OID = '1.3.6.1.4.1.1466.115.121.1.12'
 
+# Directory where the server keeps parsed LDAP schemas between processes
+SCHEMA_CACHE_DIR = '/var/cache/ipa/schema'
+# Bump when the format of the files in SCHEMA_CACHE_DIR changes
+SCHEMA_CACHE_VERSION = 1
+# Directory where the server marks changes of the IPA configuration entry
+# for other processes
+CONFIG_STAMP_DIR = '/var/cache/ipa/config'
+
 def unicode_from_utf8(val):
     '''
     val is a UTF-8 encoded string, return a unicode object.
@@ -134,6 +163,35 @@ class _ServerSchema(object):
         self.schema = schema
         self.retrieve_timestamp = time.time()
 
+        # Lower case attribute name or OID -> syntax OID, computed once
+        # here rather than searching the schema for every attribute of
+        # every entry.
+        self.syntaxes = {}
+        for oid in schema.listall(_ldap.schema.AttributeType):
+            obj = schema.get_obj(_ldap.schema.AttributeType, oid)
+            if obj is None:
+                continue
+            self.syntaxes[oid.lower()] = obj.syntax
+            for name in obj.names:
+                self.syntaxes[name.lower()] = obj.syntax
+
+        # Lower case attribute name -> value converter, filled in by
+        # IPASimpleLDAPObject.get_converter() as attributes are seen.
+        self.converters = {}
+
+    def get_syntax(self, attr):
+        '''
+        Return the syntax OID of attribute attr, None if the attribute
+        is unknown or has no syntax.
+        '''
+        try:
+            return self.syntaxes[attr.lower()]
+        except KeyError:
+            obj = self.schema.get_obj(_ldap.schema.AttributeType, attr)
+            if obj is not None:
+                return obj.syntax
+            return None
+
 class SchemaCache(object):
     '''
     Cache the schema's from individual LDAP servers.
@@ -153,6 +211,14 @@ class SchemaCache(object):
         it.
         '''
 
+        return self.get_server_schema(url, conn, force_update).schema
+
+    def get_server_schema(self, url, conn=None, force_update=False):
+        '''
+        Like get_schema() but return the _ServerSchema object holding
+        the schema and the lookup tables derived from it.
+        '''
+
         if force_update:
             self.flush(url)
 
@@ -161,7 +227,7 @@ class SchemaCache(object):
             schema = self._retrieve_schema_from_server(url, conn)
             server_schema = _ServerSchema(url, schema)
             self.servers[url] = server_schema
-        return server_schema.schema
+        return server_schema
 
     def flush(self, url):
         self.debug('flushing %s from SchemaCache', url)
@@ -218,6 +284,18 @@ class SchemaCache(object):
                     conn.set_option(_ldap.OPT_HOST_NAME, api.env.host)
                 conn.sasl_interactive_bind_s(None, SASL_AUTH)
 
+            # The parsed schema stored in a file is only valid as long
+            # as the server's schema has not been modified since.
+            stamp = None
+            if self._use_schema_file():
+                stamp = self._get_schema_stamp(conn)
+            if stamp is not None:
+                schema = self._read_schema_file(url, stamp)
+                if schema is not None:
+                    if not has_conn:
+                        conn.unbind_s()
+                    return schema
+
             schema_entry = conn.search_s('cn=schema', _ldap.SCOPE_BASE,
                                          attrlist=['attributetypes', 'objectclasses'])[0]
             if not has_conn:
@@ -239,10 +317,301 @@ class SchemaCache(object):
             if tmpdir:
                 shutil.rmtree(tmpdir)
 
-        return _ldap.schema.SubSchema(schema_entry[1])
+        schema = _ldap.schema.SubSchema(schema_entry[1])
+        if stamp is not None:
+            self._write_schema_file(url, stamp, schema)
+        return schema
+
+    def _use_schema_file(self):
+        '''
+        Apache worker processes share the parsed schema through a file.
+        '''
+        return api.env.context == 'server'
+
+    def _get_schema_stamp(self, conn):
+        '''
+        Return a value identifying the current version of the schema of
+        the server conn is connected to, None if it cannot be determined.
+        '''
+        try:
+            schema_entry = conn.search_s('cn=schema', _ldap.SCOPE_BASE,
+                                         attrlist=['modifytimestamp', 'nsschemacsn'])[0]
+        except (_ldap.LDAPError, IndexError):
+            return None
+        attrs = CIDict(schema_entry[1])
+        stamp = (attrs.get('modifytimestamp', [None])[0],
+                 attrs.get('nsschemacsn', [None])[0])
+        if stamp == (None, None):
+            return None
+        return stamp
+
+    def _get_schema_file(self, url):
+        return os.path.join(SCHEMA_CACHE_DIR, 'schema-%s' % hashlib.sha1(url).hexdigest())
+
+    def _read_schema_file(self, url, stamp):
+        '''
+        Return the schema of url stored by _write_schema_file() if it is
+        still current, None otherwise.
+        '''
+        filename = self._get_schema_file(url)
+        try:
+            f = open(filename, 'rb')
+            try:
+                (version, file_url, file_stamp, schema) = cPickle.load(f)
+            finally:
+                f.close()
+        except IOError:
+            return None
+        except Exception, e:
+            self.debug('ignoring unreadable schema file %s: %s', filename, e)
+            return None
+
+        if (version, file_url, file_stamp) != (SCHEMA_CACHE_VERSION, url, stamp):
+            return None
+        self.debug('loaded schema for url=%s from %s', url, filename)
+        return schema
+
+    def _write_schema_file(self, url, stamp, schema):
+        '''
+        Store schema of url for other processes, failures are not fatal.
+        '''
+        filename = self._get_schema_file(url)
+        try:
+            (fd, tmpname) = tempfile.mkstemp(dir=SCHEMA_CACHE_DIR)
+            try:
+                f = os.fdopen(fd, 'wb')
+                try:
+                    cPickle.dump((SCHEMA_CACHE_VERSION, url, stamp, schema), f,
+                                 cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                # replace atomically, readers never see a partial file
+                os.rename(tmpname, filename)
+            except:
+                os.unlink(tmpname)
+                raise
+        except Exception, e:
+            self.debug('unable to store schema for url=%s in %s: %s', url, filename, e)
 
 schema_cache = SchemaCache()
 
+class IPAConfigEntry(dict):
+    '''
+    Read-only copy of the IPA configuration entry attributes.
+
+    The entry is shared between requests, so neither the dict nor its
+    values may be modified. Values are stored as tuples. Callers which
+    need a modifiable copy should use copy.deepcopy().
+    '''
+
+    def __init__(self, entry_attrs):
+        dict.__init__(self, ((k, tuple(v)) for (k, v) in entry_attrs.iteritems()))
+
+    def _read_only(self, *args, **kw):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return dict((k, list(v)) for (k, v) in self.iteritems())
+
+class ConfigCache(object):
+    '''
+    Cache the IPA configuration entry of individual LDAP servers.
+
+    Entries expire after api.env.ipa_config_cache_ttl seconds, they are
+    flushed explicitly when the configuration is modified. A flush replaces
+    a stamp file in CONFIG_STAMP_DIR, so that the other server processes
+    drop their entry too. Checking the stamp costs one stat() per request.
+    '''
+
+    def __init__(self):
+        log_mgr.get_logger(self, True)
+        self.servers = {}
+
+    def _get_stamp_file(self, url):
+        return os.path.join(CONFIG_STAMP_DIR, 'config-%s' % hashlib.sha1(url).hexdigest())
+
+    def get_stamp(self, url):
+        '''
+        Return a value identifying the last flush of url in any process,
+        None if it was never flushed. Get the stamp before retrieving the
+        configuration entry passed to set_config().
+        '''
+        try:
+            st = os.stat(self._get_stamp_file(url))
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime)
+
+    def get_config(self, url):
+        '''
+        Return the cached configuration entry of a specific LDAP server
+        or None if there is no entry, it has expired or it was flushed by
+        another process.
+        '''
+        cached = self.servers.get(url)
+        if cached is None:
+            return None
+        (expires, stamp, config_entry) = cached
+        if time.time() >= expires or self.get_stamp(url) != stamp:
+            return None
+        return config_entry
+
+    def set_config(self, url, config_entry, ttl, stamp):
+        assert isinstance(config_entry, IPAConfigEntry)
+        self.servers[url] = (time.time() + ttl, stamp, config_entry)
+
+    def flush(self, url):
+        self.debug('flushing %s from ConfigCache', url)
+        try:
+            del self.servers[url]
+        except KeyError:
+            pass
+        # A new file rather than a new mtime, the inode changes even if the
+        # file system timestamps are coarse.
+        filename = self._get_stamp_file(url)
+        try:
+            (fd, tmpname) = tempfile.mkstemp(dir=CONFIG_STAMP_DIR)
+            os.close(fd)
+            try:
+                os.rename(tmpname, filename)
+            except:
+                os.unlink(tmpname)
+                raise
+        except Exception, e:
+            self.error('unable to update %s, other processes may use the '
+                       'old IPA configuration for up to %d seconds: %s',
+                       filename, api.env.ipa_config_cache_ttl, e)
+
+config_cache = ConfigCache()
+
+class LDAPConnectionPool(object):
+    '''
+    Per-process pool of bound LDAP connections.
+
+    Connections are kept under a key identifying the LDAP server and the
+    credentials they are bound with. At most api.env.ldap_pool_size idle
+    connections are kept, connections idle for longer than
+    api.env.ldap_pool_idle_timeout seconds or past their pool_expires
+    time (the end time of the credentials they were bound with) are
+    unbound. A connection is checked with a Who am I? extended operation
+    before it is handed out.
+    '''
+
+    def __init__(self):
+        log_mgr.get_logger(self, True)
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.count = 0
+
+    def _evict(self, now):
+        '''
+        Remove connections idle for too long from the pool and return
+        them. Must be called with the lock held.
+        '''
+        expired = []
+        timeout = api.env.ldap_pool_idle_timeout
+        for (key, conns) in self.idle.items():
+            keep = []
+            for (since, conn) in conns:
+                if now - since >= timeout or self._expired(conn, now):
+                    expired.append(conn)
+                else:
+                    keep.append((since, conn))
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+        self.count -= len(expired)
+        return expired
+
+    def _expired(self, conn, now):
+        return conn.pool_expires is not None and now >= conn.pool_expires
+
+    def _unbind(self, conns):
+        for conn in conns:
+            try:
+                conn.unbind_s()
+            except _ldap.LDAPError:
+                pass
+
+    def get_connection(self, key):
+        '''
+        Return a healthy idle connection stored under key or None.
+        '''
+        while True:
+            self.lock.acquire()
+            try:
+                expired = self._evict(time.time())
+                conn = None
+                conns = self.idle.get(key)
+                if conns:
+                    conn = conns.pop()[1]
+                    self.count -= 1
+                    if not conns:
+                        del self.idle[key]
+            finally:
+                self.lock.release()
+            self._unbind(expired)
+
+            if conn is None:
+                return None
+            try:
+                conn.whoami_s()
+                return conn
+            except _ldap.LDAPError, e:
+                self.debug('discarding pooled connection to %s: %s',
+                           conn.uri, e)
+                self._unbind([conn])
+
+    def put_connection(self, key, conn):
+        '''
+        Store the connection under key for later use, or unbind it if
+        the pool is full or its credentials have expired.
+        '''
+        if self._expired(conn, time.time()):
+            self._unbind([conn])
+            return
+        try:
+            # Do not leak controls set by the previous user
+            conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
+        except _ldap.LDAPError:
+            self._unbind([conn])
+            return
+        now = time.time()
+        self.lock.acquire()
+        try:
+            expired = self._evict(now)
+            if self.count < api.env.ldap_pool_size:
+                self.idle.setdefault(key, []).append((now, conn))
+                self.count += 1
+                conn = None
+        finally:
+            self.lock.release()
+        if conn is not None:
+            expired.append(conn)
+        self._unbind(expired)
+
+    def flush(self):
+        '''
+        Unbind all idle connections.
+        '''
+        self.lock.acquire()
+        try:
+            expired = [c[1] for conns in self.idle.values() for c in conns]
+            self.idle = {}
+            self.count = 0
+        finally:
+            self.lock.release()
+        self._unbind(expired)
+
+ldap_pool = LDAPConnectionPool()
+
 class IPASimpleLDAPObject(object):
     '''
     The purpose of this class is to provide a boundary between IPA and
@@ -319,16 +688,27 @@ class IPASimpleLDAPObject(object):
         log_mgr.get_logger(self, True)
         self.uri = uri
         self.conn = SimpleLDAPObject(uri)
-        self._schema = None
-
-    def _get_schema(self):
-        if self._schema is None:
+        self._server_schema = None
+        # key in ldap_pool, set for connections which may be pooled
+        self.pool_key = None
+        # time after which the connection must not be reused from ldap_pool
+        self.pool_expires = None
+        # ldap2.create_connection() arguments the connection was made with,
+        # except for bind_pw which is never kept
+        self.connect_kw = None
+
+    def _get_server_schema(self):
+        if self._server_schema is None:
             # The schema may be updated during install or during
             # updates, make sure we have a current version of the
             # schema, not an out of date cached version.
             force_update = api.env.context in ('installer', 'updates')
-            self._schema = schema_cache.get_schema(self.uri, self.conn, force_update=force_update)
-        return self._schema
+            self._server_schema = schema_cache.get_server_schema(
+                self.uri, self.conn, force_update=force_update)
+        return self._server_schema
+
+    def _get_schema(self):
+        return self._get_server_schema().schema
 
     schema = property(_get_schema, None, None, 'schema associated with this LDAP server')
 
@@ -358,7 +738,7 @@ class IPASimpleLDAPObject(object):
         # logical operations that have the potential to cause a schema
         # change.
 
-        self._schema = None
+        self._server_schema = None
 
     def get_syntax(self, attr):
         # Is this a special case attribute?
@@ -367,11 +747,20 @@ class IPASimpleLDAPObject(object):
             return syntax
 
         # Try to lookup the syntax in the schema returned by the server
-        obj = self.schema.get_obj(_ldap.schema.AttributeType, attr)
-        if obj is not None:
-            return obj.syntax
-        else:
-            return None
+        return self._get_server_schema().get_syntax(attr)
+
+    def get_converter(self, attr):
+        '''
+        Return the callable converting values of attribute attr to their
+        IPA python type. The converters are cached per schema.
+        '''
+        server_schema = self._get_server_schema()
+        key = attr.lower()
+        converter = server_schema.converters.get(key)
+        if converter is None:
+            converter = self._SYNTAX_MAPPING.get(self.get_syntax(attr), unicode_from_utf8)
+            server_schema.converters[key] = converter
+        return converter
 
     def has_dn_syntax(self, attr):
         """
@@ -414,6 +803,17 @@ class IPASimpleLDAPObject(object):
         '''
         '''
 
+        # Convert all the values at once, only if that fails go through
+        # them one by one to report the offending value.
+        try:
+            if isinstance(target_type, type):
+                return [value if isinstance(value, target_type) else target_type(value)
+                        for value in values]
+            else:
+                return [target_type(value) for value in values]
+        except Exception:
+            pass
+
         ipa_values = []
 
         for original_value in values:
@@ -457,8 +857,8 @@ class IPASimpleLDAPObject(object):
             ipa_dn = DN(original_dn)
             ipa_attrs = dict()
 
-            for attr, original_values in original_attrs.items():
-                target_type = self._SYNTAX_MAPPING.get(self.get_syntax(attr), unicode_from_utf8)
+            for attr, original_values in original_attrs.iteritems():
+                target_type = self.get_converter(attr)
                 ipa_attrs[attr.lower()] = self.convert_value_list(attr, target_type, original_values)
 
             ipa_result.append(LDAPEntry(ipa_dn, ipa_attrs))
@@ -515,6 +915,12 @@ class IPASimpleLDAPObject(object):
     def get_option(self, option):
         return self.conn.get_option(option)
 
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        assert isinstance(dn, DN)
+        dn = str(dn)
+        modlist = [(x[0], self.encode(x[1]), self.encode(x[2])) for x in modlist]
+        return self.conn.modify_ext(dn, modlist, serverctrls, clientctrls)
+
     def modify_s(self, dn, modlist):
         assert isinstance(dn, DN)
         dn = str(dn)
@@ -545,11 +951,19 @@ class IPASimpleLDAPObject(object):
         newrdn = str(newrdn)
         return self.conn.rename_s(dn, newrdn, newsuperior, delold)
 
+    def abandon(self, msgid):
+        return self.conn.abandon(msgid)
+
     def result(self, msgid=_ldap.RES_ANY, all=1, timeout=None):
         resp_type, resp_data = self.conn.result(msgid, all, timeout)
         resp_data = self.convert_result(resp_data)
         return resp_type, resp_data
 
+    def result3(self, msgid=_ldap.RES_ANY, all=1, timeout=None):
+        resp_type, resp_data, resp_msgid, resp_ctrls = self.conn.result3(msgid, all, timeout)
+        resp_data = self.convert_result(resp_data)
+        return resp_type, resp_data, resp_msgid, resp_ctrls
+
     def sasl_interactive_bind_s(self, who, auth, serverctrls=None, clientctrls=None, sasl_flags=_ldap.SASL_QUIET):
         self.flush_cached_schema()
         if who is None:
@@ -627,6 +1041,9 @@ class IPASimpleLDAPObject(object):
         self.flush_cached_schema()
         return self.conn.unbind_s()
 
+    def whoami_s(self, serverctrls=None, clientctrls=None):
+        return self.conn.whoami_s(serverctrls, clientctrls)
+
 class ldap2(CrudBackend):
     """
     LDAP Backend Take 2.
@@ -792,6 +1209,10 @@ class ldap2(CrudBackend):
         tls_keyfile - TLS bind key filename
         autobind - autobind as the current user
 
+        In the server, connections bound with a ccache are taken from and
+        returned to a per-process pool of connections bound with the same
+        ccache, until its credentials expire, see LDAPConnectionPool.
+
         Extends backend.Connectible.create_connection.
         """
         if bind_dn is None:
@@ -807,6 +1228,36 @@ class ldap2(CrudBackend):
         if debug_level:
             _ldap.set_option(_ldap.OPT_DEBUG_LEVEL, debug_level)
 
+        connect_kw = dict(ccache=ccache, bind_dn=bind_dn,
+                          tls_cacertfile=tls_cacertfile,
+                          tls_certfile=tls_certfile, tls_keyfile=tls_keyfile,
+                          debug_level=debug_level, autobind=autobind)
+
+        pool_key = None
+        pool_expires = None
+        if ccache is not None and self._use_pool():
+            try:
+                cc = KRB5_CCache(ccache)
+                principal = cc.principal.name
+                endtime = cc.endtime(api.env.host, api.env.realm)
+            except (krbV.Krb5Error, ValueError), e:
+                self.debug('not using connection pool: %s', e)
+            else:
+                if endtime > time.time():
+                    # A pooled connection is only reused with the same
+                    # credentials, i.e. not once the ccache was changed or
+                    # renewed, and not after they expired.
+                    pool_key = (self.ldap_uri, principal, cc.ccache_str(),
+                                endtime)
+                    pool_expires = endtime
+            if pool_key is not None:
+                conn = ldap_pool.get_connection(pool_key)
+                if conn is not None:
+                    os.environ['KRB5CCNAME'] = ccache
+                    setattr(context, 'principal', principal)
+                    conn.connect_kw = connect_kw
+                    return conn
+
         try:
             conn = IPASimpleLDAPObject(self.ldap_uri)
             if self.ldap_uri.startswith('ldapi://') and ccache:
@@ -826,6 +1277,8 @@ class ldap2(CrudBackend):
                 principal = krbV.CCache(name=ccache,
                             context=krbV.default_context()).principal().name
                 setattr(context, 'principal', principal)
+                conn.pool_key = pool_key
+                conn.pool_expires = pool_expires
             else:
                 # no kerberos ccache, use simple bind or external sasl
                 if autobind:
@@ -834,6 +1287,7 @@ class ldap2(CrudBackend):
                     conn.sasl_interactive_bind_s(None, auth_tokens)
                 else:
                     conn.simple_bind_s(bind_dn, bind_pw)
+            conn.connect_kw = connect_kw
 
         except _ldap.LDAPError, e:
             self.handle_errors(e)
@@ -841,13 +1295,45 @@ class ldap2(CrudBackend):
         return conn
 
     def destroy_connection(self):
-        """Disconnect from LDAP server."""
+        """
+        Disconnect from LDAP server.
+
+        Connections bound with Kerberos credentials are returned to the
+        connection pool instead, see create_connection().
+        """
+        if self.conn.pool_key is not None and self._use_pool():
+            ldap_pool.put_connection(self.conn.pool_key, self.conn)
+            return
         try:
             self.conn.unbind_s()
         except _ldap.LDAPError:
             # ignore when trying to unbind multiple times
             pass
 
+    def _use_pool(self):
+        """
+        Connections are only pooled in the long running server processes.
+        """
+        return (api.env.context in ('server', 'lite') and
+                api.env.ldap_pool_size > 0)
+
+    def create_handle(self, bind_pw=None):
+        """
+        Return a new LDAPHandle to the same server, which connects with
+        the credentials of the connection of the current thread.
+
+        Unlike this backend, a handle keeps its connection to itself
+        rather than in the thread-local request context. It may be handed
+        to another thread, e.g. a worker of a thread pool, and handles
+        may be used concurrently. A single handle must only be used by
+        one thread at a time.
+
+        The password of a connection made with a simple bind is not kept,
+        it has to be passed again as bind_pw.
+        """
+        return LDAPHandle(self.ldap_uri, self.base_dn, self.conn.connect_kw,
+                          bind_pw=bind_pw)
+
     def normalize_dn(self, dn):
         """
         Normalize distinguished name by assuring it ends with
@@ -901,8 +1387,44 @@ class ldap2(CrudBackend):
         parent_dn = self.normalize_dn(parent_dn)
         return DN((primary_key, entry_attrs[primary_key]), parent_dn)
 
-    def add_entry(self, dn, entry_attrs, normalize=True):
-        """Create a new entry."""
+    def _get_post_read_controls(self, return_attrs):
+        """
+        Return the server controls requesting the attributes return_attrs
+        of the entry as it is after a write operation (RFC 4527).
+        """
+        if return_attrs is None or PostReadControl is None:
+            return None
+        # not critical, the entry is searched for when the server ignores it
+        return [PostReadControl(False, attrList=list(set(return_attrs)))]
+
+    def _get_post_read_entry(self, res_ctrls, dn, return_attrs, normalize):
+        """
+        Return the entry (dn, entry_attrs) sent in the post-read control
+        of a write operation response, retrieve it with get_entry if the
+        server did not send it.
+        """
+        if PostReadControl is not None:
+            for ctrl in res_ctrls or []:
+                if ctrl.controlType != PostReadControl.controlType:
+                    continue
+                entry = self.conn.convert_result([(ctrl.dn, ctrl.entry)])[0]
+                (time_limit, size_limit) = self._get_search_limits(None, None)
+                self._get_indirect_members(entry, list(set(return_attrs)),
+                                           time_limit, size_limit, normalize)
+                return entry
+
+        return self.get_entry(dn, return_attrs, normalize=normalize)
+
+    def add_entry(self, dn, entry_attrs, normalize=True, return_attrs=None):
+        """
+        Create a new entry.
+
+        Keyword arguments:
+        return_attrs -- list of attributes of the new entry to return as
+                        (dn, entry_attrs), nothing is returned when None
+                        (default None). The entry is read in the same
+                        operation when the server supports it.
+        """
 
         assert isinstance(dn, DN)
 
@@ -914,11 +1436,18 @@ class ldap2(CrudBackend):
             (k, v) for (k, v) in entry_attrs.iteritems()
             if v is not None and v != []
         )
+        serverctrls = self._get_post_read_controls(return_attrs)
         try:
-            self.conn.add_s(dn, list(entry_attrs.iteritems()))
+            msgid = self.conn.add_ext(dn, list(entry_attrs.iteritems()),
+                                      serverctrls=serverctrls)
+            res_ctrls = self.conn.result3(msgid)[3]
         except _ldap.LDAPError, e:
             self.handle_errors(e)
 
+        if return_attrs is not None:
+            return self._get_post_read_entry(res_ctrls, dn, return_attrs,
+                                             normalize)
+
     # generating filters for find_entry
     # some examples:
     # f1 = ldap2.make_filter_from_attr(u'firstName', u'Pavel')
@@ -1028,9 +1557,81 @@ class ldap2(CrudBackend):
                     )
         return self.combine_filters(flts, rules)
 
+    def _get_search_limits(self, time_limit, size_limit):
+        """
+        Return the (time_limit, size_limit) to pass to python-ldap, using
+        the IPA config values for the limits which are None.
+        """
+        if time_limit is None or size_limit is None:
+            (cdn, config) = self.get_ipa_config()
+            if time_limit is None:
+                time_limit = config.get('ipasearchtimelimit', [-1])[0]
+            if size_limit is None:
+                size_limit = config.get('ipasearchrecordslimit', [0])[0]
+        if time_limit == 0:
+            time_limit = -1
+        if not isinstance(size_limit, int):
+            size_limit = int(size_limit)
+        if not isinstance(time_limit, float):
+            time_limit = float(time_limit)
+        return (time_limit, size_limit)
+
+    def _get_indirect_members(self, entry, attrs_list, time_limit, size_limit,
+            normalize):
+        """
+        Fill in the memberindirect and memberofindirect attributes of
+        the search result entry (dn, entry_attrs) when they were requested.
+        """
+        if not attrs_list:
+            return
+        (dn, entry_attrs) = entry
+        if 'memberindirect' in attrs_list or '*' in attrs_list:
+            if 'member' in entry_attrs:
+                members = entry_attrs['member']
+                indirect = self.get_members(dn, members, membertype=MEMBERS_INDIRECT,
+                    time_limit=time_limit, size_limit=size_limit, normalize=normalize)
+                if len(indirect) > 0:
+                    entry_attrs['memberindirect'] = indirect
+        if 'memberofindirect' in attrs_list or '*' in attrs_list:
+            if 'memberof' in entry_attrs:
+                memberof = entry_attrs['memberof']
+                del entry_attrs['memberof']
+            elif 'memberOf' in entry_attrs:
+                memberof = entry_attrs['memberOf']
+                del entry_attrs['memberOf']
+            else:
+                return
+            (direct, indirect) = self.get_memberof(dn, memberof, time_limit=time_limit,
+                                                   size_limit=size_limit, normalize=normalize)
+            if len(direct) > 0:
+                entry_attrs['memberof'] = direct
+            if len(indirect) > 0:
+                entry_attrs['memberofindirect'] = indirect
+
+    def _sort_entries(self, entries, sort_keys):
+        """
+        Sort the list of entries (dn, entry_attrs) in place like a server
+        would for the server side sort control with sort_keys, comparing
+        the first values of the attributes case-insensitively.
+        """
+        for sort_key in reversed(sort_keys):
+            reverse = sort_key.startswith('-')
+            attr = sort_key.lstrip('-').split(':')[0].lower()
+            def key(entry):
+                values = entry[1].get(attr)
+                if not values:
+                    # entries without the attribute come last (RFC 2891)
+                    return (True, None)
+                value = values[0]
+                if isinstance(value, basestring):
+                    value = value.lower()
+                return (False, value)
+            entries.sort(key=key, reverse=reverse)
+
     def find_entries(self, filter=None, attrs_list=None, base_dn=None,
             scope=_ldap.SCOPE_SUBTREE, time_limit=None, size_limit=None,
-            normalize=True, search_refs=False):
+            normalize=True, search_refs=False, paged_search=False,
+            sort_keys=None, offset=None):
         """
         Return a list of entries and indication of whether the results were
         truncated ([(dn, entry_attrs)], truncated) matching specified search
@@ -1045,7 +1646,36 @@ class ldap2(CrudBackend):
         size_limit -- size (number of entries returned) limit (default use IPA config values)
         normalize -- normalize the DN (default True)
         search_refs -- allow search references to be returned (default skips these entries)
+        paged_search -- retrieve the entries with a paged search, see
+                        iter_entries, ignored with offset and without
+                        python-ldap 2.4 (default False)
+        sort_keys -- list of attributes, optionally prefixed with '-' for a
+                     reverse order, to sort the entries by. The server sorts
+                     them (RFC 2891) if it can. (default None)
+        offset -- number of entries to skip at the beginning of the
+                  result, size_limit then applies to the entries which
+                  follow. The server returns just this window of the
+                  sorted entries when it supports VLV. (default None)
         """
+        if (paged_search and SimplePagedResultsControl is not None and
+            offset is None):
+            res = []
+            truncated = False
+            server_sorted = True
+            try:
+                for (page, page_sorted) in self._iter_pages(filter,
+                        attrs_list, base_dn, scope, time_limit, size_limit,
+                        normalize, search_refs, None, sort_keys):
+                    res.extend(page)
+                    server_sorted = server_sorted and page_sorted
+            except errors.LimitsExceeded:
+                truncated = True
+            if sort_keys and not server_sorted:
+                self._sort_entries(res, sort_keys)
+            if not res and not truncated:
+                raise errors.NotFound(reason='no such entry')
+            return (res, truncated)
+
         if base_dn is None:
             base_dn = DN()
         assert isinstance(base_dn, DN)
@@ -1056,30 +1686,38 @@ class ldap2(CrudBackend):
         res = []
         truncated = False
 
-        if time_limit is None or size_limit is None:
-            (cdn, config) = self.get_ipa_config()
-            if time_limit is None:
-                time_limit = config.get('ipasearchtimelimit', [-1])[0]
-            if size_limit is None:
-                size_limit = config.get('ipasearchrecordslimit', [0])[0]
-        if time_limit == 0:
-            time_limit = -1
-        if not isinstance(size_limit, int):
-            size_limit = int(size_limit)
-        if not isinstance(time_limit, float):
-            time_limit = float(time_limit)
+        (time_limit, size_limit) = self._get_search_limits(time_limit, size_limit)
 
         if attrs_list:
             attrs_list = list(set(attrs_list))
 
+        search_size_limit = size_limit
+        serverctrls = None
+        if sort_keys and SSSRequestControl is not None:
+            # A window of entries has to be taken from sorted entries,
+            # otherwise the server may just as well sort them here.
+            serverctrls = [SSSRequestControl(offset is not None,
+                                             ordering_rules=sort_keys)]
+            if offset is not None and size_limit > 0:
+                serverctrls.append(VLVRequestControl(False,
+                    before_count=0, after_count=size_limit - 1,
+                    offset=offset + 1, content_count=0))
+        if offset is not None:
+            if sort_keys and SSSRequestControl is None:
+                # everything needs to be sorted here before the cut
+                search_size_limit = 0
+            elif size_limit > 0:
+                search_size_limit = offset + size_limit
+
         # pass arguments to python-ldap
+        res_ctrls = []
         try:
             id = self.conn.search_ext(
-                base_dn, scope, filter, attrs_list, timeout=time_limit,
-                sizelimit=size_limit
+                base_dn, scope, filter, attrs_list, serverctrls=serverctrls,
+                timeout=time_limit, sizelimit=search_size_limit
             )
             while True:
-                (objtype, res_list) = self.conn.result(id, 0)
+                (objtype, res_list, res_id, res_ctrls) = self.conn.result3(id, 0)
                 if not res_list:
                     break
                 if objtype == _ldap.RES_SEARCH_ENTRY or \
@@ -1091,38 +1729,265 @@ class ldap2(CrudBackend):
         except _ldap.LDAPError, e:
             self.handle_errors(e)
 
+        server_sorted = False
+        content_count = None
+        if serverctrls:
+            for ctrl in res_ctrls or []:
+                if ctrl.controlType == SSSResponseControl.controlType:
+                    server_sorted = ctrl.result == 0
+                elif ctrl.controlType == VLVResponseControl.controlType:
+                    if ctrl.result == 0:
+                        content_count = ctrl.content_count
+
+        if sort_keys and not server_sorted:
+            self._sort_entries(res, sort_keys)
+
+        if offset is not None:
+            if content_count is not None:
+                # the server returned the window, or the last entry when
+                # offset is past the end
+                if offset >= content_count:
+                    res = []
+                truncated = content_count > offset + len(res)
+            else:
+                if size_limit > 0:
+                    if len(res) > offset + size_limit:
+                        truncated = True
+                    res = res[offset:offset + size_limit]
+                else:
+                    res = res[offset:]
+
         if not res and not truncated:
             raise errors.NotFound(reason='no such entry')
 
-        if attrs_list and ('memberindirect' in attrs_list or '*' in attrs_list):
-            for r in res:
-                if not 'member' in r[1]:
-                    continue
-                else:
-                    members = r[1]['member']
-                    indirect = self.get_members(r[0], members, membertype=MEMBERS_INDIRECT,
-                        time_limit=time_limit, size_limit=size_limit, normalize=normalize)
-                    if len(indirect) > 0:
-                        r[1]['memberindirect'] = indirect
-        if attrs_list and ('memberofindirect' in attrs_list or '*' in attrs_list):
-            for r in res:
-                if 'memberof' in r[1]:
-                    memberof = r[1]['memberof']
-                    del r[1]['memberof']
-                elif 'memberOf' in r[1]:
-                    memberof = r[1]['memberOf']
-                    del r[1]['memberOf']
-                else:
-                    continue
-                (direct, indirect) = self.get_memberof(r[0], memberof, time_limit=time_limit,
-                                                       size_limit=size_limit, normalize=normalize)
-                if len(direct) > 0:
-                    r[1]['memberof'] = direct
-                if len(indirect) > 0:
-                    r[1]['memberofindirect'] = indirect
+        for r in res:
+            self._get_indirect_members(r, attrs_list, time_limit, size_limit,
+                                       normalize)
 
         return (res, truncated)
 
+    def iter_entries(self, filter=None, attrs_list=None, base_dn=None,
+            scope=_ldap.SCOPE_SUBTREE, time_limit=None, size_limit=None,
+            normalize=True, search_refs=False, page_size=None,
+            sort_keys=None):
+        """
+        Generate the entries (dn, entry_attrs) matching specified search
+        parameters.
+
+        The search is split into pages of page_size entries using the
+        Simple Paged Results control (RFC 2696). A page is requested only
+        when the previous one has been consumed, so no more than one page
+        of entries is held in memory at a time. No other operation is
+        outstanding on the connection while the entries are generated,
+        the consumer is free to use it.
+
+        Unlike find_entries no NotFound is raised when nothing matches.
+        When the search hits a limit errors.LimitsExceeded is raised
+        after the entries retrieved so far have been generated.
+
+        Keyword arguments are those of find_entries (time_limit applies to
+        each page), and:
+        page_size -- number of entries per page, 0 disables paging
+                     (default use ldap_page_size from the environment)
+        sort_keys -- sort the entries on the server like find_entries,
+                     the entries come unsorted if the server cannot sort
+                     them (default None)
+
+        Without python-ldap 2.4 the search is not paged.
+        """
+        pages = self._iter_pages(filter, attrs_list, base_dn, scope,
+                                 time_limit, size_limit, normalize,
+                                 search_refs, page_size, sort_keys)
+        try:
+            for (page, server_sorted) in pages:
+                for r in page:
+                    yield r
+        finally:
+            # releases the server side state of the paged search when the
+            # consumer stopped early
+            pages.close()
+
+    def _iter_pages(self, filter, attrs_list, base_dn, scope, time_limit,
+            size_limit, normalize, search_refs, page_size, sort_keys):
+        """
+        Generate the pages of entries of iter_entries as (entries,
+        server_sorted) tuples, server_sorted is True if the server sorted
+        the entries by sort_keys.
+        """
+        if base_dn is None:
+            base_dn = DN()
+        assert isinstance(base_dn, DN)
+        if normalize:
+            base_dn = self.normalize_dn(base_dn)
+        if not filter:
+            filter = '(objectClass=*)'
+        if page_size is None:
+            page_size = api.env.ldap_page_size
+        if SimplePagedResultsControl is None:
+            page_size = 0
+
+        (time_limit, size_limit) = self._get_search_limits(time_limit, size_limit)
+
+        if attrs_list:
+            attrs_list = list(set(attrs_list))
+
+        # Server side sorting (RFC 2891) combines with paging, the server
+        # sorts all entries once and returns them page by page. It has to
+        # be requested with every page.
+        sortctrls = []
+        if sort_keys and SSSRequestControl is not None:
+            sortctrls = [SSSRequestControl(False, ordering_rules=sort_keys)]
+
+        count = 0
+        cookie = ''
+        truncated = False
+        while True:
+            serverctrls = list(sortctrls)
+            if page_size > 0:
+                # not critical, servers without paging return everything
+                serverctrls.append(SimplePagedResultsControl(
+                    False, size=page_size, cookie=cookie))
+
+            page = []
+            cookie = ''
+            server_sorted = False
+            msgid = None
+            try:
+                msgid = self.conn.search_ext(
+                    base_dn, scope, filter, attrs_list,
+                    serverctrls=serverctrls or None,
+                    timeout=time_limit, sizelimit=size_limit
+                )
+                while True:
+                    (objtype, res_list, res_msgid, res_ctrls) = \
+                        self.conn.result3(msgid, 0)
+                    if not res_list:
+                        break
+                    if objtype == _ldap.RES_SEARCH_ENTRY or \
+                       (search_refs and objtype == _ldap.RES_SEARCH_REFERENCE):
+                        if size_limit > 0 and count >= size_limit:
+                            # the server did not enforce the size limit
+                            self.conn.abandon(msgid)
+                            truncated = True
+                            break
+                        count += 1
+                        page.append(res_list[0])
+                msgid = None
+                for ctrl in res_ctrls or []:
+                    if (not truncated and page_size > 0 and
+                        ctrl.controlType == SimplePagedResultsControl.controlType):
+                        cookie = ctrl.cookie
+                    elif (sortctrls and
+                          ctrl.controlType == SSSResponseControl.controlType):
+                        server_sorted = ctrl.result == 0
+            except (_ldap.ADMINLIMIT_EXCEEDED, _ldap.TIMELIMIT_EXCEEDED,
+                    _ldap.SIZELIMIT_EXCEEDED), e:
+                truncated = True
+            except _ldap.LDAPError, e:
+                if msgid is not None:
+                    self.conn.abandon(msgid)
+                self.handle_errors(e)
+
+            for r in page:
+                self._get_indirect_members(r, attrs_list, time_limit,
+                                           size_limit, normalize)
+            try:
+                yield (page, server_sorted)
+            except GeneratorExit:
+                # the consumer stopped early, release the server side
+                # state of the paged search by requesting an empty page
+                if cookie:
+                    try:
+                        self.conn.search_ext_s(
+                            base_dn, scope, filter, attrs_list,
+                            serverctrls=sortctrls + [SimplePagedResultsControl(
+                                False, size=0, cookie=cookie)]
+                        )
+                    except _ldap.LDAPError:
+                        pass
+                raise
+
+            if truncated:
+                raise errors.LimitsExceeded()
+            if not cookie:
+                break
+
+    def find_entries_many(self, searches, time_limit=None, size_limit=None,
+            normalize=True):
+        """
+        Run several searches and return their results as a list of
+        ([(dn, entry_attrs)], truncated), in the order of searches.
+
+        All the searches are sent on the connection before their results
+        are read, so they cost about one round trip to the server instead
+        of one each. Unlike find_entries no NotFound is raised, the list
+        of entries of a search without any match is empty.
+
+        searches -- list of dicts with the filter, attrs_list, base_dn and
+                    scope arguments of each search, see find_entries
+        The other keyword arguments are those of find_entries and apply to
+        all the searches.
+        """
+        (time_limit, size_limit) = self._get_search_limits(time_limit, size_limit)
+
+        requests = []
+        for search in searches:
+            base_dn = search.get('base_dn')
+            if base_dn is None:
+                base_dn = DN()
+            assert isinstance(base_dn, DN)
+            if normalize:
+                base_dn = self.normalize_dn(base_dn)
+            attrs_list = search.get('attrs_list')
+            if attrs_list:
+                attrs_list = list(set(attrs_list))
+            requests.append((search.get('filter') or '(objectClass=*)',
+                             attrs_list, base_dn,
+                             search.get('scope', _ldap.SCOPE_SUBTREE)))
+
+        # pass arguments to python-ldap
+        msgids = []
+        try:
+            for (filter, attrs_list, base_dn, scope) in requests:
+                msgids.append(self.conn.search_ext(
+                    base_dn, scope, filter, attrs_list, timeout=time_limit,
+                    sizelimit=size_limit
+                ))
+        except _ldap.LDAPError, e:
+            for msgid in msgids:
+                self.conn.abandon(msgid)
+            self.handle_errors(e)
+
+        results = []
+        for (i, msgid) in enumerate(msgids):
+            res = []
+            truncated = False
+            try:
+                while True:
+                    (objtype, res_list) = self.conn.result(msgid, 0)
+                    if not res_list:
+                        break
+                    if objtype == _ldap.RES_SEARCH_ENTRY:
+                        res.append(res_list[0])
+            except (_ldap.ADMINLIMIT_EXCEEDED, _ldap.TIMELIMIT_EXCEEDED,
+                    _ldap.SIZELIMIT_EXCEEDED), e:
+                truncated = True
+            except _ldap.NO_SUCH_OBJECT:
+                pass
+            except _ldap.LDAPError, e:
+                for msgid in msgids[i + 1:]:
+                    self.conn.abandon(msgid)
+                self.handle_errors(e)
+            results.append((res, truncated))
+
+        # only now that no search is outstanding
+        for ((res, truncated), request) in zip(results, requests):
+            for r in res:
+                self._get_indirect_members(r, request[1], time_limit,
+                                           size_limit, normalize)
+
+        return results
+
     def find_entry_by_attr(self, attr, value, object_class, attrs_list=None, base_dn=None):
         """
         Find entry (dn, entry_attrs) by attribute and object class.
@@ -1170,7 +2035,15 @@ class ldap2(CrudBackend):
 
     config_defaults = {'ipasearchtimelimit': [2], 'ipasearchrecordslimit': [0]}
     def get_ipa_config(self, attrs_list=None):
-        """Returns the IPA configuration entry (dn, entry_attrs)."""
+        """
+        Returns the IPA configuration entry (dn, entry_attrs).
+
+        entry_attrs is a read-only IPAConfigEntry shared with other
+        callers. It is cached for the rest of the request and, outside
+        of the installer and updates, for api.env.ipa_config_cache_ttl
+        seconds across requests. The whole entry is always retrieved,
+        attrs_list is accepted for backward compatibility only.
+        """
 
         odn = api.Object.config.get_dn()
         assert isinstance(odn, DN)
@@ -1179,26 +2052,54 @@ class ldap2(CrudBackend):
 
         try:
             config_entry = getattr(context, 'config_entry')
-            return (cdn, copy.deepcopy(config_entry))
+            return (cdn, config_entry)
         except AttributeError:
             # Not in our context yet
             pass
-        try:
-            (entry, truncated) = self.find_entries(
-                None, attrs_list, base_dn=cdn, scope=self.SCOPE_BASE,
-                time_limit=2, size_limit=10
-            )
-            if truncated:
-                raise errors.LimitsExceeded()
-            (cdn, config_entry) = entry[0]
-        except errors.NotFound:
-            config_entry = {}
-        for a in self.config_defaults:
-            if a not in config_entry:
-                config_entry[a] = self.config_defaults[a]
-        setattr(context, 'config_entry', copy.deepcopy(config_entry))
+
+        # The configuration may be modified by the installer or updates
+        # without going through config_mod, never share it there.
+        shared = api.env.context not in ('installer', 'updates')
+
+        config_entry = None
+        if shared:
+            config_entry = config_cache.get_config(self.ldap_uri)
+        if config_entry is None:
+            # Taken before the entry is retrieved, so that a concurrent
+            # config_mod in another process is not missed
+            stamp = config_cache.get_stamp(self.ldap_uri)
+            try:
+                (entry, truncated) = self.find_entries(
+                    None, None, base_dn=cdn, scope=self.SCOPE_BASE,
+                    time_limit=2, size_limit=10
+                )
+                if truncated:
+                    raise errors.LimitsExceeded()
+                (cdn, config_entry) = entry[0]
+            except errors.NotFound:
+                config_entry = {}
+            for a in self.config_defaults:
+                if a not in config_entry:
+                    config_entry[a] = self.config_defaults[a]
+            config_entry = IPAConfigEntry(config_entry)
+            if shared:
+                config_cache.set_config(self.ldap_uri, config_entry,
+                                        api.env.ipa_config_cache_ttl, stamp)
+        setattr(context, 'config_entry', config_entry)
         return (cdn, config_entry)
 
+    def flush_ipa_config(self):
+        """
+        Forget the cached IPA configuration entry, the next call of
+        get_ipa_config() in this or any other server process retrieves it
+        from the server again.
+        """
+        config_cache.flush(self.ldap_uri)
+        try:
+            delattr(context, 'config_entry')
+        except AttributeError:
+            pass
+
     def has_upg(self):
         """Returns True/False whether User-Private Groups are enabled.
            This is determined based on whether the UPG Template exists.
@@ -1388,11 +2289,17 @@ class ldap2(CrudBackend):
 
         return modlist
 
-    def update_entry(self, dn, entry_attrs, normalize=True):
+    def update_entry(self, dn, entry_attrs, normalize=True, return_attrs=None):
         """
         Update entry's attributes.
 
         An attribute value set to None deletes all current values.
+
+        Keyword arguments:
+        return_attrs -- list of attributes of the updated entry to return
+                        as (dn, entry_attrs), nothing is returned when None
+                        (default None). The entry is read in the same
+                        operation when the server supports it.
         """
 
         assert isinstance(dn, DN)
@@ -1405,11 +2312,17 @@ class ldap2(CrudBackend):
             raise errors.EmptyModlist()
 
         # pass arguments to python-ldap
+        serverctrls = self._get_post_read_controls(return_attrs)
         try:
-            self.conn.modify_s(dn, modlist)
+            msgid = self.conn.modify_ext(dn, modlist, serverctrls=serverctrls)
+            res_ctrls = self.conn.result3(msgid)[3]
         except _ldap.LDAPError, e:
             self.handle_errors(e)
 
+        if return_attrs is not None:
+            return self._get_post_read_entry(res_ctrls, dn, return_attrs,
+                                             normalize)
+
     def delete_entry(self, dn, normalize=True):
         """Delete entry."""
 
@@ -1443,6 +2356,104 @@ class ldap2(CrudBackend):
         except _ldap.LDAPError, e:
             self.handle_errors(e)
 
+    def _modify_group_members(self, group_dn, member_attr, members, op):
+        """
+        Add (op is MOD_ADD) or remove (op is MOD_DELETE) the DNs in
+        members to/from the member_attr attribute of group_dn with a
+        single modification, independent of the size of the group.
+
+        If the server refuses the modification, e.g. because a value
+        already is (or is not) present or because of an access control
+        or constraint violation, the values are retried one at a time so
+        the offending ones can be told apart and the others still succeed.
+
+        Returns a list of (dn, exception) tuples for the members which
+        could not be added or removed.
+        """
+        if not members:
+            return []
+
+        if op == _ldap.MOD_ADD:
+            member_exc = _ldap.TYPE_OR_VALUE_EXISTS
+            member_error = errors.AlreadyGroupMember
+        else:
+            member_exc = _ldap.NO_SUCH_ATTRIBUTE
+            member_error = errors.NotGroupMember
+
+        try:
+            self.conn.modify_s(group_dn, [(op, member_attr, members)])
+        except _ldap.LDAPError, e:
+            if len(members) > 1:
+                failed = []
+                for member in members:
+                    failed.extend(self._modify_group_members(
+                        group_dn, member_attr, [member], op))
+                return failed
+            if isinstance(e, member_exc):
+                return [(members[0], member_error())]
+            try:
+                self.handle_errors(e)
+            except errors.PublicError, e:
+                return [(members[0], e)]
+
+        return []
+
+    def add_entries_to_group(self, dns, group_dn, member_attr='member', allow_same=False):
+        """
+        Add entries designated by dns to group group_dn in the member
+        attribute member_attr.
+
+        Only the new members are sent to the server, in a single MOD_ADD,
+        the current members of the group are never read. The existence of
+        the new members is checked with pipelined searches, see
+        find_entries_many().
+
+        Adding a group as a member of itself is not allowed unless
+        allow_same is True.
+
+        Returns a list of (dn, exception) tuples for the entries which
+        could not be added.
+        """
+
+        assert isinstance(group_dn, DN)
+        group_dn = self.normalize_dn(group_dn)
+
+        self.debug("add_entries_to_group: dns=%s group_dn=%s member_attr=%s", dns, group_dn, member_attr)
+
+        for dn in dns:
+            assert isinstance(dn, DN)
+
+        # check if the entries exist
+        searches = [dict(attrs_list=['objectclass'], base_dn=dn,
+                         scope=self.SCOPE_BASE) for dn in dns]
+        try:
+            results = self.find_entries_many(searches)
+        except errors.PublicError, e:
+            return [(dn, e) for dn in dns]
+
+        failed = []
+        members = []
+        for (dn, (entries, truncated)) in zip(dns, results):
+            try:
+                if not entries:
+                    raise errors.NotFound(reason='no such entry')
+                member_dn = entries[0][0]
+
+                # check if we're not trying to add group into itself
+                if member_dn == group_dn and not allow_same:
+                    raise errors.SameGroupError()
+
+                if member_dn in members:
+                    raise errors.AlreadyGroupMember()
+            except errors.PublicError, e:
+                failed.append((dn, e))
+            else:
+                members.append(member_dn)
+
+        failed.extend(self._modify_group_members(
+            group_dn, member_attr, members, _ldap.MOD_ADD))
+        return failed
+
     def add_entry_to_group(self, dn, group_dn, member_attr='member', allow_same=False):
         """
         Add entry designaed by dn to group group_dn in the member attribute
@@ -1455,28 +2466,39 @@ class ldap2(CrudBackend):
         assert isinstance(dn, DN)
         assert isinstance(group_dn, DN)
 
-        self.debug("add_entry_to_group: dn=%s group_dn=%s member_attr=%s", dn, group_dn, member_attr)
-        # check if the entry exists
-        (dn, entry_attrs) = self.get_entry(dn, ['objectclass'])
+        failed = self.add_entries_to_group(
+            [dn], group_dn, member_attr, allow_same=allow_same)
+        if failed:
+            raise failed[0][1]
 
-        # get group entry
-        (group_dn, group_entry_attrs) = self.get_entry(group_dn, [member_attr])
+    def remove_entries_from_group(self, dns, group_dn, member_attr='member'):
+        """
+        Remove entries designated by dns from group group_dn.
 
-        self.debug("add_entry_to_group: group_entry_attrs=%s", group_entry_attrs)
-        # check if we're not trying to add group into itself
-        if dn == group_dn and not allow_same:
-            raise errors.SameGroupError()
+        Only the removed members are sent to the server, in a single
+        MOD_DELETE, the current members of the group are never read.
 
-        # add dn to group entry's `member_attr` attribute
-        members = group_entry_attrs.get(member_attr, [])
-        members.append(dn)
-        group_entry_attrs[member_attr] = members
+        Returns a list of (dn, exception) tuples for the entries which
+        could not be removed.
+        """
 
-        # update group entry
-        try:
-            self.update_entry(group_dn, group_entry_attrs)
-        except errors.EmptyModlist:
-            raise errors.AlreadyGroupMember()
+        assert isinstance(group_dn, DN)
+        group_dn = self.normalize_dn(group_dn)
+
+        self.debug("remove_entries_from_group: dns=%s group_dn=%s member_attr=%s", dns, group_dn, member_attr)
+
+        failed = []
+        members = []
+        for dn in dns:
+            assert isinstance(dn, DN)
+            if dn in members:
+                failed.append((dn, errors.NotGroupMember()))
+            else:
+                members.append(dn)
+
+        failed.extend(self._modify_group_members(
+            group_dn, member_attr, members, _ldap.MOD_DELETE))
+        return failed
 
     def remove_entry_from_group(self, dn, group_dn, member_attr='member'):
         """Remove entry from group."""
@@ -1484,22 +2506,9 @@ class ldap2(CrudBackend):
         assert isinstance(dn, DN)
         assert isinstance(group_dn, DN)
 
-        self.debug("remove_entry_from_group: dn=%s group_dn=%s member_attr=%s", dn, group_dn, member_attr)
-        # get group entry
-        (group_dn, group_entry_attrs) = self.get_entry(group_dn, [member_attr])
-
-        self.debug("remove_entry_from_group: group_entry_attrs=%s", group_entry_attrs)
-        # remove dn from group entry's `member_attr` attribute
-        members = group_entry_attrs.get(member_attr, [])
-        assert all([isinstance(x, DN) for x in members])
-        try:
-            members.remove(dn)
-        except ValueError:
-            raise errors.NotGroupMember()
-        group_entry_attrs[member_attr] = members
-
-        # update group entry
-        self.update_entry(group_dn, group_entry_attrs)
+        failed = self.remove_entries_from_group([dn], group_dn, member_attr)
+        if failed:
+            raise failed[0][1]
 
     def get_members(self, group_dn, members, attr_list=[], membertype=MEMBERS_ALL, time_limit=None, size_limit=None, normalize=True):
         """Do a memberOf search of groupdn and return the attributes in
@@ -1532,33 +2541,64 @@ class ldap2(CrudBackend):
         if membertype == MEMBERS_ALL or membertype == MEMBERS_INDIRECT:
             user_container_dn = DN(api.env.container_user, api.env.basedn) # FIXME, initialize once
             host_container_dn = DN(api.env.container_host, api.env.basedn)
+
+            nested = None
+            nested_searched = False
             checkmembers = set(DN(x) for x in members)
             checked = set()
             while checkmembers:
-                member_dn = checkmembers.pop()
-                checked.add(member_dn)
-
-                # No need to check entry types that are not nested for
-                # additional members
-                if member_dn.endswith(user_container_dn) or \
-                   member_dn.endswith(host_container_dn):
-                        results.append([member_dn, {}])
-                        continue
-                try:
-                    (result, truncated) = self.find_entries(searchfilter,
-                        attr_list, member_dn, time_limit=time_limit,
-                        size_limit=size_limit, scope=_ldap.SCOPE_BASE,
+                checked.update(checkmembers)
+                candidates = []
+                for member_dn in checkmembers:
+                    # No need to check entry types that are not nested for
+                    # additional members
+                    if member_dn.endswith(user_container_dn) or \
+                       member_dn.endswith(host_container_dn):
+                            results.append([member_dn, {}])
+                            continue
+                    candidates.append(member_dn)
+
+                if candidates and not nested_searched:
+                    # Some member may be nested, fetch every nested entry
+                    # that has members of its own in one go, the transitive
+                    # closure is then computed in memory.
+                    nested = self._find_nested_members(group_dn,
+                        searchfilter, attr_list, time_limit=time_limit,
                         normalize=normalize)
-                    if truncated:
-                        raise errors.LimitsExceeded()
-                    results.append(list(result[0]))
-                    for m in result[0][1].get('member', []):
-                        # This member may contain other members, add it to our
-                        # candidate list
+                    nested_searched = True
+
+                found = []
+                lookups = []
+                for member_dn in candidates:
+                    result = None
+                    if nested is not None:
+                        result = nested.get(member_dn)
+                    if result is None:
+                        lookups.append(member_dn)
+                    else:
+                        found.append(result)
+
+                if lookups:
+                    # Not nested groups with members (or the bulk search
+                    # was truncated), verify the entries on their own.
+                    searches = [dict(filter=searchfilter, attrs_list=attr_list,
+                                     base_dn=member_dn, scope=_ldap.SCOPE_BASE)
+                                for member_dn in lookups]
+                    for (result, truncated) in self.find_entries_many(searches,
+                            time_limit=time_limit, size_limit=size_limit,
+                            normalize=normalize):
+                        if truncated:
+                            raise errors.LimitsExceeded()
+                        found.extend(result)
+
+                checkmembers = set()
+                for result in found:
+                    results.append(list(result))
+                    for m in result[1].get('member', []):
+                        # This member may contain other members, add it to
+                        # our candidate list
                         if m not in checked:
                             checkmembers.add(m)
-                except errors.NotFound:
-                    pass
 
         if membertype == MEMBERS_ALL:
             entries = []
@@ -1583,6 +2623,37 @@ class ldap2(CrudBackend):
         self.debug("get_members: result=%s", entries)
         return entries
 
+    def _find_nested_members(self, group_dn, searchfilter, attr_list,
+                             time_limit=None, normalize=True):
+        """
+        Return a dict mapping the DN of every entry which is a member
+        of group_dn and has members of its own to its (dn, entry_attrs)
+        tuple. A single subtree search is used.
+
+        Returns None when the search was truncated, callers then have
+        to look up each candidate member separately.
+        """
+
+        assert isinstance(group_dn, DN)
+
+        nested_filter = self.combine_filters(
+            [searchfilter, '(member=*)'], self.MATCH_ALL)
+
+        # The search is an internal step of member resolution, do not
+        # apply the user facing record limit to it.
+        try:
+            (result, truncated) = self.find_entries(nested_filter,
+                attr_list, self.base_dn, time_limit=time_limit,
+                size_limit=0, normalize=normalize)
+        except errors.NotFound:
+            return {}
+        if truncated:
+            self.debug("get_members: nested member search truncated for %s",
+                       group_dn)
+            return None
+
+        return dict((e[0], e) for e in result)
+
     def get_memberof(self, entry_dn, memberof, time_limit=None, size_limit=None, normalize=True):
         """
         Examine the objects that an entry is a member of and determine if they
@@ -1607,19 +2678,24 @@ class ldap2(CrudBackend):
         searchfilter = "(|(member=%s)(memberhost=%s)(memberuser=%s))" % (
             search_entry_dn, search_entry_dn, search_entry_dn)
 
-        # Search only the groups for which the object is a member to
-        # determine if it is directly or indirectly associated.
-
-        results = []
-        for group in memberof:
-            assert isinstance(group, DN)
-            try:
-                (result, truncated) = self.find_entries(searchfilter, attr_list,
-                    group, time_limit=time_limit,size_limit=size_limit,
-                    scope=_ldap.SCOPE_BASE, normalize=normalize)
-                results.extend(list(result))
-            except errors.NotFound:
-                pass
+        # Find all entries referencing the object directly with a single
+        # search and keep only those the object is a member of.
+        results = self._find_direct_memberof(entry_dn, memberof, searchfilter,
+            time_limit=time_limit, normalize=normalize)
+
+        if results is None:
+            # Search only the groups for which the object is a member to
+            # determine if it is directly or indirectly associated.
+            searches = []
+            for group in memberof:
+                assert isinstance(group, DN)
+                searches.append(dict(filter=searchfilter, attrs_list=attr_list,
+                                     base_dn=group, scope=_ldap.SCOPE_BASE))
+            results = []
+            for (result, truncated) in self.find_entries_many(searches,
+                    time_limit=time_limit, size_limit=size_limit,
+                    normalize=normalize):
+                results.extend(result)
 
         direct = []
         # If there is an exception here, it is likely due to a failure in
@@ -1637,6 +2713,35 @@ class ldap2(CrudBackend):
         self.debug("get_memberof: result direct=%s indirect=%s", direct, indirect)
         return (direct, indirect)
 
+    def _find_direct_memberof(self, entry_dn, memberof, searchfilter,
+                              time_limit=None, normalize=True):
+        """
+        Return the (dn, entry_attrs) tuples of the groups in memberof
+        which list entry_dn directly as a member, ordered as memberof.
+        A single subtree search is used.
+
+        Returns None when the search was truncated, callers then have
+        to check each group separately.
+        """
+
+        assert isinstance(entry_dn, DN)
+
+        # The search is an internal step of member resolution, do not
+        # apply the user facing record limit to it.
+        try:
+            (result, truncated) = self.find_entries(searchfilter, ['dn'],
+                self.base_dn, time_limit=time_limit, size_limit=0,
+                normalize=normalize)
+        except errors.NotFound:
+            return []
+        if truncated:
+            self.debug("get_memberof: direct member search truncated for %s",
+                       entry_dn)
+            return None
+
+        found = dict((e[0], e) for e in result)
+        return [found[group] for group in memberof if group in found]
+
     def set_entry_active(self, dn, active):
         """Mark entry active/inactive."""
 
@@ -1782,4 +2887,75 @@ class ldap2(CrudBackend):
             return (-1, output)
         return (len(output), output)
 
+
+class LDAPHandle(ldap2):
+    """
+    Independent connection to the LDAP server, see ldap2.create_handle().
+
+    The connection is made, with ldap2.create_connection() arguments
+    connect_kw, on the first use of the handle. It is reused from, and
+    returned to, the connection pool when possible. The schema cache is
+    shared with the other connections to the server. Use the handle as
+    a context manager, or call disconnect() when done with it.
+
+    A handle for a simple bind with a password connects at once with
+    bind_pw, which is not kept. It cannot connect again once disconnected.
+    """
+
+    def __init__(self, ldap_uri, base_dn, connect_kw, bind_pw=None):
+        ldap2.__init__(self, shared_instance=False, ldap_uri=ldap_uri,
+                       base_dn=base_dn)
+        self.connect_kw = dict(connect_kw)
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._simple_bind = (connect_kw['ccache'] is None and
+                             not connect_kw['autobind'] and
+                             len(connect_kw['bind_dn']) > 0)
+        if self._simple_bind:
+            if bind_pw is None:
+                raise ValueError(
+                    'bind_pw is required for a handle with a simple bind')
+            self._conn = self.create_connection(bind_pw=bind_pw,
+                                                **self.connect_kw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def _get_conn(self):
+        if self._conn is None:
+            self.connect()
+        return self._conn
+    conn = property(_get_conn)
+
+    def connect(self):
+        """
+        Connect now rather than on first use.
+        """
+        self._conn_lock.acquire()
+        try:
+            if self._conn is None:
+                if self._simple_bind:
+                    raise ValueError(
+                        'cannot reconnect a handle with a simple bind')
+                self._conn = self.create_connection(**self.connect_kw)
+                self.debug('Created connection for handle %s' % self.id)
+        finally:
+            self._conn_lock.release()
+
+    def disconnect(self):
+        self._conn_lock.acquire()
+        try:
+            if self._conn is not None:
+                self.destroy_connection()
+                self._conn = None
+                self.debug('Destroyed connection for handle %s' % self.id)
+        finally:
+            self._conn_lock.release()
+
+    def isconnected(self):
+        return self._conn is not None
+
 api.register(ldap2)
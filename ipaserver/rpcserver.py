@@ -54,6 +54,11 @@ from ipalib.text import _
 HTTP_STATUS_SUCCESS = '200 Success'
 HTTP_STATUS_SERVER_ERROR = '500 Internal Server Error'
 
+# Approximate size of the chunks a JSON response is sent in
+JSON_CHUNK_SIZE = 64 * 1024
+# Containers nested deeper than this are encoded in one piece
+JSON_STREAM_DEPTH = 3
+
 _not_found_template = """<html>
 <head>
 <title>404 Not Found</title>
@@ -306,6 +311,7 @@ class WSGIExecutioner(Executioner):
         name = None
         args = ()
         options = {}
+        params = None
 
         if not 'HTTP_REFERER' in environ:
             return self.marshal(result, RefererError(referer='missing'), _id)
@@ -331,7 +337,9 @@ class WSGIExecutioner(Executioner):
                 (name, args, options, _id) = self.simple_unmarshal(environ)
             if name not in self.Command:
                 raise CommandError(name=name)
-            result = self.Command[name](*args, **options)
+            command = self.Command[name]
+            params = command.args_options_2_params(*args, **options)
+            result = command.call_with_params(params)
         except PublicError, e:
             error = e
         except StandardError, e:
@@ -342,9 +350,7 @@ class WSGIExecutioner(Executioner):
         finally:
             os.environ['LANG'] = lang
         if name and name in self.Command:
-            try:
-                params = self.Command[name].args_options_2_params(*args, **options)
-            except Exception, e:
+            if params is None:
                 self.info(
                    'exception %s caught when converting options: %s', e.__class__.__name__, str(e)
                 )
@@ -352,9 +358,9 @@ class WSGIExecutioner(Executioner):
                 params = options
             principal = getattr(context, 'principal', 'UNKNOWN')
             if error:
-                self.info('%s: %s(%s): %s', principal, name, ', '.join(self.Command[name]._repr_iter(**params)), e.__class__.__name__)
+                self.Command[name].log_call(self.log, principal, params, error=e)
             else:
-                self.info('%s: %s(%s): SUCCESS', principal, name, ', '.join(self.Command[name]._repr_iter(**params)))
+                self.Command[name].log_call(self.log, principal, params)
         else:
             self.info('%s: %s', context.principal, e.__class__.__name__)
         return self.marshal(result, error, _id)
@@ -389,7 +395,9 @@ class WSGIExecutioner(Executioner):
             headers.append(('Set-Cookie', session_cookie))
 
         start_response(status, headers)
-        return [response]
+        if isinstance(response, basestring):
+            response = [response]
+        return response
 
     def unmarshal(self, data):
         raise NotImplementedError('%s.unmarshal()' % self.fullname)
@@ -435,6 +443,178 @@ def json_encode_binary(val):
     else:
         return val
 
+_json_encode_string = json.encoder.encode_basestring_ascii
+
+def _json_encode_key(key):
+    if isinstance(key, basestring):
+        return _json_encode_string(key)
+    elif key is True:
+        return '"true"'
+    elif key is False:
+        return '"false"'
+    elif key is None:
+        return '"null"'
+    elif isinstance(key, (int, long, float)):
+        return _json_encode_string(json.dumps(key))
+    raise TypeError("key %r is not a string" % (key,))
+
+def _json_encode_scalar(val):
+    if isinstance(val, unicode):
+        return _json_encode_string(val)
+    elif isinstance(val, str):
+        return '{"__base64__": "%s"}' % base64.b64encode(val)
+    elif isinstance(val, DN):
+        return _json_encode_string(str(val).decode('utf-8'))
+    elif val is None:
+        return 'null'
+    elif val is True:
+        return 'true'
+    elif val is False:
+        return 'false'
+    elif isinstance(val, (int, long)):
+        return str(val)
+    elif isinstance(val, float):
+        return json.dumps(val)
+    elif isinstance(val, Decimal):
+        return '{"__base64__": "%s"}' % base64.b64encode(str(val))
+    raise TypeError("%r is not JSON serializable" % (val,))
+
+def _json_encode(val, out, indent, level):
+    """
+    Append the JSON encoding of val to the list out.
+    """
+    if isinstance(val, dict):
+        if not val:
+            out.append('{}')
+            return
+        if indent is None:
+            separator = ', '
+            out.append('{')
+        else:
+            separator = ',\n' + ' ' * (indent * (level + 1))
+            out.append('{' + separator[1:])
+        first = True
+        for key in sorted(val):
+            if first:
+                first = False
+            else:
+                out.append(separator)
+            out.append(_json_encode_key(key))
+            out.append(': ')
+            _json_encode(val[key], out, indent, level + 1)
+        if indent is not None:
+            out.append('\n' + ' ' * (indent * level))
+        out.append('}')
+    elif isinstance(val, (list, tuple)):
+        if not val:
+            out.append('[]')
+            return
+        if indent is None:
+            separator = ', '
+            out.append('[')
+        else:
+            separator = ',\n' + ' ' * (indent * (level + 1))
+            out.append('[' + separator[1:])
+        first = True
+        for item in val:
+            if first:
+                first = False
+            else:
+                out.append(separator)
+            _json_encode(item, out, indent, level + 1)
+        if indent is not None:
+            out.append('\n' + ' ' * (indent * level))
+        out.append(']')
+    else:
+        out.append(_json_encode_scalar(val))
+
+def _json_iterencode(val, indent, level):
+    """
+    Yield the JSON encoding of val in pieces. Only the outermost
+    JSON_STREAM_DEPTH levels of containers are split up, everything
+    below (e.g. a single entry of a search result) is encoded at once.
+    """
+    if level >= JSON_STREAM_DEPTH or not isinstance(val, (dict, list, tuple)):
+        out = []
+        _json_encode(val, out, indent, level)
+        yield ''.join(out)
+        return
+    if not val:
+        yield '{}' if isinstance(val, dict) else '[]'
+        return
+    if indent is None:
+        separator = ', '
+    else:
+        separator = ',\n' + ' ' * (indent * (level + 1))
+    if isinstance(val, dict):
+        (start, end) = ('{', '}')
+        items = ((key, val[key]) for key in sorted(val))
+    else:
+        (start, end) = ('[', ']')
+        items = ((None, item) for item in val)
+    yield start if indent is None else start + separator[1:]
+    first = True
+    for (key, item) in items:
+        if first:
+            first = False
+        else:
+            yield separator
+        if start == '{':
+            yield _json_encode_key(key) + ': '
+        for piece in _json_iterencode(item, indent, level + 1):
+            yield piece
+    yield end if indent is None else '\n' + ' ' * (indent * level) + end
+
+def _json_check(val):
+    '''
+    Raise TypeError if val contains anything _json_encode() cannot encode.
+    '''
+    stack = [val]
+    while stack:
+        val = stack.pop()
+        if isinstance(val, dict):
+            for key in val:
+                if not (key is None or
+                        isinstance(key, (basestring, int, long, float))):
+                    raise TypeError("key %r is not a string" % (key,))
+            stack.extend(val.itervalues())
+        elif isinstance(val, (list, tuple)):
+            stack.extend(val)
+        elif not (val is None or isinstance(val,
+                  (basestring, DN, int, long, float, Decimal))):
+            raise TypeError("%r is not JSON serializable" % (val,))
+
+def json_iterencode(val, indent=None):
+    '''
+    Encode val as JSON and return an iterator over the str chunks of the
+    encoding, suitable as a WSGI response iterable.
+
+    Binary values are encoded the same way json_encode_binary() does it,
+    but while the output is generated, no copy of val is made. Dict keys
+    are sorted. The output is compact unless indent is given, in that
+    case it is pretty-printed with indent spaces per level.
+
+    The output is generated lazily, so val is checked up front and a
+    value which cannot be encoded raises TypeError here rather than
+    while the iterator is being consumed, after the response status has
+    been sent.
+    '''
+    _json_check(val)
+    return _json_iterchunks(val, indent)
+
+def _json_iterchunks(val, indent):
+    chunk = []
+    size = 0
+    for piece in _json_iterencode(val, indent, 0):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= JSON_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
 def json_decode_binary(val):
     '''
     JSON cannot transport binary data. In order to transport binary data we
@@ -491,6 +671,22 @@ def json_decode_binary(val):
         else:
             return val
 
+def json_binary_object_hook(val):
+    '''
+    object_hook for json.loads() decoding binary values while the JSON is
+    parsed, see json_encode_binary(). Unlike json_decode_binary() it does
+    not need a second pass over the decoded object, nor copies of it.
+
+    json.loads() already returns all text as unicode objects.
+    '''
+    if '__base64__' in val:
+        try:
+            return base64.b64decode(val['__base64__'])
+        except TypeError, e:
+            # Let json.loads() callers handle it like any other bad input
+            raise ValueError('invalid __base64__ value: %s' % e)
+    return val
+
 class jsonserver(WSGIExecutioner, HTTP_Status):
     """
     JSON RPC server.
@@ -508,6 +704,10 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
 
         self.debug('WSGI jsonserver.__call__:')
 
+        # The response is compact unless "pretty" is in the query string
+        query = parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+        setattr(context, 'json_pretty', 'pretty' in query)
+
         response = super(jsonserver, self).__call__(environ, start_response)
         return response
 
@@ -527,12 +727,21 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
             principal=unicode(principal),
             version=unicode(VERSION),
         )
-        response = json_encode_binary(response)
-        return json.dumps(response, sort_keys=True, indent=4)
+        if getattr(context, 'json_pretty', False):
+            indent = 4
+        else:
+            indent = None
+        try:
+            return json_iterencode(response, indent=indent)
+        except TypeError, e:
+            if error is not None:
+                raise
+            self.exception('cannot encode the JSON response: %s', e)
+            return self.marshal(None, InternalError(), _id)
 
     def unmarshal(self, data):
         try:
-            d = json.loads(data)
+            d = json.loads(data, object_hook=json_binary_object_hook)
         except ValueError, e:
             raise JSONError(error=e)
         if not isinstance(d, dict):
@@ -541,7 +750,6 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
             raise JSONError(error=_('Request is missing "method"'))
         if 'params' not in d:
             raise JSONError(error=_('Request is missing "params"'))
-        d = json_decode_binary(d)
         method = d['method']
         params = d['params']
         _id = d.get('id')
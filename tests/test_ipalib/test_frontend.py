@@ -21,6 +21,7 @@
 Test the `ipalib.frontend` module.
 """
 
+import logging
 from tests.util import raises, getitem, no_set, no_del, read_only
 from tests.util import check_TypeError, ClassChecker, create_test_api
 from tests.util import assert_equal
@@ -479,6 +480,46 @@ class test_Command(ClassChecker):
         e = raises(errors.RequirementError, sub.validate, **fail)
         assert e.name == 'option1'
 
+    def test_process_params(self):
+        """
+        Test the ``ipalib.frontend.Command._process_params`` function.
+        """
+        (api, home) = create_test_api()
+        api.finalize()
+        sub = self.subcls()
+        sub.set_api(api)
+        sub.finalize()
+        generic = sub._Command__process_params_generic
+        assert sub._process_params != generic
+
+        # Check that the results are the same as the generic version's:
+        for kw in (
+            dict(option0=u'OPTION0', option1=u'Option1'),
+            dict(option0=u'Option0', option1=u'OPTION1'),
+        ):
+            assert_equal(sub._process_params(dict(kw)), generic(dict(kw)))
+
+        # Check that the errors are the same as the generic version's:
+        for (kw, error) in (
+            (dict(option0=u'option0'), errors.RequirementError),
+            (dict(option0=u'whatever', option1=u'option1'),
+                errors.ValidationError),
+            (dict(option0=u'option0', option1=(u'option1',)),
+                errors.ConversionError),
+        ):
+            e1 = raises(error, sub._process_params, dict(kw))
+            e2 = raises(error, generic, dict(kw))
+            assert_equal(str(e1), str(e2))
+
+        # Check that the generic version is used when a step is overridden:
+        class example(self.subcls):
+            def convert(self, **kw):
+                return super(example, self).convert(**kw)
+        sub = example()
+        sub.set_api(api)
+        sub.finalize()
+        assert sub._process_params == sub._Command__process_params_generic
+
     def test_execute(self):
         """
         Test the `ipalib.frontend.Command.execute` method.
@@ -709,6 +750,133 @@ class test_Command(ClassChecker):
             'nested', 'Subclass', 'world', 4, dict, tuple, nope
         )
 
+    def test_validate_output_sampled(self):
+        """
+        Test sampled output validation in `ipalib.frontend.Command.__call__`.
+        """
+        class example(self.cls):
+            has_output = (
+                output.Output('result', int),
+            )
+
+            def run(self, *args, **options):
+                return dict(result=u'wrong')
+
+        # Test that every call is validated by default:
+        (api, home) = create_test_api()
+        api.finalize()
+        o = example()
+        o.set_api(api)
+        o.finalize()
+        raises(TypeError, o)
+
+        # Test that 1 in 3 calls is validated and violations are counted:
+        (api, home) = create_test_api(output_validation_sample=3)
+        api.finalize()
+        o = example()
+        o.set_api(api)
+        o.finalize()
+        for i in xrange(7):
+            assert o() == dict(result=u'wrong')
+        assert o.output_validation_stats == dict(
+            calls=7, validated=2, violations=2
+        )
+
+        # Test that output validation can be disabled:
+        (api, home) = create_test_api(output_validation_sample=0)
+        api.finalize()
+        o = example()
+        o.set_api(api)
+        o.finalize()
+        assert o() == dict(result=u'wrong')
+        assert o.output_validation_stats['validated'] == 0
+
+    def test_call_with_params(self):
+        """
+        Test the `ipalib.frontend.Command.call_with_params` method.
+        """
+        class my_cmd(self.cls):
+            takes_args = ('login',)
+            takes_options = (
+                Str('option0', default_from=lambda login: login.upper()),
+            )
+
+            def run(self, *args, **options):
+                return dict(result=(args, options))
+
+        (api, home) = create_test_api()
+        api.finalize()
+        o = my_cmd()
+        o.set_api(api)
+        o.finalize()
+        params = o.args_options_2_params(u'admin')
+        assert params == dict(login=u'admin')
+        assert o.call_with_params(params) == o(u'admin')
+        assert params == dict(login=u'admin')
+
+    def test_log_call(self):
+        """
+        Test the `ipalib.frontend.Command.log_call` method.
+        """
+        class example(self.cls):
+            takes_args = ('login',)
+            takes_options = (parameters.Password('passwd'),)
+
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+
+        log = logging.getLogger('test_log_call')
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        handler = Handler()
+        log.addHandler(handler)
+        params = dict(login=u'admin', passwd=u'secret')
+
+        # Test that successful calls are sampled, failed calls are not:
+        (api, home) = create_test_api(audit_log_sample=2)
+        api.finalize()
+        o = example()
+        o.set_api(api)
+        o.finalize()
+        for i in xrange(4):
+            o.log_call(log, 'admin@EXAMPLE.COM', params)
+        o.log_call(log, 'admin@EXAMPLE.COM', params,
+            error=errors.NotFound(reason=u'no'), prefix='batch: ')
+        assert handler.messages == [
+            "admin@EXAMPLE.COM: example(u'admin', passwd=u'********'): SUCCESS",
+        ] * 2 + [
+            "admin@EXAMPLE.COM: batch: example(u'admin', "
+            "passwd=u'********'): NotFound",
+        ]
+
+        # Test the sampling rate of a single command:
+        (api, home) = create_test_api(audit_log_sample_example=0)
+        api.finalize()
+        o = example()
+        o.set_api(api)
+        o.finalize()
+        handler.messages = []
+        o.log_call(log, 'admin@EXAMPLE.COM', params)
+        assert handler.messages == []
+
+        # Test that the params are not formatted if no record is emitted:
+        class unrepresentable(example):
+            def _repr_iter(self, **params):
+                raise AssertionError('params formatted')
+        o = unrepresentable()
+        o.set_api(api)
+        o.finalize()
+        handler.setLevel(logging.WARNING)
+        o.log_call(log, 'admin@EXAMPLE.COM', params,
+            error=errors.NotFound(reason=u'no'))
+        assert handler.messages == []
+        log.removeHandler(handler)
+
     def test_get_output_params(self):
         """
         Test the `ipalib.frontend.Command.get_output_params` method.
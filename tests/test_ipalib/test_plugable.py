@@ -22,10 +22,13 @@ Test the `ipalib.plugable` module.
 """
 
 import inspect
+import json
+import os
+import sys
 from tests.util import raises, no_set, no_del, read_only
 from tests.util import getitem, setitem, delitem
-from tests.util import ClassChecker, create_test_api
-from ipalib import plugable, errors, text
+from tests.util import ClassChecker, create_test_api, TempHome
+from ipalib import plugable, errors, text, create_api
 
 
 class test_SetProxy(ClassChecker):
@@ -198,6 +201,86 @@ class test_MagicDict(ClassChecker):
             raises(AttributeError, getattr, dictproxy, key)
 
 
+class test_LazyNameSpace(ClassChecker):
+    """
+    Test the `ipalib.plugable.LazyNameSpace` class.
+    """
+    _cls = plugable.LazyNameSpace
+
+    def test_class(self):
+        """
+        Test the `ipalib.plugable.LazyNameSpace` class.
+        """
+        assert self.cls.__bases__ == (plugable.NameSpace,)
+
+    def test_LazyNameSpace(self):
+        """
+        Test container emulation of `ipalib.plugable.LazyNameSpace` class.
+        """
+        loaded = []
+        class member(object):
+            def __init__(self, name):
+                loaded.append(name)
+                self.name = name
+        members = {}
+        def loader(name):
+            if name not in members:
+                members[name] = member(name)
+            return members[name]
+
+        names = ['member_%d' % i for i in xrange(10)]
+        o = self.cls(reversed(names), loader)
+
+        # Test that no member is loaded by name lookups:
+        assert len(o) == 10
+        assert list(o) == names
+        assert 'member_10' not in o
+        raises(KeyError, getitem, o, 'member_10')
+        raises(AttributeError, getattr, o, 'member_10')
+        assert loaded == []
+
+        # Test that members are loaded on first access:
+        assert o['member_3'] is members['member_3']
+        assert o.member_3 is members['member_3']
+        assert o[4] is members['member_4']
+        assert loaded == ['member_3', 'member_4']
+        assert 'member_5' in o
+        assert loaded == ['member_3', 'member_4', 'member_5']
+        raises(AttributeError, setattr, o, 'member_3', None)
+
+        # Test that iterating through the members loads all of them:
+        assert [m.name for m in o()] == names
+        assert sorted(loaded) == names
+
+    def test_missing(self):
+        """
+        Test that members the loader cannot find are dropped.
+        """
+        def loader(name):
+            if name == 'stale':
+                raise KeyError(name)
+            return name.upper()
+
+        o = self.cls(['one', 'stale', 'two'], loader)
+        assert 'stale' not in o
+        assert list(o) == ['one', 'two']
+        assert len(o) == 2
+
+        o = self.cls(['one', 'stale', 'two'], loader)
+        raises(KeyError, getitem, o, 'stale')
+        raises(KeyError, getitem, o, 'stale')
+        assert list(o) == ['one', 'two']
+
+        o = self.cls(['one', 'stale', 'two'], loader)
+        raises(AttributeError, getattr, o, 'stale')
+        assert list(o) == ['one', 'two']
+
+        o = self.cls(['one', 'stale', 'two'], loader)
+        assert list(o()) == ['ONE', 'TWO']
+        assert list(o) == ['one', 'two']
+        assert o.__todict__() == dict(one='ONE', two='TWO')
+
+
 class test_Plugin(ClassChecker):
     """
     Test the `ipalib.plugable.Plugin` class.
@@ -514,3 +597,145 @@ class test_API(ClassChecker):
         assert o.isdone('load_plugins') is True
         e = raises(StandardError, o.load_plugins)
         assert str(e) == 'API.load_plugins() already called'
+
+
+plugin_module = """
+from ipalib import frontend, SkipPluginModule
+import %(package)s as package
+
+if '%(name)s' in package.skip:
+    raise SkipPluginModule(reason='%(name)s is skipped')
+
+class %(name)s(frontend.Command):
+    pass
+
+if '%(name)s' not in package.unregistered:
+    package.api.register(%(name)s)
+"""
+
+
+class test_plugin_manifest(object):
+    """
+    Test loading plugins lazily through the plugin manifest of `API`.
+    """
+
+    package = 'ipa_manifest_test'
+
+    def setUp(self):
+        self.home = TempHome()
+        self.home.write('', self.package, '__init__.py')
+        self.home.write('', self.package, 'plugins', '__init__.py')
+        for name in ('one', 'two', 'three'):
+            self.write_plugin(name)
+        sys.path.insert(0, self.home.path)
+        package = __import__(self.package)
+        package.skip = set()
+        package.unregistered = set()
+        self.manifest = self.home.join('.ipa', 'plugins.manifest')
+
+    def tearDown(self):
+        sys.path.remove(self.home.path)
+        for name in list(sys.modules):
+            if name.split('.')[0] == self.package:
+                del sys.modules[name]
+        self.home.rmtree()
+
+    def write_plugin(self, name, comment=''):
+        filename = self.home.join(self.package, 'plugins', '%s.py' % name)
+        if os.path.exists(filename):
+            os.unlink(filename)
+        self.home.write(plugin_module % dict(package=self.package, name=name)
+                        + comment, self.package, 'plugins', '%s.py' % name)
+
+    def imported(self, name):
+        return '%s.plugins.%s' % (self.package, name) in sys.modules
+
+    def create_api(self):
+        """
+        Return a finalized API, as a new process would create it.
+        """
+        for name in list(sys.modules):
+            if name.startswith(self.package + '.plugins.'):
+                del sys.modules[name]
+        api = create_api(mode=None)
+        sys.modules[self.package].api = api
+        api.bootstrap(in_tree=True, context='cli', plugins_on_demand=True)
+        api.load_plugins([self.package])
+        api.finalize()
+        return api
+
+    def test_write(self):
+        """
+        Test that the manifest records the modules registering each plugin.
+        """
+        sys.modules[self.package].skip.add('two')
+        api = self.create_api()
+        assert type(api.Command) is not plugable.LazyNameSpace
+        assert list(api.Command) == ['one', 'three']
+        data = json.load(open(self.manifest))
+        assert data['plugins'] == dict(Command=dict(
+            one=['%s.plugins.one' % self.package],
+            three=['%s.plugins.three' % self.package],
+        ))
+        assert data['skipped'] == ['%s.plugins.two' % self.package]
+
+    def test_read(self):
+        """
+        Test that plugin modules are imported when a plugin is accessed.
+        """
+        self.create_api()
+        api = self.create_api()
+        assert type(api.Command) is plugable.LazyNameSpace
+        assert list(api.Command) == ['one', 'three', 'two']
+        assert not self.imported('one')
+        assert api.Command.one.name == 'one'
+        assert self.imported('one')
+        assert not self.imported('three')
+        assert len(api.plugins) == 3
+        assert self.imported('three')
+
+    def test_stale_key(self):
+        """
+        Test that the manifest is regenerated when a plugin module changes.
+        """
+        self.create_api()
+        self.write_plugin('one', '# changed\n')
+        api = self.create_api()
+        assert type(api.Command) is not plugable.LazyNameSpace
+        assert self.imported('two')
+        api = self.create_api()
+        assert type(api.Command) is plugable.LazyNameSpace
+
+    def test_not_registered(self):
+        """
+        Test that a plugin which is no longer registered is not reported.
+        """
+        self.create_api()
+        sys.modules[self.package].unregistered.add('three')
+        api = self.create_api()
+        assert type(api.Command) is plugable.LazyNameSpace
+        assert 'three' not in api.Command
+        raises(KeyError, getitem, api.Command, 'three')
+        raises(AttributeError, getattr, api.Command, 'three')
+        assert list(api.Command) == ['one', 'two']
+        assert sorted(p.name for p in api.plugins) == ['one', 'two']
+        assert not os.path.exists(self.manifest)
+
+        api = self.create_api()
+        assert type(api.Command) is not plugable.LazyNameSpace
+        assert list(api.Command) == ['one', 'two']
+        assert os.path.exists(self.manifest)
+
+    def test_not_skipped(self):
+        """
+        Test that a plugin module which was skipped is imported again.
+        """
+        package = sys.modules[self.package]
+        package.skip.add('two')
+        self.create_api()
+        package.skip.remove('two')
+        api = self.create_api()
+        assert self.imported('two')
+        assert list(api.Command) == ['one', 'three', 'two']
+        assert api.Command.two.name == 'two'
+        assert not os.path.exists(self.manifest)
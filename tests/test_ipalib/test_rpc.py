@@ -22,6 +22,9 @@ Test the `ipalib.rpc` module.
 """
 
 import threading
+import socket
+import tempfile
+import shutil
 from xmlrpclib import Binary, Fault, dumps, loads, ServerProxy
 from tests.util import raises, assert_equal, PluginTester, DummyClass
 from tests.data import binary_bytes, utf8_bytes, unicode_str
@@ -242,3 +245,90 @@ class test_xmlclient(PluginTester):
         assert_equal(e.error, u'no such error')
 
         assert context.xmlclient.conn._calledall() is True
+
+    def test_get_url_list(self):
+        """
+        Test the `ipalib.rpc.xmlclient.get_url_list` method.
+        """
+        class answer(object):
+            def __init__(self, target, priority, weight):
+                self.target = target
+                self.priority = priority
+                self.weight = weight
+
+        class answers(list):
+            def __init__(self, ttl, *targets):
+                list.__init__(self, (answer(*t) for t in targets))
+                self.rrset = DummyClass()
+                self.rrset.ttl = ttl
+
+        class resolver(object):
+            def __init__(self, ttl):
+                self.ttl = ttl
+                self.queries = []
+
+            def query(self, name, rdtype):
+                self.queries.append(name)
+                return answers(self.ttl, ('ipa1.example.com.', 10, 0),
+                    ('ipa2.example.com.', 0, 0), ('ipa3.example.com.', 0, 100))
+
+        dot_ipa = tempfile.mkdtemp()
+        orig_resolver = rpc.resolver
+        try:
+            uri = 'https://ipa2.example.com/ipa/xml'
+            # The configured server is first, then the others by priority
+            # and weight:
+            urls = [uri, 'https://ipa3.example.com/ipa/xml',
+                'https://ipa1.example.com/ipa/xml']
+
+            # Test that the servers are cached for the TTL of the records:
+            (o, api, home) = self.instance('Backend', in_server=False,
+                domain='example.com', dot_ipa=dot_ipa)
+            rpc.resolver = resolver(3600)
+            assert o.get_url_list(uri) == urls
+            assert o.get_url_list(uri) == urls
+            assert rpc.resolver.queries == ['_ldap._tcp.example.com.']
+
+            # Test that the cache is not used once it expired:
+            shutil.rmtree(dot_ipa)
+            rpc.resolver = resolver(0)
+            assert o.get_url_list(uri) == urls
+            assert o.get_url_list(uri) == urls
+            assert len(rpc.resolver.queries) == 2
+
+            # Test that the cache can be disabled:
+            shutil.rmtree(dot_ipa)
+            (o, api, home) = self.instance('Backend', in_server=False,
+                domain='example.com', dot_ipa=dot_ipa, discovery_cache=False)
+            rpc.resolver = resolver(3600)
+            assert o.get_url_list(uri) == urls
+            assert o.get_url_list(uri) == urls
+            assert len(rpc.resolver.queries) == 2
+        finally:
+            rpc.resolver = orig_resolver
+            shutil.rmtree(dot_ipa, ignore_errors=True)
+
+    def test_probe_servers(self):
+        """
+        Test the `ipalib.rpc.xmlclient.__probe_servers` method.
+        """
+        (o, api, home) = self.instance('Backend', in_server=False)
+        listening = socket.socket()
+        listening.bind(('127.0.0.1', 0))
+        listening.listen(5)
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        try:
+            url = 'http://127.0.0.1:%d/ipa/xml'
+            up = url % listening.getsockname()[1]
+            down = url % closed.getsockname()[1]
+            cache = dict(latencies={'127.0.0.1:%d' % closed.getsockname()[1]: 0})
+
+            # Test that the server accepting a connection is first and the
+            # one refusing it last:
+            assert o._xmlclient__probe_servers([down, up], cache) == [up, down]
+            assert cache['latencies'].keys() == [
+                '127.0.0.1:%d' % listening.getsockname()[1]]
+        finally:
+            listening.close()
+            closed.close()
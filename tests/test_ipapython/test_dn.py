@@ -1,7 +1,10 @@
 #!/usr/bin/python
 
 import unittest
+import copy
+import pickle
 from ipapython.dn import *
+from ipapython.dn import _clear_dn_cache
 
 def default_rdn_attr_arg(i):
     return 'a%d' % i
@@ -1820,6 +1823,66 @@ class TestDN(unittest.TestCase):
         self.assertEqual(immutable_dn3, self.dn3)
         self.assertEqual(immutable_dn3, mutable_dn3)
 
+    def test_interning(self):
+        dn_str = str(self.dn3)
+
+        # Immutable DN's parsed from the same string share their RDN's
+        dn3_a = DN(dn_str)
+        dn3_b = DN(dn_str)
+        self.assertEqual(dn3_a, dn3_b)
+        for i in range(0, len(dn3_a)):
+            self.assertTrue(dn3_a[i] is dn3_b[i])
+
+        # Mutable DN's never share their RDN's
+        dn3_a = EditableDN(dn_str)
+        dn3_b = EditableDN(dn_str)
+        self.assertEqual(dn3_a, dn3_b)
+        for i in range(0, len(dn3_a)):
+            self.assertFalse(dn3_a[i] is dn3_b[i])
+
+        # Modifying a mutable DN must not leak into the interned RDN's
+        dn3_a[0] = self.rdn1
+        self.assertEqual(dn3_a[0], self.rdn1)
+        self.assertEqual(DN(dn_str), self.dn3)
+        self.assertEqual(str(dn3_a), str(DN(self.rdn1, *self.dn3[1:])))
+
+        # The string and hash of a mutable DN track modifications
+        dn1 = EditableDN(self.dn1)
+        dn1_str = str(dn1)
+        dn1[0] = self.rdn2
+        self.assertNotEqual(str(dn1), dn1_str)
+        self.assertEqual(str(dn1), str(self.rdn2))
+
+        # Immutable results of concatenation do not alter their operands
+        dn3 = DN(dn_str)
+        dn3_str = str(dn3)
+        dn4 = dn3 + self.rdn1
+        self.assertEqual(str(dn3), dn3_str)
+        self.assertEqual(len(dn4), len(dn3) + 1)
+        self.assertEqual(str(dn4), dn3_str + ',' + str(self.rdn1))
+
+        _clear_dn_cache()
+        self.assertEqual(DN(dn_str), self.dn3)
+        self.assertEqual(hash(DN(dn_str)), hash(self.dn3))
+
+    def test_copy(self):
+        for DN_class in (DN, EditableDN):
+            dn = DN_class(self.base_container_dn)
+            self.assertFalse(hasattr(dn, '__dict__'))
+            self.assertFalse(hasattr(dn[0], '__dict__'))
+            self.assertFalse(hasattr(dn[0][0], '__dict__'))
+
+            for dn_copy in (copy.copy(dn), copy.deepcopy(dn),
+                            pickle.loads(pickle.dumps(dn)),
+                            pickle.loads(pickle.dumps(dn, 2))):
+                self.assertEqual(dn_copy, dn)
+                self.assertEqual(str(dn_copy), str(dn))
+                self.assertExpectedClass(DN_class, dn_copy, 'self')
+                for i in range(0, len(dn_copy)):
+                    self.assertExpectedClass(DN_class, dn_copy[i], 'RDN')
+                    for j in range(0, len(dn_copy[i])):
+                        self.assertExpectedClass(DN_class, dn_copy[i][j], 'AVA')
+
 class TestEscapes(unittest.TestCase):
     def setUp(self):
         self.privilege = 'R,W privilege'
@@ -27,6 +27,7 @@
 
 import nose
 import os
+import threading
 from ipaserver.plugins.ldap2 import ldap2
 from ipalib.plugins.service import service, service_show
 from ipalib.plugins.host import host
@@ -145,3 +146,32 @@ class test_ldap(object):
         cert = cert[0]
         serial = unicode(x509.get_serial_number(cert, x509.DER))
         assert serial is not None
+
+    def test_handles(self):
+        """
+        Test independent ldap2 handles used from several threads
+        """
+        self.conn = ldap2(shared_instance=False, ldap_uri=self.ldapuri)
+        self.conn.connect()
+        handles = [self.conn.create_handle() for i in xrange(4)]
+        results = [None] * len(handles)
+
+        def lookup(i, handle):
+            try:
+                (dn, entry_attrs) = handle.get_entry(self.dn, ['usercertificate'])
+                results[i] = entry_attrs.get('usercertificate')
+            finally:
+                handle.disconnect()
+
+        threads = [threading.Thread(target=lookup, args=(i, handle))
+                   for (i, handle) in enumerate(handles)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for (handle, cert) in zip(handles, results):
+            assert not handle.isconnected()
+            assert cert is not None
+            serial = unicode(x509.get_serial_number(cert[0], x509.DER))
+            assert serial is not None
@@ -0,0 +1,716 @@
+# Copyright (C) 2013  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipaserver.plugins.ldap2` backend against a fake LDAP connection.
+
+Unlike the tests in test_ldap.py these do not need an LDAP server.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import ldap as _ldap
+from ipaserver.plugins import ldap2 as ldap2_module
+from ipaserver.plugins.ldap2 import ldap2, IPAConfigEntry, ConfigCache
+from ipaserver.plugins.ldap2 import SchemaCache
+from ipaserver.plugins.ldap2 import LDAPConnectionPool, MEMBERS_ALL
+from ipalib.plugins.baseldap import LDAPObject, LDAPSearch
+from ipalib.plugins.migration import _merge_objectclasses
+from ipalib import api, errors, Str
+from ipalib.request import context, Connection
+from ipapython.dn import DN
+from tests.util import raises, create_test_api
+
+
+class sort_request(object):
+    """
+    Fake server side sort request control.
+    """
+    controlType = '1.2.840.113556.1.4.473'
+
+    def __init__(self, criticality, ordering_rules):
+        self.ordering_rules = ordering_rules
+
+
+class sort_response(object):
+    """
+    Fake server side sort response control.
+    """
+    controlType = '1.2.840.113556.1.4.474'
+
+    def __init__(self, result):
+        self.result = result
+
+
+class FakeConnection(object):
+    """
+    Fake python-ldap connection to a server holding ``entries``, a list of
+    (dn, entry_attrs) tuples.
+
+    A base search returns the entry at the base DN, other searches return
+    the entries below the base DN for which `FakeConnection.match` is
+    true. The paged results and server side sort controls are supported.
+    Searches are recorded in ``searches`` as (base_dn, scope, filter,
+    serverctrls) tuples, modifications in ``modifications``.
+
+    It also stands in for a bound `IPASimpleLDAPObject`.
+    """
+
+    # result code of server side sorting, None if not supported
+    sort_result = None
+
+    def __init__(self, uri='ldap://localhost', entries=(), refused=None):
+        self.uri = uri
+        self.entries = list(entries)
+        self.refused = refused or {}
+        self.searches = []
+        self.modifications = []
+        self.binds = []
+        self.results = {}
+        self.bound = True
+        self.pool_key = None
+        self.pool_expires = None
+        self.connect_kw = None
+
+    def match(self, filter, entry):
+        return True
+
+    def search_ext(self, base_dn, scope, filter, attrs_list,
+                   serverctrls=None, **kw):
+        self.searches.append((base_dn, scope, filter, serverctrls))
+        msgid = len(self.searches)
+        if scope == _ldap.SCOPE_BASE:
+            entries = [e for e in self.entries if e[0] == base_dn]
+            if not entries:
+                self.results[msgid] = _ldap.NO_SUCH_OBJECT(
+                    {'desc': 'No such object'})
+                return msgid
+        else:
+            entries = [e for e in self.entries
+                       if e[0].endswith(base_dn) and self.match(filter, e)]
+
+        res_ctrls = []
+        for ctrl in serverctrls or []:
+            if (ctrl.controlType == sort_request.controlType and
+                self.sort_result is not None):
+                if self.sort_result == 0:
+                    # sorts case-sensitively, unlike ldap2._sort_entries
+                    entries.sort(key=lambda e: e[1]['uid'][0])
+                res_ctrls.append(sort_response(self.sort_result))
+        for ctrl in serverctrls or []:
+            if (ctrl.controlType ==
+                ldap2_module.SimplePagedResultsControl.controlType):
+                start = int(ctrl.cookie or 0)
+                end = min(start + ctrl.size, len(entries))
+                cookie = ''
+                if end < len(entries):
+                    cookie = str(end)
+                res_ctrls.append(ldap2_module.SimplePagedResultsControl(
+                    False, size=ctrl.size, cookie=cookie))
+                entries = entries[start:end]
+        self.results[msgid] = (entries, res_ctrls)
+        return msgid
+
+    def search_s(self, base_dn, scope, filterstr='(objectClass=*)',
+                 attrlist=None):
+        self.searches.append((base_dn, scope, filterstr, None))
+        return [e for e in self.entries if e[0] == base_dn]
+
+    def result3(self, msgid, all=1):
+        if isinstance(self.results[msgid], _ldap.LDAPError):
+            raise self.results[msgid]
+        (entries, res_ctrls) = self.results[msgid]
+        if entries:
+            return (_ldap.RES_SEARCH_ENTRY, [entries.pop(0)], msgid, [])
+        return (_ldap.RES_SEARCH_RESULT, [], msgid, res_ctrls)
+
+    def result(self, msgid, all=1):
+        return self.result3(msgid, all)[:2]
+
+    def abandon(self, msgid):
+        pass
+
+    def modify_s(self, dn, modlist):
+        for (op, attr, values) in modlist:
+            for value in values:
+                if value in self.refused:
+                    raise self.refused[value]
+        self.modifications.append(modlist)
+
+    def whoami_s(self):
+        return 'dn: uid=admin'
+
+    def get_option(self, option):
+        return 56
+
+    def set_option(self, option, value):
+        pass
+
+    def simple_bind_s(self, bind_dn, bind_pw):
+        self.binds.append((bind_dn, bind_pw))
+
+    def unbind_s(self):
+        self.bound = False
+
+
+class LDAPTester(object):
+    """
+    Base class for tests of an ldap2 instance using a `FakeConnection`.
+    """
+
+    def setUp(self):
+        self.ldap = ldap2(shared_instance=False, ldap_uri='ldap://localhost')
+        setattr(context, 'config_entry', IPAConfigEntry(
+            {'ipasearchtimelimit': [2], 'ipasearchrecordslimit': [0]}))
+        self.controls = (ldap2_module.SimplePagedResultsControl,
+                         ldap2_module.SSSRequestControl,
+                         getattr(ldap2_module, 'SSSResponseControl', None))
+
+    def tearDown(self):
+        (ldap2_module.SimplePagedResultsControl,
+         ldap2_module.SSSRequestControl,
+         ldap2_module.SSSResponseControl) = self.controls
+        for name in (self.ldap.id, 'config_entry'):
+            if hasattr(context, name):
+                delattr(context, name)
+
+    def connect(self, entries=(), refused=None, ldap=None):
+        """
+        Use a `FakeConnection` as the connection of ``ldap``, by default
+        the ldap2 instance of the test.
+        """
+        if ldap is None:
+            ldap = self.ldap
+        conn = FakeConnection(entries=entries, refused=refused)
+        setattr(context, ldap.id, Connection(conn, lambda: None))
+        return conn
+
+    def sort(self, conn, sort_result):
+        """
+        Make the server sort the entries with result code ``sort_result``,
+        None if it does not support sorting.
+        """
+        ldap2_module.SSSRequestControl = sort_request
+        ldap2_module.SSSResponseControl = sort_response
+        conn.sort_result = sort_result
+
+
+class test_SchemaCache(object):
+    """
+    Test sharing the parsed LDAP schema between processes through a file.
+    """
+
+    url = 'ldap://ipa.example.com'
+    stamp = ('20130101000000Z', '50e2a5b0000000000000')
+
+    def setUp(self):
+        self.schema_dir = ldap2_module.SCHEMA_CACHE_DIR
+        self.version = ldap2_module.SCHEMA_CACHE_VERSION
+        self.tmpdir = tempfile.mkdtemp(prefix='ipa.tests.')
+        ldap2_module.SCHEMA_CACHE_DIR = self.tmpdir
+        self.cache = SchemaCache()
+        self.cache._use_schema_file = lambda: True
+        self.filename = self.cache._get_schema_file(self.url)
+
+    def tearDown(self):
+        ldap2_module.SCHEMA_CACHE_DIR = self.schema_dir
+        ldap2_module.SCHEMA_CACHE_VERSION = self.version
+        shutil.rmtree(self.tmpdir)
+
+    def connect(self):
+        return FakeConnection(self.url, [('cn=schema', {
+            'modifytimestamp': [self.stamp[0]],
+            'nsschemacsn': [self.stamp[1]],
+            'attributetypes': [], 'objectclasses': []})])
+
+    def retrieve(self):
+        """
+        Retrieve the schema, return the number of searches it took.
+        """
+        conn = self.connect()
+        schema = self.cache._retrieve_schema_from_server(self.url, conn)
+        assert schema is not None
+        return len(conn.searches)
+
+    def test_stamp(self):
+        """
+        Test that the stamp identifies the version of the server's schema
+        """
+        conn = self.connect()
+        assert self.cache._get_schema_stamp(conn) == self.stamp
+        conn.entries = []
+        assert self.cache._get_schema_stamp(conn) is None
+
+    def test_round_trip(self):
+        """
+        Test that a stored schema is read back
+        """
+        schema = {'attributetypes': ['( 2.5.4.3 NAME cn )']}
+        self.cache._write_schema_file(self.url, self.stamp, schema)
+        assert self.cache._read_schema_file(self.url, self.stamp) == schema
+
+        # A new process downloads the schema only once:
+        os.unlink(self.filename)
+        assert self.retrieve() == 2
+        assert os.path.isfile(self.filename)
+        assert self.retrieve() == 1
+
+    def test_mismatch(self):
+        """
+        Test that a schema stored for another version, URL or stamp is
+        not used
+        """
+        schema = {'attributetypes': []}
+        self.cache._write_schema_file(self.url, self.stamp, schema)
+        assert self.cache._read_schema_file(self.url, ('other', None)) is None
+
+        other_url = 'ldap://other.example.com'
+        os.rename(self.filename, self.cache._get_schema_file(other_url))
+        assert self.cache._read_schema_file(other_url, self.stamp) is None
+
+        self.cache._write_schema_file(self.url, self.stamp, schema)
+        ldap2_module.SCHEMA_CACHE_VERSION = self.version + 1
+        assert self.cache._read_schema_file(self.url, self.stamp) is None
+        assert self.retrieve() == 2
+
+    def test_corrupt(self):
+        """
+        Test that the schema is downloaded when the file is corrupt
+        """
+        open(self.filename, 'wb').write('not a pickle')
+        assert self.cache._read_schema_file(self.url, self.stamp) is None
+        assert self.retrieve() == 2
+        assert self.retrieve() == 1
+
+    def test_unreadable(self):
+        """
+        Test that the schema is downloaded when the file cannot be read
+        """
+        os.mkdir(self.filename)
+        assert self.cache._read_schema_file(self.url, self.stamp) is None
+        assert self.retrieve() == 2
+
+    def test_unwritable(self):
+        """
+        Test that failing to store the schema is not fatal
+        """
+        not_a_dir = os.path.join(self.tmpdir, 'file')
+        open(not_a_dir, 'w').close()
+        ldap2_module.SCHEMA_CACHE_DIR = not_a_dir
+        self.cache._write_schema_file(self.url, self.stamp, {})
+        assert os.listdir(self.tmpdir) == ['file']
+        assert self.retrieve() == 2
+        assert self.retrieve() == 2
+
+
+class test_IPAConfigEntry(object):
+    """
+    Test the read-only cached IPA config entry.
+    """
+
+    def test_read_only(self):
+        """
+        Test that the cached config entry cannot be modified
+        """
+        config = IPAConfigEntry({'ipauserobjectclasses': ['top', 'person']})
+        assert config['ipauserobjectclasses'] == ('top', 'person')
+        raises(TypeError, config.__setitem__, 'ipauserobjectclasses', [])
+        raises(TypeError, config.pop, 'ipauserobjectclasses')
+
+    def test_migration_objectclasses(self):
+        """
+        Test merging the migrated objectclasses with the cached config entry
+        """
+        config = IPAConfigEntry({'ipauserobjectclasses': ['top', 'person']})
+        user = api.Object.user
+        objectclasses = _merge_objectclasses(user, config,
+            ['Person', 'inetOrgPerson'])
+        assert sorted(objectclasses) == ['inetorgperson', 'person', 'top']
+        assert config['ipauserobjectclasses'] == ('top', 'person')
+
+        # Without the attribute in the config the defaults of the object
+        # are used:
+        objectclasses = _merge_objectclasses(user, IPAConfigEntry({}),
+            ['inetOrgPerson'])
+        assert sorted(objectclasses) == sorted(
+            set(user.object_class + ['inetorgperson']))
+
+
+class test_ConfigCache(object):
+    """
+    Test the IPA config entry cache shared by the requests of a process.
+    """
+
+    url = 'ldap://ipa.example.com'
+
+    def setUp(self):
+        self.stamp_dir = ldap2_module.CONFIG_STAMP_DIR
+        self.tmpdir = tempfile.mkdtemp(prefix='ipa.tests.')
+        ldap2_module.CONFIG_STAMP_DIR = self.tmpdir
+        self.config = IPAConfigEntry({'ipahomesrootdir': ['/home']})
+
+    def tearDown(self):
+        ldap2_module.CONFIG_STAMP_DIR = self.stamp_dir
+        shutil.rmtree(self.tmpdir)
+
+    def cache(self):
+        cache = ConfigCache()
+        cache.set_config(self.url, self.config, 60, cache.get_stamp(self.url))
+        return cache
+
+    def test_flush(self):
+        """
+        Test that a flush in one process invalidates the other processes
+        """
+        (cache, other) = (self.cache(), self.cache())
+        assert cache.get_config(self.url) is self.config
+        assert other.get_config(self.url) is self.config
+
+        cache.flush(self.url)
+        assert cache.get_config(self.url) is None
+        assert other.get_config(self.url) is None
+
+        other = self.cache()
+        assert other.get_config(self.url) is self.config
+        cache.flush(self.url)
+        assert other.get_config(self.url) is None
+
+    def test_expired(self):
+        """
+        Test that the cached config entry expires
+        """
+        cache = ConfigCache()
+        cache.set_config(self.url, self.config, 0, cache.get_stamp(self.url))
+        assert cache.get_config(self.url) is None
+
+    def test_unwritable(self):
+        """
+        Test that a flush does not fail without the stamp directory
+        """
+        ldap2_module.CONFIG_STAMP_DIR = os.path.join(self.tmpdir, 'missing')
+        cache = self.cache()
+        cache.flush(self.url)
+        assert cache.get_config(self.url) is None
+
+
+class test_LDAPConnectionPool(object):
+    """
+    Test the pool of bound LDAP connections.
+    """
+
+    def connection(self, pool_expires):
+        conn = FakeConnection('ldap://ipa.example.com')
+        conn.pool_expires = pool_expires
+        return conn
+
+    def test_reuse(self):
+        """
+        Test that idle connections are reused under the same key only
+        """
+        pool = LDAPConnectionPool()
+        conn = self.connection(time.time() + 3600)
+        pool.put_connection('key', conn)
+        assert pool.get_connection('other') is None
+        assert pool.get_connection('key') is conn
+        assert pool.get_connection('key') is None
+        assert conn.bound
+
+    def test_expired(self):
+        """
+        Test that connections are not reused after their credentials expired
+        """
+        pool = LDAPConnectionPool()
+        conn = self.connection(time.time() - 1)
+        pool.put_connection('key', conn)
+        assert not conn.bound
+        assert pool.get_connection('key') is None
+
+        conn = self.connection(time.time() + 3600)
+        pool.put_connection('key', conn)
+        conn.pool_expires = time.time() - 1
+        assert pool.get_connection('key') is None
+        assert not conn.bound
+        assert pool.count == 0
+
+
+class test_simple_bind_handles(object):
+    """
+    Test that the password of a simple bind is not kept for handles.
+    """
+
+    def setUp(self):
+        self.ldap_object = ldap2_module.IPASimpleLDAPObject
+        ldap2_module.IPASimpleLDAPObject = FakeConnection
+        self.ldap = ldap2(shared_instance=False, ldap_uri='ldap://localhost')
+        self.bind_dn = DN(('cn', 'directory manager'))
+        self.ldap.connect(bind_dn=self.bind_dn, bind_pw='secret')
+
+    def tearDown(self):
+        ldap2_module.IPASimpleLDAPObject = self.ldap_object
+        self.ldap.disconnect()
+
+    def test_connect_kw(self):
+        """
+        Test that the connection does not keep the password
+        """
+        assert 'bind_pw' not in self.ldap.conn.connect_kw
+        assert self.ldap.conn.binds == [(self.bind_dn, 'secret')]
+
+    def test_create_handle(self):
+        """
+        Test that a handle binds with a password supplied again
+        """
+        raises(ValueError, self.ldap.create_handle)
+        handle = self.ldap.create_handle(bind_pw='secret')
+        assert handle.isconnected()
+        assert handle.conn.binds == [(self.bind_dn, 'secret')]
+        assert 'secret' not in handle.connect_kw.values()
+        handle.disconnect()
+        raises(ValueError, handle.connect)
+
+
+class test_group_members(LDAPTester):
+    """
+    Test adding and removing group members in bulk.
+    """
+
+    def setUp(self):
+        super(test_group_members, self).setUp()
+        self.group_dn = DN(('cn', 'group'), api.env.basedn)
+        self.members = [DN(('uid', 'user%d' % i), api.env.basedn)
+                        for i in xrange(3)]
+
+    def connect(self, members, refused=None):
+        entries = [(dn, {'objectclass': ['top']}) for dn in members]
+        return super(test_group_members, self).connect(entries, refused)
+
+    def test_add(self):
+        """
+        Test that members are added with a single modification
+        """
+        conn = self.connect(self.members)
+        failed = self.ldap.add_entries_to_group(self.members, self.group_dn)
+        assert failed == []
+        assert [s[0] for s in conn.searches] == self.members
+        assert conn.modifications == [
+            [(_ldap.MOD_ADD, 'member', self.members)]]
+
+    def test_add_missing(self):
+        """
+        Test that members which do not exist are not added
+        """
+        conn = self.connect(self.members[1:])
+        failed = self.ldap.add_entries_to_group(self.members, self.group_dn)
+        assert [dn for (dn, e) in failed] == self.members[:1]
+        assert isinstance(failed[0][1], errors.NotFound)
+        assert conn.modifications == [
+            [(_ldap.MOD_ADD, 'member', self.members[1:])]]
+
+    def test_add_refused(self):
+        """
+        Test that a member refused by the server does not fail the others
+        """
+        conn = self.connect(self.members, {
+            self.members[0]: _ldap.TYPE_OR_VALUE_EXISTS({'desc': 'exists'}),
+            self.members[1]: _ldap.INSUFFICIENT_ACCESS(
+                {'desc': 'Insufficient access', 'info': 'no'}),
+        })
+        failed = self.ldap.add_entries_to_group(self.members, self.group_dn)
+        assert [dn for (dn, e) in failed] == self.members[:2]
+        assert isinstance(failed[0][1], errors.AlreadyGroupMember)
+        assert isinstance(failed[1][1], errors.ACIError)
+        assert conn.modifications == [
+            [(_ldap.MOD_ADD, 'member', self.members[2:])]]
+
+    def test_remove_refused(self):
+        """
+        Test that a member refused by the server does not fail the others
+        """
+        conn = self.connect(self.members, {
+            self.members[2]: _ldap.NO_SUCH_ATTRIBUTE({'desc': 'no value'}),
+        })
+        failed = self.ldap.remove_entries_from_group(self.members,
+            self.group_dn)
+        assert [dn for (dn, e) in failed] == self.members[2:]
+        assert isinstance(failed[0][1], errors.NotGroupMember)
+        assert conn.modifications == [
+            [(_ldap.MOD_DELETE, 'member', [dn])] for dn in self.members[:2]]
+
+
+class test_get_members(LDAPTester):
+    """
+    Test resolving the nested members of a group.
+    """
+
+    def setUp(self):
+        super(test_get_members, self).setUp()
+        groups_dn = DN(api.env.container_group, api.env.basedn)
+        self.group_dn = DN(('cn', 'group'), groups_dn)
+        self.nested_dn = DN(('cn', 'nested'), groups_dn)
+        self.users = [DN(('uid', 'user%d' % i), api.env.container_user,
+                         api.env.basedn) for i in xrange(3)]
+        self.host = DN(('fqdn', 'host.example.com'), api.env.container_host,
+                       api.env.basedn)
+
+    def test_users_and_hosts(self):
+        """
+        Test that no search is needed when no member can be nested
+        """
+        conn = self.connect()
+        members = self.ldap.get_members(self.group_dn,
+            self.users + [self.host], membertype=MEMBERS_ALL)
+        assert sorted(members) == sorted(self.users + [self.host])
+        assert conn.searches == []
+
+    def test_nested(self):
+        """
+        Test that nested members are resolved with a single search
+        """
+        conn = self.connect([
+            (self.nested_dn, {'memberof': [self.group_dn],
+                              'member': self.users[1:]}),
+        ])
+        conn.match = lambda filter, entry: 'member' in entry[1]
+        members = self.ldap.get_members(self.group_dn,
+            [self.users[0], self.nested_dn], membertype=MEMBERS_ALL)
+        assert sorted(members) == sorted(self.users + [self.nested_dn])
+        assert len(conn.searches) == 1
+        assert conn.searches[0][1] == _ldap.SCOPE_SUBTREE
+
+
+class test_paged_search(LDAPTester):
+    """
+    Test searches split into pages with the Simple Paged Results control.
+    """
+
+    def setUp(self):
+        super(test_paged_search, self).setUp()
+        self.container_dn = DN(('cn', 'examples'), api.env.basedn)
+        self.entries = [(DN(('uid', 'user%d' % i), self.container_dn),
+                         {'uid': ['user%d' % i]}) for i in xrange(5)]
+        self.conn = self.connect(self.entries)
+
+    def serverctrls(self):
+        """
+        Return the types of the controls sent with each search.
+        """
+        return [[c.controlType for c in s[3] or []]
+                for s in self.conn.searches]
+
+    def sort(self, sort_result):
+        super(test_paged_search, self).sort(self.conn, sort_result)
+        uids = ['user3', 'User1', 'user4', 'user0', 'User2']
+        self.conn.entries = [(DN(('uid', uid), self.container_dn),
+                              {'uid': [uid]}) for uid in uids]
+
+    def test_iter_entries(self):
+        """
+        Test that the entries are retrieved page by page
+        """
+        entries = list(self.ldap.iter_entries(page_size=2))
+        assert entries == self.entries
+        assert len(self.conn.searches) == 3
+
+    def test_without_control(self):
+        """
+        Test that a search is not paged without the paged results control
+        """
+        ldap2_module.SimplePagedResultsControl = None
+        entries = list(self.ldap.iter_entries(page_size=2))
+        assert entries == self.entries
+        assert self.conn.searches[0][3] is None
+        (entries, truncated) = self.ldap.find_entries(paged_search=True)
+        assert entries == self.entries
+        assert truncated is False
+
+    def test_server_sort(self):
+        """
+        Test that a paged search is sorted by the server
+        """
+        self.sort(0)
+        paged = ldap2_module.SimplePagedResultsControl.controlType
+        (entries, truncated) = self.ldap.find_entries(paged_search=True,
+                                                      sort_keys=['uid'])
+        assert [e[1]['uid'][0] for e in entries] == \
+            ['User1', 'User2', 'user0', 'user3', 'user4']
+        assert truncated is False
+        assert self.serverctrls() == [[sort_request.controlType, paged]]
+        assert self.conn.searches[0][3][0].ordering_rules == ['uid']
+
+        entries = list(self.ldap.iter_entries(page_size=2, sort_keys=['uid']))
+        assert [e[1]['uid'][0] for e in entries] == \
+            ['User1', 'User2', 'user0', 'user3', 'user4']
+        assert self.serverctrls()[1:] == [[sort_request.controlType, paged]] * 3
+
+    def test_server_sort_failed(self):
+        """
+        Test that a paged search is sorted here if the server did not sort it
+        """
+        self.sort(53)
+        (entries, truncated) = self.ldap.find_entries(paged_search=True,
+                                                      sort_keys=['uid'])
+        assert [e[1]['uid'][0] for e in entries] == \
+            ['user0', 'User1', 'User2', 'user3', 'user4']
+
+        self.sort(None)
+        (entries, truncated) = self.ldap.find_entries(paged_search=True,
+                                                      sort_keys=['uid'])
+        assert [e[1]['uid'][0] for e in entries] == \
+            ['user0', 'User1', 'User2', 'user3', 'user4']
+
+    def test_ldap_search(self):
+        """
+        Test that LDAPSearch sorts a paged search unless an offset is given
+        """
+        (api, home) = create_test_api(in_server=True)
+        class example(LDAPObject):
+            container_dn = DN(('cn', 'examples'))
+            object_class = ['top']
+            search_attributes = ['uid']
+            default_attributes = ['uid']
+            takes_params = (Str('uid', primary_key=True),)
+        class example_find(LDAPSearch):
+            pass
+        api.register(example)
+        api.register(example_find)
+        api.register(ldap2)
+        api.finalize()
+        self.conn = self.connect(ldap=api.Backend.ldap2)
+        try:
+            self.sort(0)
+            result = api.Command.example_find(u'')
+            assert [e['uid'][0] for e in result['result']] == \
+                ['User1', 'User2', 'user0', 'user3', 'user4']
+            assert self.serverctrls() == [[sort_request.controlType,
+                ldap2_module.SimplePagedResultsControl.controlType]]
+
+            self.sort(None)
+            del self.conn.searches[:]
+            ldap2_module.SSSRequestControl = None
+
+            result = api.Command.example_find(u'')
+            assert [e['uid'][0] for e in result['result']] == \
+                ['user0', 'User1', 'User2', 'user3', 'user4']
+
+            result = api.Command.example_find(u'', offset=1, sizelimit=2)
+            assert [e['uid'][0] for e in result['result']] == \
+                ['User1', 'User2']
+            assert result['truncated'] is True
+            assert self.conn.searches[1][3] is None
+        finally:
+            delattr(context, api.Backend.ldap2.id)
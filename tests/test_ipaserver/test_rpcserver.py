@@ -26,6 +26,8 @@ from tests.data import unicode_str
 from ipalib import errors, Command
 from ipaserver import rpcserver
 from ipapython.compat import json
+from ipapython.dn import DN
+from decimal import Decimal
 
 
 class StartResponse(object):
@@ -122,6 +124,37 @@ def test_params_2_args_options():
     assert f([args, options]) == (args, options)
 
 
+def test_json_iterencode():
+    """
+    Test the `ipaserver.rpcserver.json_iterencode` function.
+    """
+    f = rpcserver.json_iterencode
+    entry = dict(
+        uid=[u'jdoe'], cn=(u'John Doe',), usercertificate=['\x00\xff'],
+        manager=[DN(('uid', 'admin'), ('dc', 'example'))],
+        uidnumber=[1000], nsaccountlock=False, description=None,
+        limit=Decimal('1.5'), memberof=[], ipauniqueid={},
+    )
+    val = dict(result=dict(result=[entry] * 5000, count=5000), error=None)
+
+    # The output matches encoding a json_encode_binary copy:
+    chunks = list(f(val))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == json.dumps(
+        rpcserver.json_encode_binary(val), sort_keys=True
+    )
+
+    # Pretty-printed output decodes to the same value:
+    pretty = ''.join(f(val, indent=4))
+    assert pretty.startswith('{\n    "error": null,\n')
+    assert json.loads(pretty) == json.loads(''.join(chunks))
+
+    # Values which cannot be encoded raise TypeError before any output is
+    # generated:
+    raises(TypeError, f, dict(result=object()))
+    raises(TypeError, f, dict(result=[{object(): u'x'}]))
+
+
 class test_session(object):
     klass = rpcserver.wsgi_dispatch
 
@@ -244,3 +277,46 @@ class test_jsonserver(PluginTester):
         options = dict(givenname=u'John', sn='Doe')
         d = dict(method=u'user_add', params=[args, options], id=18)
         assert o.unmarshal(json.dumps(d)) == (u'user_add', args, options, 18)
+
+        # Test with binary values:
+        args = [u'jdoe', {'__base64__': 'AP8='}]
+        options = dict(usercertificate=[{'__base64__': 'AA=='}], sn=u'D\xf6e')
+        d = dict(method=u'user_add', params=[args, options], id=18)
+        (name, args, options, _id) = o.unmarshal(json.dumps(d))
+        assert args == [u'jdoe', '\x00\xff']
+        assert options == dict(usercertificate=['\x00'], sn=u'D\xf6e')
+        assert type(options['sn']) is unicode
+
+        # Test with invalid binary values:
+        d = dict(method=u'user_add', params=[[{'__base64__': 'A'}], {}], id=18)
+        e = raises(errors.JSONError, o.unmarshal, json.dumps(d))
+        assert unicode(e.error).startswith('invalid __base64__ value')
+
+    def test_marshal(self):
+        """
+        Test the `ipaserver.rpcserver.jsonserver.marshal` method.
+        """
+        (o, api, home) = self.instance('Backend', in_server=True)
+
+        result = dict(result=dict(uid=[u'jdoe'], data=['\x00']), value=u'jdoe')
+        d = json.loads(''.join(o.marshal(result, None, 18)))
+        assert d['id'] == 18
+        assert d['error'] is None
+        assert d['result'] == dict(
+            result=dict(uid=[u'jdoe'], data=[{u'__base64__': u'AA=='}]),
+            value=u'jdoe',
+        )
+
+        d = json.loads(''.join(o.marshal(None, errors.NotFound(reason=u'x'))))
+        assert d['result'] is None
+        # The name is a str, so it is sent base64 encoded like any other
+        # binary value:
+        assert d['error'] == dict(code=4001, message=u'x',
+            name={u'__base64__': u'Tm90Rm91bmQ='})
+
+        # A result which cannot be encoded is turned into an InternalError
+        # before the response is started:
+        d = json.loads(''.join(o.marshal(dict(result=object()), None, 19)))
+        assert d['id'] == 19
+        assert d['result'] is None
+        assert d['error']['code'] == errors.InternalError.errno
@@ -77,6 +77,27 @@ class test_batch(Declarative):
             ),
         ),
 
+        dict(
+            desc='Batch pings and a bad command in parallel',
+            command=('batch', [
+                dict(method='ping', params=([], {})),
+                dict(method='nonexistent_ipa_command', params=([], dict())),
+                dict(method='ping', params=([], {})),
+            ], dict(parallel=True)),
+            expected=dict(
+                count=3,
+                results=deepequal_list(
+                    dict(summary=Fuzzy('IPA server version .*'), error=None),
+                    dict(
+                        error=u"unknown command 'nonexistent_ipa_command'",
+                        error_name=u'CommandError',
+                        error_code=905,
+                    ),
+                    dict(summary=Fuzzy('IPA server version .*'), error=None),
+                ),
+            ),
+        ),
+
         dict(
             desc='Create and deleting a group',
             command=('batch', [
@@ -490,6 +490,32 @@ class test_group(Declarative):
             ),
         ),
 
+        dict(
+            desc='Try to add existing and non-existent members to %r' % group1,
+            command=(
+                'group_add_member', [group1], dict(group=[group2, u'notfound'])
+            ),
+            expected=dict(
+                completed=0,
+                failed=dict(
+                    member=dict(
+                        group=[
+                            (group2, u'This entry is already a member'),
+                            (u'notfound', u'no such entry'),
+                        ],
+                        user=tuple(),
+                    ),
+                ),
+                result={
+                        'dn': get_group_dn(group1),
+                        'member_group': (group2,),
+                        'gidnumber': [fuzzy_digits],
+                        'cn': [group1],
+                        'description': [u'New desc 1'],
+                },
+            ),
+        ),
+
         dict(
             desc='Remove member %r from %r' % (group2, group1),
             command=('group_remove_member',
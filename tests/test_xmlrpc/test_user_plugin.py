@@ -328,6 +328,35 @@ class test_user(Declarative):
         ),
 
 
+        dict(
+            desc='Search for all users with an offset of 1 and a limit of 1',
+            command=(
+                'user_find', [], dict(offset=1, sizelimit=1,),
+            ),
+            expected=dict(
+                result=[
+                    dict(
+                        dn=get_user_dn(user1),
+                        givenname=[u'Test'],
+                        homedirectory=[u'/home/tuser1'],
+                        loginshell=[u'/bin/sh'],
+                        sn=[u'User1'],
+                        uid=[user1],
+                        nsaccountlock=False,
+                        has_keytab=False,
+                        has_password=False,
+                        uidnumber=[fuzzy_digits],
+                        gidnumber=[fuzzy_digits],
+                        mail=[u'%s@%s' % (user1, api.env.domain)],
+                    ),
+                ],
+                summary=u'1 user matched',
+                count=1,
+                truncated=False,
+            ),
+        ),
+
+
         dict(
             desc='Disable "%s"' % user1,
             command=(